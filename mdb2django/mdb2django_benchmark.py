@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the conversion hot paths without a JVM
+
+Synthetic MDB schemas are served by a pure-Python fake of the Jackcess
+``Database``, ``Table``, ``Column`` and ``Index`` objects.  Rows are
+generated on the fly, so scenarios with millions of rows don't need
+the memory to hold them.
+
+Each benchmark runs in a child process of its own where available, so
+the peak memory reported is that of the single benchmark.  Results can
+be saved as a baseline and later runs compared against it::
+
+    python mdb2django_benchmark.py --save-baseline baseline.json
+    python mdb2django_benchmark.py --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import traceback
+
+from mdb2django_schema import DatabaseWrapper, DependencyGraph, MEMO_LENGTH
+from mdb2django_jet4 import Row, RowValues
+
+SCENARIOS = {
+    'many-tables': dict(tables=2000, columns=8, rows=20),
+    'wide-rows': dict(tables=10, columns=200, rows=5000),
+    'many-rows': dict(tables=2, columns=10, rows=1000000)}
+
+COLUMN_TYPES = [(u'TEXT', 50), (u'LONG', 4), (u'SHORT_DATE_TIME', 8),
+                (u'TEXT', MEMO_LENGTH), (u'BOOLEAN', 1), (u'INT', 2)]
+
+TEXT_SAMPLES = [u'plain text', u'caf\xe9 "quoted"', u'tab\there',
+                u'two\r\nlines', None]
+
+DATE_BASE_MILLIS = 946684800000
+
+class FakeType(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+class FakeColumn(object):
+    def __init__(self, name, type_name, length, columnIndex):
+        self.name = name
+        self.type = FakeType(type_name)
+        self.length = length
+        self.columnIndex = columnIndex
+
+class FakeIndex(object):
+    def __init__(self, columns, primary_key=False, unique=False):
+        self.columns = columns
+        self.primary_key = primary_key
+        self.unique = unique
+
+    def isPrimaryKey(self):
+        return self.primary_key
+
+    def isUnique(self):
+        return self.unique or self.primary_key
+
+class FakeDate(object):
+    "A Java date giving milliseconds since the epoch"
+    def __init__(self, millis):
+        self.millis = millis
+
+    def getTime(self):
+        return self.millis
+
+    def __repr__(self):
+        return 'FakeDate(%d)' % self.millis
+
+def value_generator(type_name, length, nth):
+    "Return a function giving the value of a column in row `index`"
+    if type_name == u'TEXT':
+        return lambda index: TEXT_SAMPLES[(index + nth) % len(TEXT_SAMPLES)]
+    if type_name == u'LONG':
+        return lambda index: index * 7 + nth
+    if type_name == u'INT':
+        return lambda index: (index + nth) % 32768
+    if type_name == u'BOOLEAN':
+        return lambda index: bool((index + nth) & 1)
+    if type_name == u'SHORT_DATE_TIME':
+        def date_value(index):
+            if (index + nth) % 7 == 0:
+                return None
+            return FakeDate(DATE_BASE_MILLIS + index * 3600000)
+        return date_value
+    raise ValueError('no generator for %s columns' % type_name)
+
+class FakeTable(object):
+    """A table with rows computed from their index
+
+    `columns` is a list of (name, type name, length, value function)
+    tuples.
+    """
+    def __init__(self, name, columns, row_count):
+        self.name = name
+        self.columns = [FakeColumn(column_name, type_name, length, index)
+                        for index, (column_name, type_name, length, value)
+                        in enumerate(columns)]
+        self.column_indexes = dict((column.name, column.columnIndex)
+                                   for column in self.columns)
+        self.value_functions = [value for name, type_name, length, value
+                                in columns]
+        self.row_count = row_count
+        self.indexes = []
+        self._position = 0
+
+    def getColumns(self):
+        return self.columns
+
+    def getColumn(self, column_name):
+        return self.columns[self.column_indexes[column_name]]
+
+    def getRowCount(self):
+        return self.row_count
+
+    def reset(self):
+        self._position = 0
+
+    def make_row(self, index):
+        return Row(self, RowValues([value(index)
+                                    for value in self.value_functions]))
+
+    def getNextRow(self):
+        if self._position >= self.row_count:
+            return None
+        self._position += 1
+        return self.make_row(self._position - 1)
+
+class FakeCursor(object):
+    def __init__(self, table):
+        self.table = table
+        self.position = 0
+
+    def skipNextRows(self, count):
+        skipped = min(count, self.table.row_count - self.position)
+        self.position += skipped
+        return skipped
+
+    def getNextRow(self):
+        if self.position >= self.table.row_count:
+            return None
+        self.position += 1
+        return self.table.make_row(self.position - 1)
+
+class FakeDatabase(object):
+    def __init__(self, tables, system_tables):
+        self.tables = dict((table.name, table) for table in tables)
+        self.table_names = [table.name for table in tables]
+        self.system_tables = dict((table.name, table)
+                                  for table in system_tables)
+
+    def getTableNames(self):
+        return self.table_names
+
+    def getTable(self, table_name):
+        return self.tables.get(table_name)
+
+    def getSystemTable(self, table_name):
+        return self.system_tables.get(table_name)
+
+    def createCursor(self, table):
+        return FakeCursor(table)
+
+def make_database(tables, columns, rows):
+    """Generate a database with a synthetic schema
+
+    Every table has an ``id`` primary key and `columns` columns in
+    total.  Each table after the first one has a foreign key to an
+    earlier table, so the relationships form a binary tree.
+    """
+    fake_tables = []
+    relationships = []
+    for number in xrange(tables):
+        name = u'Table%05d' % number
+        table_columns = [(u'id', u'LONG', 4, lambda index: index + 1)]
+        parent = None
+        if number:
+            parent = fake_tables[(number - 1) // 2]
+            table_columns.append(
+                (u'%s_id' % parent.name, u'LONG', 4,
+                 lambda index, parent_rows=parent.row_count:
+                     index % max(parent_rows, 1) + 1))
+        for nth in xrange(columns - len(table_columns)):
+            type_name, length = COLUMN_TYPES[nth % len(COLUMN_TYPES)]
+            table_columns.append(
+                (u'%s%d' % (type_name.lower(), nth), type_name, length,
+                 value_generator(type_name, length, nth)))
+        table = FakeTable(name, table_columns, rows)
+        table.indexes.append(FakeIndex(table.columns[:1], primary_key=True))
+        if parent is not None:
+            table.indexes.append(FakeIndex(table.columns[1:2]))
+            relationships.append(
+                [u'%s_%s' % (parent.name, name), parent.name, name, 0,
+                 u'id', table.columns[1].name])
+        fake_tables.append(table)
+    catalog = FakeTable(
+        u'MSysRelationships',
+        [(name, u'TEXT', 50,
+          lambda index, position=position: relationships[index][position])
+         for position, name in enumerate([u'szRelationship',
+                                          u'szReferencedObject', u'szObject',
+                                          u'icolumn', u'szReferencedColumn',
+                                          u'szColumn'])],
+        len(relationships))
+    # list the referencing tables first to give the ordering some work
+    return FakeDatabase(fake_tables[::-1], [catalog])
+
+def consume(lines):
+    "Exhaust an output generator and return the number of bytes output"
+    return sum(len(line) + 1 for line in lines)
+
+def warm_schema(dbwrapper):
+    dbwrapper.get_relationships()
+    dbwrapper.ordered_models
+
+def build_relationships(dbwrapper):
+    dbwrapper.get_relationships()
+    return 0
+
+def order_models(dbwrapper):
+    DependencyGraph(dbwrapper.models, dbwrapper.relationships.values())
+    return 0
+
+BENCHMARKS = [
+    # name, untimed setup, timed run giving the output size, whether
+    # it reads the rows
+    ('get_relationships', lambda d: d.models, build_relationships, False),
+    ('order_models', build_relationships, order_models, False),
+    ('output_models', lambda d: None,
+     lambda d: consume(d.output_models()), False),
+    ('output_admin', lambda d: None,
+     lambda d: consume(d.output_admin()), False),
+    ('output_fixture', warm_schema,
+     lambda d: consume(d.output_fixture()), True),
+    ('output_postgresql', warm_schema,
+     lambda d: consume(d.output_postgresql()), True)]
+
+def peak_memory_kib():
+    "Return the peak resident memory of this process in KiB, if known"
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # reported in bytes
+        peak //= 1024
+    return peak
+
+def run_benchmark(settings, benchmark):
+    name, setup, run, reads_rows = benchmark
+    dbwrapper = DatabaseWrapper(make_database(**settings))
+    setup(dbwrapper)
+    start = time.time()
+    output_bytes = run(dbwrapper)
+    seconds = time.time() - start
+    result = dict(seconds=seconds,
+                  bytes=output_bytes,
+                  peak_memory_kib=peak_memory_kib())
+    if reads_rows:
+        rows = settings['tables'] * settings['rows']
+        result.update(rows=rows, rows_per_second=rows / max(seconds, 1e-9))
+    return result
+
+def run_isolated(function, *args):
+    """Call a function in a child process and return its JSON result
+
+    Falls back to calling it directly where processes can't be forked.
+    """
+    if not hasattr(os, 'fork'):
+        return function(*args)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            output = json.dumps(dict(result=function(*args)))
+        except:
+            output = json.dumps(dict(error=traceback.format_exc()))
+        os.write(write_fd, output)
+        os._exit(0)
+    os.close(write_fd)
+    parts = []
+    while True:
+        data = os.read(read_fd, 65536)
+        if not data:
+            break
+        parts.append(data)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    response = json.loads(''.join(parts))
+    if 'error' in response:
+        raise RuntimeError('benchmark failed:\n%s' % response['error'])
+    return response['result']
+
+def scaled(settings, scale):
+    return dict((key, max(1, int(value * scale)) if key != 'columns'
+                 else value)
+                for key, value in settings.iteritems())
+
+def run_benchmarks(scenario_names, benchmark_names, scale=1.0, report=None):
+    """Run benchmarks and return their results by 'scenario/benchmark'"""
+    results = {}
+    for scenario_name in scenario_names:
+        settings = scaled(SCENARIOS[scenario_name], scale)
+        for benchmark in BENCHMARKS:
+            if benchmark[0] not in benchmark_names:
+                continue
+            key = '%s/%s' % (scenario_name, benchmark[0])
+            results[key] = run_isolated(run_benchmark, settings, benchmark)
+            if report:
+                report(key, results[key])
+    return results
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline
+
+    Returns a list of (key, time ratio) tuples for the benchmarks which
+    took more than 1 + `tolerance` times their baseline time.
+    """
+    slower = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key]['seconds'] / max(baseline[key]['seconds'], 1e-9)
+        if ratio > 1.0 + tolerance:
+            slower.append((key, ratio))
+    return slower
+
+def format_result(key, result, baseline=None):
+    line = '%-36s %9.3f s' % (key, result['seconds'])
+    if 'rows_per_second' in result:
+        line += ' %12.0f rows/s' % result['rows_per_second']
+    else:
+        line += ' %19s' % ''
+    if result['peak_memory_kib'] is not None:
+        line += ' %8.1f MiB' % (result['peak_memory_kib'] / 1024.0)
+    if baseline and key in baseline:
+        line += ' %+6.1f%%' % (100.0 * (result['seconds'] /
+                                        max(baseline[key]['seconds'], 1e-9)
+                                        - 1.0))
+    return line
+
+def make_option_parser():
+    from optparse import OptionParser
+    p = OptionParser()
+    p.add_option('-s', '--scenario', action='append',
+                 choices=sorted(SCENARIOS),
+                 help='scenario to run, can be repeated (default: all)')
+    p.add_option('-b', '--benchmark', action='append',
+                 choices=[benchmark[0] for benchmark in BENCHMARKS],
+                 help='benchmark to run, can be repeated (default: all)')
+    p.add_option('--scale', action='store', type='float', default=1.0,
+                 help='multiply the table and row counts of the scenarios')
+    p.add_option('--baseline', action='store',
+                 help='compare the results with this baseline file')
+    p.add_option('--save-baseline', action='store',
+                 help='save the results as a baseline file')
+    p.add_option('--tolerance', action='store', type='float', default=0.25,
+                 help='fail if a benchmark is slower than its baseline '
+                      'by more than this fraction')
+    return p
+
+def main(argv):
+    opts, args = make_option_parser().parse_args(argv)
+    baseline = None
+    if opts.baseline:
+        baseline = json.load(file(opts.baseline))
+    def report(key, result):
+        print format_result(key, result, baseline)
+        sys.stdout.flush()
+    results = run_benchmarks(
+        opts.scenario or sorted(SCENARIOS),
+        opts.benchmark or [benchmark[0] for benchmark in BENCHMARKS],
+        opts.scale, report)
+    if opts.save_baseline:
+        output = file(opts.save_baseline, 'w')
+        try:
+            json.dump(results, output, indent=1, sort_keys=True)
+        finally:
+            output.close()
+    if baseline:
+        slower = compare(results, baseline, opts.tolerance)
+        for key, ratio in slower:
+            print '%s is %.0f%% slower than the baseline' % (
+                key, 100.0 * (ratio - 1.0))
+        if slower:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,183 @@
+"""
+Convert row batches column by column with `NumPy`_
+
+A batch of rows, as returned by ``RowFetcher``, is turned into one
+`ColumnArray` per column: ``INT`` and ``LONG`` values become int64
+arrays, ``BOOLEAN`` values bool arrays and ``SHORT_DATE_TIME`` values
+datetime64 arrays of the local time, each with a mask of the null
+values.  These arrays are formatted as JSON, COPY text or PGCOPY
+binary fields with vectorized operations.  Other columns, and all
+columns when a custom conversion is used, are converted value by value
+with the converters of ``ValueConversion.plan``.
+
+`read_columns` and `format_columns` are separate, so the arrays read
+from a batch can be formatted for several outputs.  When the outputs
+share the scan of a table, a `ColumnCache` passes the arrays of the
+last batches read on to the other outputs.
+
+.. _NumPy: http://numpy.scipy.org/
+"""
+
+import threading
+
+import numpy
+
+VECTOR_TYPES = {u'INT': 'int64',
+                u'LONG': 'int64',
+                u'BOOLEAN': 'bool',
+                u'SHORT_DATE_TIME': 'datetime64[ms]'}
+PG_EPOCH = numpy.datetime64('2000-01-01T00:00:00', 'us')
+CACHED_BATCHES = 4
+PGCOPY_NULL = '\xff\xff\xff\xff'
+PGCOPY_FIELDS = {'int64': [('size', '>i4'), ('value', '>i4')],
+                 'bool': [('size', '>i4'), ('value', '?')],
+                 'datetime64[ms]': [('size', '>i4'), ('value', '>i8')]}
+
+class ColumnArray(object):
+    "The values of a column in a batch of rows with their null mask"
+    __slots__ = ('dtype', 'data', 'mask')
+
+    def __init__(self, dtype, data, mask):
+        self.dtype = dtype
+        self.data = data
+        self.mask = mask
+
+def read_column(valueconversion, table_name, column, values, vectorize=True):
+    """Return a `ColumnArray` for the raw values of a column
+
+    Without `vectorize` the values are kept in an object array.
+    """
+    dtype = None
+    if vectorize:
+        dtype = VECTOR_TYPES.get(column.type.name())
+    count = len(values)
+    mask = numpy.fromiter((value is None for value in values), bool, count)
+    if dtype is None:
+        data = numpy.empty(count, object)
+        data[:] = values
+    elif dtype == 'datetime64[ms]':
+        local_millis = valueconversion.local_millis
+        data = numpy.fromiter((0 if value is None else local_millis(value)
+                               for value in values), 'int64', count
+                              ).astype(dtype)
+    else:
+        python_value = valueconversion.python_converter(table_name, column)
+        data = numpy.fromiter((0 if value is None else python_value(value)
+                               for value in values), dtype, count)
+    return ColumnArray(dtype, data, mask)
+
+def read_columns(valueconversion, table_name, columns, batch,
+                 vectorize=True):
+    "Return a `ColumnArray` for each column of a batch of rows"
+    return [read_column(valueconversion, table_name, column,
+                        [values[index] for values in batch], vectorize)
+            for index, column in enumerate(columns)]
+
+class ColumnCache(object):
+    """Read the columns of a batch once for several outputs
+
+    Calling the cache is like calling `read_columns`, but the arrays of
+    the last `size` batches are kept and returned again for the same
+    batch object.  The outputs of a shared scan convert the same
+    batches in step, so each batch is read once.  The arrays aren't
+    modified by formatting.
+    """
+    def __init__(self, read=read_columns, size=CACHED_BATCHES):
+        self.read = read
+        self.size = size
+        self.recent = []
+        self.lock = threading.Lock() # formatters may share the cache
+
+    def __call__(self, valueconversion, table_name, columns, batch,
+                 vectorize=True):
+        key = table_name, vectorize
+        self.lock.acquire()
+        try:
+            for recent_batch, recent_key, arrays in self.recent:
+                if recent_batch is batch and recent_key == key:
+                    return arrays
+        finally:
+            self.lock.release()
+        arrays = self.read(valueconversion, table_name, columns, batch,
+                           vectorize)
+        self.lock.acquire()
+        try:
+            # the batch is kept too, so its id can't be reused
+            self.recent.append((batch, key, arrays))
+            del self.recent[:-self.size]
+        finally:
+            self.lock.release()
+        return arrays
+
+def timestamp_text(data):
+    return numpy.char.replace(numpy.datetime_as_string(data, unit='s'),
+                              'T', ' ')
+
+def format_json(column):
+    if column.dtype == 'bool':
+        text = numpy.where(column.data, 'true', 'false')
+    elif column.dtype == 'datetime64[ms]':
+        text = numpy.char.add(numpy.char.add('"', timestamp_text(column.data)),
+                              '"')
+    else:
+        text = column.data.astype(str)
+    return numpy.where(column.mask, 'null', text).tolist()
+
+def format_pgcopy(column):
+    if column.dtype == 'bool':
+        text = numpy.where(column.data, 't', 'f')
+    elif column.dtype == 'datetime64[ms]':
+        text = timestamp_text(column.data)
+    else:
+        text = column.data.astype(str)
+    return numpy.where(column.mask, r'\N', text).tolist()
+
+def format_pgbinary(column):
+    fields = numpy.empty(len(column.data), PGCOPY_FIELDS[column.dtype])
+    fields['size'] = fields.dtype['value'].itemsize
+    if column.dtype == 'datetime64[ms]':
+        fields['value'] = (column.data.astype('datetime64[us]') - PG_EPOCH
+                           ).astype('int64')
+    else:
+        fields['value'] = column.data
+    data = fields.tostring()
+    size = fields.dtype.itemsize
+    return [(data[offset:offset + size], PGCOPY_NULL)[null]
+            for offset, null in zip(xrange(0, len(data), size),
+                                    column.mask.tolist())]
+
+FORMATTERS = {'json': format_json,
+              'pgcopy': format_pgcopy,
+              'pgbinary': format_pgbinary}
+
+def format_columns(kind, plan, columns):
+    """Format the `ColumnArray`s of a batch as lists of field values
+
+    `kind` is 'json', 'pgcopy' or 'pgbinary'.  Object columns are
+    converted with the corresponding converter from `plan`.
+    """
+    format_vector = FORMATTERS.get(kind)
+    return [format_vector(column) if column.dtype is not None
+            else map(convert, column.data.tolist())
+            for convert, column in zip(plan, columns)]
+
+def batch_converter(valueconversion, kind, table_name, columns,
+                    vectorize=True, read=read_columns):
+    """Return a function converting a batch of rows column by column
+
+    The function returns the converted rows as tuples.  Without
+    `vectorize`, e.g. for custom conversions, and for kinds without
+    vectorized formatting, every column is converted with the
+    converters of the plan.  The columns are read with `read`, e.g.
+    a `ColumnCache`.
+    """
+    plan = valueconversion.plan(kind, table_name, columns)
+    if kind not in FORMATTERS:
+        vectorize = False
+    def convert_batch(batch):
+        if not batch:
+            return []
+        return zip(*format_columns(
+            kind, plan, read(valueconversion, table_name, columns, batch,
+                             vectorize)))
+    return convert_batch
@@ -0,0 +1,606 @@
+"""
+Read Microsoft Access 2000 (Jet 4) .MDB files without a JVM
+
+This module implements the small part of the `Jackcess`_ API which
+``mdb2django_schema`` uses: table names, tables with their columns,
+indexes and rows, system tables and cursors.  The file is memory
+mapped and pages are decoded with `struct` only when a table is read.
+
+The page layout follows the format notes of the `mdbtools`_ project.
+Only reading is supported.  Dates are returned as naive
+`datetime.datetime` objects holding the wall-clock time stored in the
+file.
+
+.. _Jackcess: http://jackcess.sourceforge.net/
+.. _mdbtools: http://mdbtools.sourceforge.net/
+"""
+
+import mmap
+import zlib
+import struct
+import datetime
+import itertools
+from decimal import Decimal
+
+PAGE_SIZE = 4096
+JET_SIGNATURE = 'Standard Jet DB'
+VERSION_OFFSET = 0x14
+JET4_VERSION = 1
+
+PAGE_TYPE_DATA = 0x01
+PAGE_TYPE_TDEF = 0x02
+
+ROW_OFFSET_MASK = 0x1fff
+ROW_DELETED = 0x8000 # also set for overflow and long value rows
+ROW_OVERFLOW = 0x4000
+
+COLUMN_FIXED = 0x01
+INDEX_UNIQUE = 0x01
+INDEX_PRIMARY_KEY = 1
+UNUSED_INDEX_COLUMN = 0xffff
+
+LONG_VALUE_INLINE = 0x80000000
+LONG_VALUE_SINGLE_PAGE = 0x40000000
+LONG_VALUE_LENGTH_MASK = 0x3fffffff
+
+CATALOG_PAGE = 2
+OBJECT_TYPE_TABLE = 1
+OBJECT_TYPE_CONTAINER = 3
+SYSTEM_OBJECT_FLAGS = 0x80000002
+
+MILLIS_PER_DAY = 24 * 60 * 60 * 1000
+DATE_EPOCH = datetime.datetime(1899, 12, 30)
+
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+TDEF_COUNTS = struct.Struct('<HHIII')
+COLUMN_ENTRY = struct.Struct('<B4xHH2x4xH4xHH')
+COLUMN_ENTRY_SIZE = 25
+REAL_INDEX_ENTRY = struct.Struct('<4x' + 'HB' * 10 + '8xB9x')
+LOGICAL_INDEX_ENTRY = struct.Struct('<4xII11xB4x')
+MEMO_HEADER = struct.Struct('<II')
+
+class Jet4Error(ValueError):
+    "Raised for files and pages which this reader can't decode"
+
+class DataType(object):
+    "A column type named like the corresponding Jackcess ``DataType``"
+    def __init__(self, code, name):
+        self.code = code
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def __repr__(self):
+        return '<DataType %s>' % self._name
+
+DATA_TYPES = dict((code, DataType(code, name)) for code, name in (
+    (0x01, u'BOOLEAN'),
+    (0x02, u'BYTE'),
+    (0x03, u'INT'),
+    (0x04, u'LONG'),
+    (0x05, u'MONEY'),
+    (0x06, u'FLOAT'),
+    (0x07, u'DOUBLE'),
+    (0x08, u'SHORT_DATE_TIME'),
+    (0x09, u'BINARY'),
+    (0x0a, u'TEXT'),
+    (0x0b, u'OLE'),
+    (0x0c, u'MEMO'),
+    (0x0f, u'GUID'),
+    (0x10, u'NUMERIC')))
+
+def decode_text(data):
+    """Decode Jet 4 text, which may use the compressed unicode format
+
+    Compressed text starts with 0xff 0xfe.  A zero byte toggles between
+    one byte and two byte characters, starting with one byte ones.
+    """
+    if not data.startswith('\xff\xfe'):
+        return data.decode('utf-16-le')
+    segments = data[2:].split('\0')
+    for index in xrange(1, len(segments), 2):
+        # like Access, ignore a dangling byte of a two byte segment
+        segments[index] = segments[index][:len(segments[index]) & ~1]
+    return u''.join(segment.decode(('latin-1', 'utf-16-le')[index % 2])
+                    for index, segment in enumerate(segments))
+
+def decode_date(data):
+    """Convert a date double (days since 1899-12-30) to a `datetime`
+
+    For dates before 1899-12-30 the fraction is still the time of day,
+    e.g. -1.5 is noon on 1899-12-29.
+    """
+    value = struct.unpack('<d', data)[0]
+    days = int(value)
+    return DATE_EPOCH + datetime.timedelta(
+        days, 0, 0, int(round(abs(value - days) * MILLIS_PER_DAY)))
+
+def decode_guid(data):
+    return '{%08X-%04X-%04X-%02X%02X-%02X%02X%02X%02X%02X%02X}' % (
+        struct.unpack('<IHH8B', data))
+
+def numeric_decoder(scale):
+    "Return a function decoding 17-byte NUMERIC values to `Decimal`"
+    def decode_numeric(data):
+        value = 0
+        for word in struct.unpack('<4I', data[1:17]):
+            value = (value << 32) | word
+        if ord(data[0]) & 0x80:
+            value = -value
+        return Decimal(value).scaleb(-scale)
+    return decode_numeric
+
+FIXED_DECODERS = {
+    0x02: ord,
+    0x03: lambda data: struct.unpack('<h', data)[0],
+    0x04: lambda data: struct.unpack('<i', data)[0],
+    0x05: lambda data: Decimal(struct.unpack('<q', data)[0]).scaleb(-4),
+    0x06: lambda data: struct.unpack('<f', data)[0],
+    0x07: lambda data: struct.unpack('<d', data)[0],
+    0x08: decode_date,
+    0x09: bytearray,
+    0x0f: decode_guid}
+
+class Column(object):
+    def __init__(self, table, name, type_code, number, var_index,
+                 fixed_offset, length, flags, scale):
+        self.table = table
+        self.name = name
+        self.type = DATA_TYPES.get(type_code) or DataType(
+            type_code, u'UNKNOWN_%02X' % type_code)
+        self.number = number
+        self.var_index = var_index
+        self.fixed_offset = fixed_offset
+        self.length = length
+        self.fixed = bool(flags & COLUMN_FIXED)
+        self.scale = scale
+        self.columnIndex = None
+
+    def getName(self):
+        return self.name
+
+    def getType(self):
+        return self.type
+
+    def getLength(self):
+        return self.length
+
+    def decoder(self, database):
+        "Return a function converting the bytes of a value of this column"
+        code = self.type.code
+        if code == 0x0a:
+            return decode_text
+        if code == 0x0c:
+            return lambda data: decode_text(database.read_long_value(data))
+        if code == 0x0b:
+            return lambda data: bytearray(database.read_long_value(data))
+        if code == 0x10:
+            return numeric_decoder(self.scale)
+        return FIXED_DECODERS.get(code, bytearray)
+
+    def __repr__(self):
+        return '<Column %s.%s>' % (self.table.name, self.name)
+
+class Index(object):
+    def __init__(self, name, columns, primary_key, unique):
+        self.name = name
+        self.columns = columns
+        self.primary_key = primary_key
+        self.unique = unique
+
+    def getName(self):
+        return self.name
+
+    def getColumns(self):
+        return self.columns
+
+    def isPrimaryKey(self):
+        return self.primary_key
+
+    def isUnique(self):
+        return self.unique or self.primary_key
+
+    def __repr__(self):
+        return '<Index %s>' % self.name
+
+class RowValues(list):
+    "Row values in column order, also usable like a Java collection"
+    def toArray(self):
+        return self
+
+class Row(object):
+    "A table row acting like the ``Map`` rows returned by Jackcess"
+    __slots__ = ('table', 'data')
+
+    def __init__(self, table, data):
+        self.table = table
+        self.data = data
+
+    def values(self):
+        return self.data
+
+    def keySet(self):
+        return [column.name for column in self.table.columns]
+
+    def get(self, column_name):
+        index = self.table.column_indexes.get(column_name)
+        if index is None:
+            return None
+        return self.data[index]
+
+    def hashCode(self):
+        return zlib.crc32(repr(self.data))
+
+    def __repr__(self):
+        return 'Row(%r)' % dict(zip(self.keySet(), self.data))
+
+class Relationship(object):
+    def __init__(self, fromTable, toTable):
+        self.fromTable = fromTable
+        self.toTable = toTable
+        self.fromColumns = []
+        self.toColumns = []
+
+class Table(object):
+    def __init__(self, database, name, tdef_page):
+        self.database = database
+        self.name = name
+        self.tdef_page = tdef_page
+        tdef = database.read_tdef(tdef_page)
+        self.row_count = U32.unpack_from(tdef, 16)[0]
+        (var_column_count, column_count, index_count, real_index_count,
+         self.usage_map) = TDEF_COUNTS.unpack_from(tdef, 43)
+        offset = 63 + 12 * real_index_count
+        columns = []
+        for index in xrange(column_count):
+            (type_code, number, var_index, flags, fixed_offset, length
+             ) = COLUMN_ENTRY.unpack_from(tdef, offset)
+            scale = ord(tdef[offset + 12])
+            columns.append(Column(self, None, type_code, number, var_index,
+                                  fixed_offset, length, flags, scale))
+            offset += COLUMN_ENTRY_SIZE
+        for column in columns:
+            column.name, offset = read_name(tdef, offset)
+        columns.sort(key=lambda column: column.number)
+        for index, column in enumerate(columns):
+            column.columnIndex = index
+        self.columns = columns
+        self.column_indexes = dict((column.name, column.columnIndex)
+                                   for column in columns)
+        columns_by_number = dict((column.number, column) for column in columns)
+        real_indexes = []
+        for index in xrange(real_index_count):
+            entry = REAL_INDEX_ENTRY.unpack_from(tdef, offset)
+            real_indexes.append(([columns_by_number[number]
+                                  for number in entry[:20:2]
+                                  if number != UNUSED_INDEX_COLUMN],
+                                 bool(entry[20] & INDEX_UNIQUE)))
+            offset += REAL_INDEX_ENTRY.size
+        logical_indexes = []
+        for index in xrange(index_count):
+            logical_indexes.append(LOGICAL_INDEX_ENTRY.unpack_from(tdef, offset))
+            offset += LOGICAL_INDEX_ENTRY.size
+        self.indexes = []
+        for number, real_index, index_type in logical_indexes:
+            name, offset = read_name(tdef, offset)
+            index_columns, unique = real_indexes[real_index]
+            self.indexes.append(Index(name, index_columns,
+                                      index_type == INDEX_PRIMARY_KEY, unique))
+        self._rows = None
+
+    def getName(self):
+        return self.name
+
+    def getColumns(self):
+        return self.columns
+
+    def getColumn(self, column_name):
+        return self.columns[self.column_indexes[column_name]]
+
+    def getIndexes(self):
+        return self.indexes
+
+    def getRowCount(self):
+        return self.row_count
+
+    def reset(self):
+        self._rows = None
+
+    def getNextRow(self):
+        if self._rows is None:
+            self._rows = self.iter_rows()
+        try:
+            return self._rows.next()
+        except StopIteration:
+            return None
+
+    def getNextRows(self, count):
+        "Return up to `count` rows as lists of values in column order"
+        if self._rows is None:
+            self._rows = self.iter_rows()
+        return [row.data for row in itertools.islice(self._rows, count)]
+
+    def iter_row_positions(self):
+        "Generate the start and end offsets of the rows in the file"
+        database = self.database
+        data = database.data
+        for page_number in database.usage_map_pages(self.usage_map):
+            page_offset = page_number * PAGE_SIZE
+            if (ord(data[page_offset]) != PAGE_TYPE_DATA or
+                U32.unpack_from(data, page_offset + 4)[0] != self.tdef_page):
+                continue
+            row_total = U16.unpack_from(data, page_offset + 12)[0]
+            end = PAGE_SIZE
+            for offset in struct.unpack_from('<%dH' % row_total, data,
+                                             page_offset + 14):
+                start = offset & ROW_OFFSET_MASK
+                if not offset & ROW_DELETED:
+                    if offset & ROW_OVERFLOW:
+                        yield database.find_row(U32.unpack_from(
+                            data, page_offset + start)[0])
+                    else:
+                        yield page_offset + start, page_offset + end
+                end = start
+
+    def iter_rows(self):
+        decode_row = self.row_decoder()
+        data = self.database.data
+        for start, end in self.iter_row_positions():
+            yield Row(self, decode_row(data[start:end]))
+
+    def row_decoder(self):
+        """Return a function decoding the bytes of a row into `RowValues`
+
+        Values are located the same way as in ``mdb_crack_row4`` of
+        mdbtools.  Boolean values are stored in the null mask.
+        """
+        layout = []
+        for column in self.columns:
+            if column.type.code == 0x01:
+                kind = 'bool'
+            elif column.fixed:
+                kind = 'fixed'
+            else:
+                kind = 'var'
+            layout.append((column.number >> 3, 1 << (column.number & 7),
+                           column.number, kind, column.var_index,
+                           2 + column.fixed_offset,
+                           2 + column.fixed_offset + column.length,
+                           column.decoder(self.database)))
+        def decode_row(row):
+            size = len(row)
+            row_column_count = U16.unpack_from(row)[0]
+            var_end = size - (row_column_count + 7) // 8
+            null_mask = row[var_end:]
+            var_count = U16.unpack_from(row, var_end - 2)[0]
+            var_offsets = struct.unpack_from(
+                '<%dH' % (var_count + 1), row, var_end - 4 - 2 * var_count
+                )[::-1]
+            values = RowValues()
+            for (mask_byte, mask_bit, number, kind, var_index,
+                 fixed_start, fixed_end, decode) in layout:
+                present = (number < row_column_count and
+                           ord(null_mask[mask_byte]) & mask_bit)
+                if kind == 'bool':
+                    values.append(bool(present))
+                elif not present:
+                    values.append(None)
+                elif kind == 'fixed':
+                    values.append(decode(row[fixed_start:fixed_end]))
+                elif var_index < var_count:
+                    values.append(decode(row[var_offsets[var_index]:
+                                             var_offsets[var_index + 1]]))
+                else:
+                    values.append(None)
+            return values
+        return decode_row
+
+    def __repr__(self):
+        return '<Table %s>' % self.name
+
+class Cursor(object):
+    "Read the rows of a table independently of other cursors"
+    def __init__(self, table):
+        self.table = table
+        self.decode_row = table.row_decoder()
+        self.positions = table.iter_row_positions()
+
+    def skipNextRows(self, count):
+        return sum(1 for position in itertools.islice(self.positions, count))
+
+    def getNextRow(self):
+        try:
+            start, end = self.positions.next()
+        except StopIteration:
+            return None
+        return Row(self.table,
+                   self.decode_row(self.table.database.data[start:end]))
+
+    def getNextRows(self, count):
+        "Return up to `count` rows as lists of values in column order"
+        data = self.table.database.data
+        decode_row = self.decode_row
+        return [decode_row(data[start:end])
+                for start, end in itertools.islice(self.positions, count)]
+
+class Database(object):
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.file = open(filepath, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if (self.data[4:4 + len(JET_SIGNATURE)] != JET_SIGNATURE or
+            ord(self.data[VERSION_OFFSET]) != JET4_VERSION):
+            self.close()
+            raise Jet4Error('%s is not a Jet 4 (Access 2000) database'
+                            % filepath)
+        self._tables = {}
+        catalog = Table(self, u'MSysObjects', CATALOG_PAGE)
+        tables_parent_id = None
+        objects = []
+        for row in iter(catalog.getNextRow, None):
+            name = row.get('Name')
+            object_type = row.get('Type')
+            parent_id = row.get('ParentId')
+            if object_type == OBJECT_TYPE_CONTAINER and name == u'Tables':
+                tables_parent_id = row.get('Id')
+            elif object_type == OBJECT_TYPE_TABLE:
+                objects.append((name, parent_id, row.get('Id'),
+                                (row.get('Flags') or 0) & 0xffffffff))
+        self.table_pages = {}
+        self.system_table_pages = {}
+        for name, parent_id, object_id, flags in objects:
+            if tables_parent_id is not None and parent_id != tables_parent_id:
+                continue
+            if flags & SYSTEM_OBJECT_FLAGS:
+                pages = self.system_table_pages
+            else:
+                pages = self.table_pages
+            pages[name.lower()] = name, object_id & 0xffffff
+
+    @classmethod
+    def open(cls, filepath):
+        return cls(filepath)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def read_tdef(self, page_number):
+        "Return a table definition with its continuation pages appended"
+        offset = page_number * PAGE_SIZE
+        if ord(self.data[offset]) != PAGE_TYPE_TDEF:
+            raise Jet4Error('page %d is not a table definition' % page_number)
+        parts = [self.data[offset:offset + PAGE_SIZE]]
+        next_page = U32.unpack_from(self.data, offset + 4)[0]
+        while next_page:
+            offset = next_page * PAGE_SIZE
+            parts.append(self.data[offset + 8:offset + PAGE_SIZE])
+            next_page = U32.unpack_from(self.data, offset + 4)[0]
+        return ''.join(parts)
+
+    def find_row(self, pointer):
+        """Return the start and end offsets of a row in the file
+
+        The pointer holds the row number in the low byte and the page
+        number in the upper three bytes.
+        """
+        row_number = pointer & 0xff
+        page_offset = (pointer >> 8) * PAGE_SIZE
+        start = U16.unpack_from(
+            self.data, page_offset + 14 + 2 * row_number)[0] & ROW_OFFSET_MASK
+        if row_number:
+            end = U16.unpack_from(self.data, page_offset + 12 + 2 * row_number
+                                  )[0] & ROW_OFFSET_MASK
+        else:
+            end = PAGE_SIZE
+        return page_offset + start, page_offset + end
+
+    def usage_map_pages(self, pointer):
+        "Return the numbers of the pages owned according to a usage map"
+        start, end = self.find_row(pointer)
+        usage_map = self.data[start:end]
+        map_type = ord(usage_map[0])
+        if map_type == 0:
+            return bitmap_pages(usage_map[5:],
+                                U32.unpack_from(usage_map, 1)[0])
+        if map_type == 1:
+            pages = []
+            pages_per_bitmap = (PAGE_SIZE - 4) * 8
+            map_page_count = (len(usage_map) - 1) // 4
+            for index, map_page in enumerate(struct.unpack_from(
+                    '<%dI' % map_page_count, usage_map, 1)):
+                if map_page:
+                    offset = map_page * PAGE_SIZE
+                    pages.extend(bitmap_pages(
+                        self.data[offset + 4:offset + PAGE_SIZE],
+                        index * pages_per_bitmap))
+            return pages
+        raise Jet4Error('unknown usage map type %d' % map_type)
+
+    def read_long_value(self, data):
+        "Return the bytes of a MEMO or OLE value given its 12-byte header"
+        length, pointer = MEMO_HEADER.unpack_from(data)
+        if length & LONG_VALUE_INLINE:
+            return data[12:12 + (length & LONG_VALUE_LENGTH_MASK)]
+        if length & LONG_VALUE_SINGLE_PAGE:
+            start, end = self.find_row(pointer)
+            return self.data[start:end][:length & LONG_VALUE_LENGTH_MASK]
+        length &= LONG_VALUE_LENGTH_MASK
+        parts = []
+        remaining = length
+        while pointer and remaining > 0:
+            start, end = self.find_row(pointer)
+            pointer = U32.unpack_from(self.data, start)[0]
+            parts.append(self.data[start + 4:end])
+            remaining -= end - start - 4
+        return ''.join(parts)[:length]
+
+    def getTableNames(self):
+        return sorted((name for name, page in self.table_pages.itervalues()),
+                      key=lambda name: name.lower())
+
+    def _get_table(self, pages, table_name):
+        try:
+            name, page = pages[table_name.lower()]
+        except KeyError:
+            return None
+        if page not in self._tables:
+            self._tables[page] = Table(self, name, page)
+        return self._tables[page]
+
+    def getTable(self, table_name):
+        return self._get_table(self.table_pages, table_name)
+
+    def getSystemTable(self, table_name):
+        return self._get_table(self.system_table_pages, table_name)
+
+    def getRelationships(self, table1, table2):
+        "Return the relationships between two tables in either direction"
+        catalog = self.getSystemTable('MSysRelationships')
+        if catalog is None:
+            return []
+        names = set([table1.name, table2.name])
+        relationships = {}
+        for row in iter(Cursor(catalog).getNextRow, None):
+            from_name = row.get('szReferencedObject')
+            to_name = row.get('szObject')
+            if set([from_name, to_name]) != names:
+                continue
+            name = row.get('szRelationship')
+            if name not in relationships:
+                relationships[name] = (Relationship(self.getTable(from_name),
+                                                    self.getTable(to_name)),
+                                       [])
+            relationships[name][1].append((row.get('icolumn'),
+                                           row.get('szReferencedColumn'),
+                                           row.get('szColumn')))
+        for relationship, column_pairs in relationships.itervalues():
+            for index, from_column, to_column in sorted(column_pairs):
+                relationship.fromColumns.append(
+                    relationship.fromTable.getColumn(from_column))
+                relationship.toColumns.append(
+                    relationship.toTable.getColumn(to_column))
+        return [relationship for relationship, pairs
+                in relationships.itervalues()]
+
+    def createCursor(self, table):
+        return Cursor(table)
+
+def read_name(data, offset):
+    "Read a name prefixed by its length, return it and the next offset"
+    length = U16.unpack_from(data, offset)[0]
+    start = offset + 2
+    return data[start:start + length].decode('utf-16-le'), start + length
+
+def bitmap_pages(bitmap, first_page):
+    "Return the page numbers whose bits are set in a usage map bitmap"
+    pages = []
+    for index, byte in enumerate(bitmap):
+        byte = ord(byte)
+        if byte:
+            for bit in xrange(8):
+                if byte & (1 << bit):
+                    pages.append(first_page + 8 * index + bit)
+    return pages
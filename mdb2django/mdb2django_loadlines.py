@@ -0,0 +1,125 @@
+"""
+Load JSON Lines fixtures written by ``mdb2django_schema``
+
+``--fixture-format jsonl`` writes the rows of each table into ``.jsonl``
+files with one fixture object per line, and lists the files in loading
+order in the fixture file.  Django's ``loaddata`` reads a whole fixture
+into memory and saves the objects one by one; this command reads the
+files line by line instead and saves each run of objects of the same
+model with ``bulk_create``.
+
+Copy this module into an application of the project as
+``<app>/management/commands/loadfixturelines.py`` and run::
+
+    python manage.py loadfixturelines fixture.json
+
+The fixture file may be compressed like any output of
+``mdb2django_schema`` (``.gz``, or ``.zst`` with ``zstandard``), but
+the ``.jsonl`` files it lists never are.
+
+Like ``loaddata``, the whole load is one transaction and the primary key
+sequences are reset afterwards.  Unlike ``loaddata``, ``bulk_create``
+sends no ``pre_save`` or ``post_save`` signals.
+"""
+
+import gzip
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.core.serializers.python import Deserializer
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+BATCH_SIZE = 1000
+
+def read_listing(listing_path):
+    "Return the text of a fixture file, decompressing it if necessary"
+    if listing_path.endswith('.zst'):
+        import zstandard
+        listing = file(listing_path, 'rb')
+        try:
+            return ''.join(
+                zstandard.ZstdDecompressor().read_to_iter(listing))
+        finally:
+            listing.close()
+    if listing_path.endswith('.gz'):
+        listing = gzip.open(listing_path, 'rb')
+    else:
+        listing = file(listing_path)
+    try:
+        return listing.read()
+    finally:
+        listing.close()
+
+def fixture_files(listing_path):
+    """Return the paths of the JSON Lines files listed in a fixture
+
+    A ``.jsonl`` path is returned as is.
+    """
+    if listing_path.endswith('.jsonl'):
+        return [listing_path]
+    return [line.strip() for line in read_listing(listing_path).splitlines()
+            if line.strip() and not line.startswith('#')]
+
+def read_objects(path, using):
+    "Deserialize the objects of a JSON Lines file one line at a time"
+    lines_file = file(path)
+    try:
+        for line in lines_file:
+            if line.strip():
+                for obj in Deserializer([json.loads(line)], using=using):
+                    yield obj.object
+    finally:
+        lines_file.close()
+
+def model_batches(objects, batch_size):
+    "Group consecutive objects of the same model into lists"
+    batch = []
+    for obj in objects:
+        if batch and (len(batch) >= batch_size or
+                      type(obj) is not type(batch[0])):
+            yield batch
+            batch = []
+        batch.append(obj)
+    if batch:
+        yield batch
+
+class Command(BaseCommand):
+    help = 'Loads JSON Lines fixtures written by mdb2django_schema.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixture_files', nargs='+',
+                            help='fixture files listing .jsonl files, '
+                                 'or .jsonl files')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='number of objects saved in each INSERT')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='the database to load the fixtures into')
+
+    def handle(self, *listing_paths, **options):
+        using = options['database']
+        listing_paths = listing_paths or options['fixture_files']
+        connection = connections[using]
+        models = set()
+        count = 0
+        with transaction.atomic(using=using):
+            for listing_path in listing_paths:
+                for path in fixture_files(listing_path):
+                    for batch in model_batches(read_objects(path, using),
+                                               options['batch_size']):
+                        model = type(batch[0])
+                        model._base_manager.using(using).bulk_create(batch)
+                        models.add(model)
+                        count += len(batch)
+            sequence_sql = connection.ops.sequence_reset_sql(no_style(),
+                                                             list(models))
+            if sequence_sql:
+                cursor = connection.cursor()
+                try:
+                    for sql in sequence_sql:
+                        cursor.execute(sql)
+                finally:
+                    cursor.close()
+        if options['verbosity'] >= 1:
+            self.stdout.write('Installed %d object(s) from %d fixture(s)'
+                              % (count, len(listing_paths)))
@@ -15,6 +15,28 @@ Requirements:
  * Apache `Commons Logging`_
  * Apache `Commons Lang`_
 
+Alternatively, ``--backend=jet4`` reads the file with a pure-Python
+Jet 4 page reader which needs none of the above.  ``--dump-schema``
+saves the schema as a JSON snapshot, and ``--from-schema`` generates
+``models.py`` and ``admin.py`` from the snapshot without a JVM.
+``--columnar`` converts table data column by column and needs `NumPy`_.
+``--fixture-format=jsonl`` splits the fixture into JSON Lines files,
+which the management command in ``mdb2django_loadlines`` bulk loads.
+Output files ending in ``.gz`` or ``.zst`` are compressed while they
+are written, the latter with `zstandard`_.  Only those files are: the
+CSV, PGCOPY, JSON Lines and shard files written next to them stay
+uncompressed, so that MySQL, psql and the loader can read them.
+``--pipeline`` reads, converts and writes table data in separate
+threads and holds at most ``--pipeline-batches`` row batches ahead of
+the output.
+``--batch-rows`` sets how many rows are read and converted at a time.
+The jet4 backend reads such a batch in one call, while Jackcess rows
+are still fetched one by one across the Java bridge.
+``--shard-threshold`` splits the COPY data of large tables into
+``--shards`` files.  Only with ``--jobs`` above 1 are they written by
+worker threads alongside the rest of the output, otherwise they are
+written one after another.
+
 .. _OpenJDK: http://openjdk.java.net/
 .. _Jython: http://jython.org/
 .. _CPython: http://python.org/
@@ -22,30 +44,285 @@ Requirements:
 .. _Jackcess: http://jackcess.sourceforge.net/
 .. _Commons Logging: http://commons.apache.org/logging/
 .. _Commons Lang: http://commons.apache.org/lang/
+.. _NumPy: http://numpy.scipy.org/
+.. _zstandard: https://pypi.python.org/pypi/zstandard
 """
 
 import re
 import sys
+import os
 import json
+import base64
+import binascii
+import time
+import struct
+import marshal
+import hashlib
+import datetime
+import functools
+import decimal
 import itertools
+import heapq
+import socket
+import tempfile
+import gzip
+import threading
+import traceback
+import warnings
+import Queue
 from collections import defaultdict
+from json.encoder import encode_basestring_ascii
 
 MEMO_LENGTH = 8190
+FIXTURE_CHUNK_ROWS = 1000
+FIXTURE_FILE_ROWS = 100000
+OUTPUT_BUFFER_SIZE = 1 << 20
+COMPRESSION_SUFFIXES = ('.gz', '.zst')
+COPY_BUFFER_SIZE = 1 << 16
+DAEMON_CACHE_SIZE = 16
+FETCH_BATCH_ROWS = 500
+PIPELINE_BATCHES = 8
+CSV_NULL = 'NULL'
+PROGRESS_INTERVAL = 1.0
 
 def memoize(method):
+    """Cache the result of a method in the ``_cache`` dict of the instance
+
+    The cached values live and die with the instance, and `forget`
+    invalidates them explicitly.
+    """
+    name = method.__name__
+    @functools.wraps(method)
     def wrapped(self):
-        if self not in wrapped.cache:
-            wrapped.cache[self] = method(self)
-        return wrapped.cache[self]
-    wrapped.cache = {}
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = method(self)
+            return value
     return wrapped
 
 memoized_property = lambda method: property(memoize(method))
 
+def slot_memoized_property(method):
+    """A `memoized_property` which caches its value in the slot ``_name``
+
+    Saves the ``_cache`` dict in objects which exist in large numbers.
+    The values can't be forgotten.
+    """
+    slot = '_%s' % method.__name__
+    @functools.wraps(method)
+    def wrapped(self):
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            value = method(self)
+            setattr(self, slot, value)
+            return value
+    return property(wrapped)
+
+def forget(obj, *names):
+    "Invalidate the named memoized values of an object, or all of them"
+    if names:
+        for name in names:
+            obj._cache.pop(name, None)
+    else:
+        obj._cache.clear()
+
 MONTH_ABBRS = 'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()
 
+MILLIS_PER_DAY = 24 * 60 * 60 * 1000
+QUARTER_HOUR_MILLIS = 15 * 60 * 1000
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+def no_conversion(table_name, column_name, value):
+    return value
+
+def java_timezone_offset():
+    """Return a function giving the JVM default time zone offset
+
+    The function takes milliseconds since the epoch and returns the
+    offset of local time in milliseconds.  Offsets are cached for each
+    quarter of an hour which doesn't contain an offset transition.
+    Without a JVM, UTC is assumed.
+    """
+    try: # jython
+        from java.util import TimeZone
+    except ImportError: # JPype
+        try:
+            import jpype
+        except ImportError:
+            return lambda millis: 0
+        if not jpype.isJVMStarted():
+            return lambda millis: 0
+        TimeZone = jpype.java.util.TimeZone
+    timezone = TimeZone.getDefault()
+    cache = {}
+    def offset(millis):
+        quarter = millis // QUARTER_HOUR_MILLIS
+        if quarter in cache:
+            return cache[quarter]
+        start = quarter * QUARTER_HOUR_MILLIS
+        start_offset = timezone.getOffset(start)
+        if timezone.getOffset(start + QUARTER_HOUR_MILLIS - 1) != start_offset:
+            return timezone.getOffset(millis)
+        if len(cache) > 100000:
+            cache.clear()
+        cache[quarter] = start_offset
+        return start_offset
+    return offset
+
+def int_value(value):
+    if isinstance(value, (int, long)): # already unboxed by Jython
+        return value
+    return value.value
+
+def bool_value(value):
+    if isinstance(value, bool): # already unboxed by Jython
+        return value
+    return bool(value.booleanValue())
+
+def text_value(value):
+    return value.replace('\r\n', r'\r').replace('\t', r'\t')
+
+DECIMAL_TYPES = frozenset([u'MONEY', u'NUMERIC'])
+
+def decimal_value(value):
+    "Convert a Jackcess BigDecimal to a `decimal.Decimal`"
+    if isinstance(value, decimal.Decimal): # pure-Python backend
+        return value
+    return decimal.Decimal(unicode(value.toString()))
+
+def decimal_text(value):
+    """Format decimals in fixed point notation, e.g. 0E-4 as 0.0000
+
+    Other values, e.g. from custom conversions, are formatted with
+    `unicode`.
+    """
+    if isinstance(value, decimal.Decimal):
+        return format(value, 'f')
+    return unicode(value)
+
+BINARY_TYPES = frozenset([u'BINARY', u'OLE'])
+
+def binary_value(value):
+    "Convert a Jackcess byte array to a `buffer`"
+    if isinstance(value, bytearray): # pure-Python backend
+        return buffer(value)
+    return buffer(bytearray(byte & 0xff for byte in value))
+
+CSV_QUOTED_RE = re.compile(r'[",\r\n]')
+
+def csv_field(text, null_marker):
+    """Quote a CSV field according to RFC 4180 if necessary
+
+    Empty fields and fields equal to the null marker are quoted too,
+    so they can be told apart from nulls.
+    """
+    if not text or text == null_marker or CSV_QUOTED_RE.search(text):
+        return '"%s"' % text.replace('"', '""')
+    return text
+
+def fingerprint_value(value):
+    """Encode a column value for hashing the contents of a table
+
+    Values are prefixed with their length, so that the encoded values
+    of a row can't run into each other.
+    """
+    if value is None:
+        return 'N'
+    if isinstance(value, float):
+        text = repr(value)
+    elif isinstance(value, buffer):
+        text = str(value)
+    else:
+        text = unicode(value).encode('UTF-8')
+    return '%d:%s' % (len(text), text)
+
+SQLITE_TYPES = {
+    u'BYTE': 'integer',
+    u'INT': 'integer',
+    u'LONG': 'integer',
+    u'BOOLEAN': 'bool',
+    u'SHORT_DATE_TIME': 'datetime',
+    u'FLOAT': 'real',
+    u'DOUBLE': 'real',
+    u'MONEY': 'decimal',
+    u'NUMERIC': 'decimal',
+    u'MEMO': 'text',
+    u'BINARY': 'blob',
+    u'OLE': 'blob'}
+
+def sqlite_name(name):
+    "Quote a table, column or index name for SQLite"
+    return '"%s"' % name.replace('"', '""')
+
+JSON_ENCODERS = {
+    type(None): lambda value: 'null',
+    bool: lambda value: ('false', 'true')[value],
+    int: str,
+    long: str,
+    float: repr,
+    decimal.Decimal: decimal_text,
+    buffer: lambda value: '"%s"' % base64.b64encode(value),
+    str: encode_basestring_ascii,
+    unicode: encode_basestring_ascii}
+
+PGCOPY_HEADER = 'PGCOPY\n\377\r\n\0' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+PGCOPY_NULL = struct.pack('>i', -1)
+PGCOPY_LENGTH = struct.Struct('>i')
+PGCOPY_INT4 = struct.Struct('>ii')
+PGCOPY_BOOL = struct.Struct('>i?')
+PGCOPY_TIMESTAMP = struct.Struct('>iq')
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+PG_EPOCH_MILLIS = 946684800000
+
+def pgbinary_text(value):
+    data = unicode(value).encode('UTF-8')
+    return PGCOPY_LENGTH.pack(len(data)) + data
+
+def pgbinary_bytes(value):
+    return PGCOPY_LENGTH.pack(len(value)) + str(value)
+
+def pgbinary_timestamp(value):
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    delta = value - PG_EPOCH
+    return PGCOPY_TIMESTAMP.pack(
+        8, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+PGCOPY_ENCODERS = {
+    u'INT': lambda value: PGCOPY_INT4.pack(4, value),
+    u'LONG': lambda value: PGCOPY_INT4.pack(4, value),
+    u'BOOLEAN': lambda value: PGCOPY_BOOL.pack(1, value),
+    u'SHORT_DATE_TIME': pgbinary_timestamp,
+    u'TEXT': pgbinary_text,
+    u'MEMO': pgbinary_text,
+    u'BINARY': pgbinary_bytes,
+    u'OLE': pgbinary_bytes}
+
+def check_pgbinary_columns(models):
+    """Raise ValueError if a table has columns without a PGCOPY encoding
+
+    PostgreSQL doesn't take text for e.g. float8, numeric or timestamp
+    fields in binary format, so only the types of `PGCOPY_ENCODERS`
+    can be written as binary COPY data.
+    """
+    for model in models:
+        for column in model.columns:
+            if column.type.name() not in PGCOPY_ENCODERS:
+                raise ValueError(
+                    'column %s.%s of type %s has no binary COPY encoding, '
+                    'use the text format' % (model.access_table.name,
+                                             column.name,
+                                             column.type.name()))
+
 class ValueConversion:
-    def __init__(self, custom_conversion=lambda t, c, v: v):
+    timezone_offset = None
+    csv_null = CSV_NULL
+
+    def __init__(self, custom_conversion=no_conversion):
         self.custom_conversion = custom_conversion
 
     def java2python(self, table_name, column_name, value):
@@ -57,7 +334,7 @@ class ValueConversion:
         if cls in ('java.lang.Integer', 'java.lang.Short'):
             value = value.value
         elif cls == 'unicode':
-            value = value.replace('\r\n', r'\r').replace('\t', r'\t')
+            value = text_value(value)
         elif cls == 'java.lang.Boolean':
             value = bool(value.booleanValue())
         elif cls in ('com.healthmarketscience.jackcess.Column$DateExt',
@@ -90,6 +367,216 @@ class ValueConversion:
             return r'\N'
         return unicode(python_value).encode('UTF-8')
 
+    def local_millis(self, value):
+        "Return the local time of a Java date as milliseconds since epoch"
+        if isinstance(value, datetime.datetime): # pure-Python backend
+            delta = value - EPOCH
+            return ((delta.days * 86400 + delta.seconds) * 1000 +
+                    delta.microseconds // 1000)
+        if self.timezone_offset is None:
+            self.timezone_offset = java_timezone_offset()
+        millis = value.getTime()
+        return millis + self.timezone_offset(millis)
+
+    def date_value(self, value):
+        """Format a Java date as local time using epoch millis arithmetic"""
+        days, millis = divmod(self.local_millis(value), MILLIS_PER_DAY)
+        date = datetime.date.fromordinal(EPOCH_ORDINAL + days)
+        seconds = millis // 1000
+        return '%04d-%02d-%02d %02d:%02d:%02d' % (
+            date.year, date.month, date.day,
+            seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    def python_converter(self, table_name, column, escape_text=True):
+        """Return a function converting the values of a Jackcess column
+
+        The conversion is chosen once from the column type, so
+        converting a value doesn't need to inspect its class.  Without
+        `escape_text`, line breaks and tabs in text are kept as is.
+        """
+        column_name = column.name
+        if escape_text:
+            text = text_value
+        else:
+            text = lambda value: value
+        convert = {u'INT': int_value,
+                   u'LONG': int_value,
+                   u'BOOLEAN': bool_value,
+                   u'SHORT_DATE_TIME': self.date_value,
+                   u'MONEY': decimal_value,
+                   u'NUMERIC': decimal_value,
+                   u'TEXT': text,
+                   u'MEMO': text,
+                   u'BINARY': binary_value,
+                   u'OLE': binary_value}.get(column.type.name())
+        if convert is None:
+            # other column types keep the per-value class dispatch
+            convert = lambda value: generic_conversion.java2python(
+                table_name, column_name, value)
+        custom_conversion = self.custom_conversion
+        if custom_conversion is no_conversion:
+            def python_value(value):
+                if value is None:
+                    return None
+                return convert(value)
+        else:
+            def python_value(value):
+                if value is not None:
+                    value = convert(value)
+                return custom_conversion(table_name, column_name, value)
+        return python_value
+
+    def json_converter(self, table_name, column):
+        """Return a function encoding the values of a column as JSON text"""
+        python_value = self.python_converter(table_name, column)
+        def json_value(value):
+            value = python_value(value)
+            try:
+                encode = JSON_ENCODERS[value.__class__]
+            except KeyError:
+                return json.dumps(value)
+            return encode(value)
+        return json_value
+
+    def pgcopy_converter(self, table_name, column):
+        """Return a function encoding column values for COPY text format
+
+        Binary values are written as ``bytea`` in hex format, with the
+        backslash escaped for COPY.
+        """
+        python_value = self.python_converter(table_name, column)
+        text = unicode
+        if column.type.name() in DECIMAL_TYPES:
+            text = decimal_text
+        def pgcopy_value(value):
+            value = python_value(value)
+            if isinstance(value, bool):
+                return 'ft'[value]
+            if value is None:
+                return r'\N'
+            if isinstance(value, buffer):
+                return r'\\x' + binascii.hexlify(value)
+            return text(value).encode('UTF-8')
+        return pgcopy_value
+
+    def csv_converter(self, table_name, column):
+        """Return a function encoding column values as CSV fields
+
+        Booleans become 1 and 0 and nulls the `csv_null` marker.
+        Binary values are encoded in base64.
+        """
+        python_value = self.python_converter(table_name, column,
+                                             escape_text=False)
+        null_marker = self.csv_null
+        text = unicode
+        if column.type.name() in DECIMAL_TYPES:
+            text = decimal_text
+        def csv_value(value):
+            value = python_value(value)
+            if value is None:
+                return null_marker
+            if isinstance(value, bool):
+                return '01'[value]
+            if isinstance(value, buffer):
+                return csv_field(base64.b64encode(value), null_marker)
+            return csv_field(text(value).encode('UTF-8'), null_marker)
+        return csv_value
+
+    def sqlite_converter(self, table_name, column):
+        """Return a function converting column values for `sqlite3`
+
+        `sqlite3` can't bind decimals, so they are passed as text,
+        which SQLite converts to numbers for ``decimal`` columns.
+        """
+        python_value = self.python_converter(table_name, column,
+                                             escape_text=False)
+        if column.type.name() not in DECIMAL_TYPES:
+            return python_value
+        def sqlite_value(value):
+            value = python_value(value)
+            if isinstance(value, decimal.Decimal):
+                return decimal_text(value)
+            return value
+        return sqlite_value
+
+    def pgbinary_converter(self, table_name, column):
+        """Return a function encoding column values as PGCOPY binary fields
+
+        The encoding is chosen from the Jackcess column type.
+        Timestamps are written as the local time of the JVM, which
+        matches loading the text format in a session using UTC.  Text
+        is written as is, without the escapes of the text format.
+        Other column types raise ValueError, see
+        `check_pgbinary_columns`.
+        """
+        column_type = column.type.name()
+        if (column_type == u'SHORT_DATE_TIME' and
+            self.custom_conversion is no_conversion):
+            # encode dates without formatting them as text first
+            def pgbinary_value(value):
+                if value is None:
+                    return PGCOPY_NULL
+                return PGCOPY_TIMESTAMP.pack(
+                    8, (self.local_millis(value) - PG_EPOCH_MILLIS) * 1000)
+            return pgbinary_value
+        try:
+            encode = PGCOPY_ENCODERS[column_type]
+        except KeyError:
+            raise ValueError('column %s.%s of type %s has no binary COPY '
+                             'encoding' % (table_name, column.name,
+                                           column_type))
+        python_value = self.python_converter(table_name, column,
+                                             escape_text=False)
+        def pgbinary_value(value):
+            value = python_value(value)
+            if value is None:
+                return PGCOPY_NULL
+            return encode(value)
+        return pgbinary_value
+
+    def plan(self, kind, table_name, columns):
+        """Build a list of converters for the columns of a table
+
+        `kind` is 'python', 'json' (encoded JSON text), 'pgcopy',
+        'pgbinary', 'csv' or 'sqlite'.  Apply the plan to a
+        row with `convert_row`.
+        """
+        make_converter = getattr(self, '%s_converter' % kind)
+        return [make_converter(table_name, column) for column in columns]
+
+    def batch_converter(self, kind, table_name, columns):
+        """Return a function converting a batch of rows, see `plan`
+
+        The batches are lists of rows as returned by `RowFetcher`.
+        """
+        plan = self.plan(kind, table_name, columns)
+        return lambda batch: [convert_row(plan, values) for values in batch]
+
+def convert_row(plan, values):
+    return [convert(value) for convert, value in zip(plan, values)]
+
+class ColumnarConversion(ValueConversion):
+    """Convert row batches column by column with NumPy arrays
+
+    See ``mdb2django_columnar``.  Typed columns are only vectorized
+    without a custom conversion, which may return values of any type.
+    The columns read from a batch are reused by the other outputs of a
+    `SharedScan`.
+    """
+    def __init__(self, custom_conversion=no_conversion):
+        import mdb2django_columnar
+        ValueConversion.__init__(self, custom_conversion)
+        self.columnar = mdb2django_columnar
+        self.read_columns = mdb2django_columnar.ColumnCache()
+
+    def batch_converter(self, kind, table_name, columns):
+        return self.columnar.batch_converter(
+            self, kind, table_name, columns,
+            vectorize=self.custom_conversion is no_conversion,
+            read=self.read_columns)
+
+generic_conversion = ValueConversion()
+
 def forloop(seq):
     """Iterate sequence with markers for first and last item
 
@@ -115,7 +602,9 @@ def camelcase2english(s):
 def underscores2camelcase(s):
     return ''.join(part.title() for part in s.split('_'))
 
-class Relationship:
+class Relationship(object):
+    __slots__ = ('database', 'to_field', 'from_field')
+
     def __init__(self, database, access_relationship):
         self.database = database
         to_model = database.get_model_by_table(access_relationship.toTable)
@@ -128,54 +617,179 @@ class Relationship:
     def __repr__(self):
         return '<Relationship from:%s to:%s>' % (self.from_field, self.to_field)
 
-class FieldBase:
+class DependencyGraph(object):
+    """The foreign key dependencies between models
+
+    Built once from the relationships of the database.  `ordered` lists
+    the models in table order, except that the models referred to by a
+    foreign key come before the model with the foreign key.  It is
+    sorted iteratively with Kahn's algorithm, always picking the first
+    ready model in table order.
+
+    Foreign keys of a model to itself are listed in `self_references`
+    and don't affect the order.  Circular dependencies are listed in
+    `cycles`, each as a list of models where every model refers to the
+    next one and the last one to the first.  A cycle is broken at its
+    first model in table order.
+
+    `levels` groups the models so that the models of each level only
+    refer to models of earlier levels, e.g. for loading the tables of a
+    level in parallel.  `level` maps each model to its level.
+    """
+    def __init__(self, models, relationships):
+        self.models = list(models)
+        self.position = dict((model, index)
+                             for index, model in enumerate(self.models))
+        self.dependencies = dict((model, set()) for model in self.models)
+        self.dependents = dict((model, set()) for model in self.models)
+        self_references = set()
+        for relationship in relationships:
+            model = relationship.to_field.model
+            related_model = relationship.from_field.model
+            if (model not in self.position or
+                related_model not in self.position):
+                continue
+            if model is related_model:
+                self_references.add(model)
+            else:
+                self.dependencies[model].add(related_model)
+                self.dependents[related_model].add(model)
+        self.self_references = sorted(self_references, key=self.position.get)
+        self.cycles = []
+        self.ordered = []
+        self.level = {}
+        self.sort()
+        self.levels = [[] for i in range(max(self.level.values() or [-1]) + 1)]
+        for model in self.ordered:
+            self.levels[self.level[model]].append(model)
+
+    def sort(self):
+        position = self.position
+        waiting = dict((model, len(self.dependencies[model]))
+                       for model in self.models)
+        ready = [position[model]
+                 for model, count in waiting.iteritems() if count == 0]
+        heapq.heapify(ready)
+        while waiting:
+            if ready:
+                model = self.models[heapq.heappop(ready)]
+            else:
+                cycle = self.find_cycle(waiting)
+                self.cycles.append(cycle)
+                model = min(cycle, key=position.get)
+            del waiting[model]
+            self.ordered.append(model)
+            self.level[model] = max([self.level[related_model] + 1
+                                     for related_model
+                                     in self.dependencies[model]
+                                     if related_model in self.level] or [0])
+            for dependent in self.dependents[model]:
+                if dependent in waiting:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        heapq.heappush(ready, position[dependent])
+
+    def find_cycle(self, waiting):
+        """Return a cycle among the models still waiting to be ordered
+
+        Each of them refers to another waiting model, so following
+        these references from any of them leads into a cycle.
+        """
+        model = min(waiting, key=self.position.get)
+        path = []
+        visited = {}
+        while model not in visited:
+            visited[model] = len(path)
+            path.append(model)
+            model = min([related_model
+                         for related_model in self.dependencies[model]
+                         if related_model in waiting],
+                        key=self.position.get)
+        return path[visited[model]:]
+
+class CatalogRelationship:
+    """A relationship read directly from the MSysRelationships table
+
+    Has the same attributes as the Jackcess ``Relationship`` objects
+    which `Relationship` is constructed from.
+    """
+    def __init__(self, fromTable, toTable):
+        self.fromTable = fromTable
+        self.toTable = toTable
+        self.fromColumns = []
+        self.toColumns = []
+
+class FieldBase(object):
+    __slots__ = ()
+
     def as_python(self):
         yield '    %s = models.%s(' % (self.name, self.field_class)
         for first, att, last in forloop(self.attrs):
             yield '        %s%s' % (att, ',)'[last])
 
 class Field(FieldBase):
+    """A Django model field for an Access column
+
+    The properties derived from the column, its indexes and the
+    relationships are memoized in slots, so the Java objects behind
+    them are read only once during code generation.
+    """
+    __slots__ = ('model', 'database', 'column', '_name', '_verbose_name',
+                 '_foreign_key', '_type_name', '_length', '_field_class',
+                 '_column_name', '_index', '_primary_key', '_unique')
+
     def __init__(self, model, column):
         self.model = model
         self.database = model.database
         self.column = column
 
-    @property
+    @slot_memoized_property
+    def column_name(self):
+        return self.column.name
+
+    @slot_memoized_property
     def name(self):
         return self.database.column2field_name(
-            self.column.name, self.primary_key)
+            self.column_name, self.primary_key)
 
-    @property
+    @slot_memoized_property
     def verbose_name(self):
         return camelcase2english(self.name)
 
-    @property
+    @slot_memoized_property
     def foreign_key(self):
-        if self not in self.database.relationships:
-            return False
-        return self.database.relationships[self]
+        return self.database.relationships.get(self, False)
 
     @property
     def reverse_foreign_keys(self):
         for r in self.database.reverse_relationships[self]:
             yield r
 
-    @property
+    @slot_memoized_property
+    def type_name(self):
+        return self.column.type.name()
+
+    @slot_memoized_property
+    def length(self):
+        return self.column.length
+
+    @slot_memoized_property
     def field_class(self):
         if self.foreign_key:
             return 'ForeignKey'
-        if self.column.type.name() == u'TEXT':
-            if self.column.length == MEMO_LENGTH:
+        type_name = self.type_name
+        if type_name == u'TEXT':
+            if self.length == MEMO_LENGTH:
                 return 'TextField'
             else:
                 return 'CharField'
-        elif self.column.type.name() in (u'INT', u'LONG'):
+        elif type_name in (u'INT', u'LONG'):
             if self.primary_key:
                 return 'AutoField'
             return 'IntegerField'
-        elif self.column.type.name() == u'BOOLEAN':
+        elif type_name == u'BOOLEAN':
             return 'BooleanField'
-        elif self.column.type.name() == u'SHORT_DATE_TIME':
+        elif type_name == u'SHORT_DATE_TIME':
             return 'DateTimeField'
 
     @property
@@ -185,16 +799,18 @@ class Field(FieldBase):
                                    underscores2camelcase(self.name))
         return '%sInline' % self.model.name
 
-    @property
+    @slot_memoized_property
     def index(self):
-        return self.model.single_column_indexes[self.column.name]
+        "The single column index of the field, or None"
+        return self.model.single_column_indexes.get(self.column_name)
 
-    @property
+    @slot_memoized_property
     def primary_key(self):
-        try:
-            return self.index.isPrimaryKey()
-        except KeyError:
-            return False
+        return self.index is not None and bool(self.index.isPrimaryKey())
+
+    @slot_memoized_property
+    def unique(self):
+        return self.index is not None and bool(self.index.isUnique())
 
     @property
     def attrs(self):
@@ -212,26 +828,40 @@ class Field(FieldBase):
             yield "verbose_name=_(u'%s')" % self.verbose_name
         else:
             yield "_(u'%s')" % self.verbose_name
-            if self.column.type.name() == u'TEXT':
-                if self.column.length != MEMO_LENGTH:
-                    yield 'max_length=%d' % self.column.length
-        try:
-            if self.primary_key:
-                yield 'primary_key=True'
-            elif self.index:
-                yield 'db_index=True'
-                if self.index.isUnique():
-                    yield 'unique=True'
-        except KeyError:
-            pass
-
-        if self.name != self.column.name:
-            yield "db_column='%s'" % self.column.name
+            if self.type_name == u'TEXT':
+                if self.length != MEMO_LENGTH:
+                    yield 'max_length=%d' % self.length
+        if self.primary_key:
+            yield 'primary_key=True'
+        elif self.index is not None:
+            yield 'db_index=True'
+            if self.unique:
+                yield 'unique=True'
+
+        if self.name != self.column_name:
+            yield "db_column='%s'" % self.column_name
+
+    def sqlite_definition(self):
+        "Return the column definition of the field for SQLite"
+        column_type = self.type_name
+        if column_type == u'TEXT' and self.length != MEMO_LENGTH:
+            sqlite_type = 'varchar(%d)' % self.length
+        else:
+            sqlite_type = SQLITE_TYPES.get(column_type, 'text')
+        definition = '%s %s' % (sqlite_name(self.column_name), sqlite_type)
+        if self.primary_key:
+            return '%s NOT NULL PRIMARY KEY' % definition
+        if self.foreign_key:
+            target = self.foreign_key.from_field
+            return '%s REFERENCES %s (%s)' % (
+                definition, sqlite_name(target.model.db_table),
+                sqlite_name(target.column_name))
+        return definition
 
     def __repr__(self):
         return '<Field %s.%s>' % (self.model.name, self.name)
 
-class PrimaryKeyField:
+class PrimaryKeyField(object):
     """A generated primary key field for tables lacking one
 
     This class contains just enough functionality to act as a hidden
@@ -242,17 +872,64 @@ class PrimaryKeyField:
     primary_key = True
     class column:
         name = None
+    column_name = None
     foreign_key = False
     reverse_foreign_keys = ()
+    __slots__ = ()
     def __init__(self, model):
         pass
     def as_python(self):
         return ()
+    def sqlite_definition(self):
+        return '"id" integer NOT NULL PRIMARY KEY AUTOINCREMENT'
+
+class RowFetcher(object):
+    """Fetch rows from a table or cursor in batches of value lists
+
+    Every batch is a list of up to `batch_rows` rows, each a list of
+    values in column order.  Sources providing ``getNextRows(count)``,
+    like the cursors of the pure-Python backends, return a whole batch
+    in one call.  Jackcess has no such call, so its rows are still
+    fetched one by one, and only ``values().toArray()`` is called on
+    each of these Java maps.
+    """
+    def __init__(self, source, batch_rows=FETCH_BATCH_ROWS):
+        self.source = source
+        self.batch_rows = batch_rows
+        if hasattr(source, 'getNextRows'):
+            self.fetch = source.getNextRows
+
+    def fetch(self, count):
+        "Return the next `count` rows, or fewer at the end of the table"
+        batch = []
+        get_next_row = self.source.getNextRow
+        for index in xrange(count):
+            row = get_next_row()
+            if row is None:
+                break
+            batch.append(list(row.values().toArray()))
+        return batch
+
+    def batches(self, count=None):
+        "Generate batches of the next `count` rows, or of all rows"
+        while count is None or count > 0:
+            size = self.batch_rows
+            if count is not None:
+                size = min(size, count)
+                count -= size
+            batch = self.fetch(size)
+            if batch:
+                yield batch
+            if len(batch) < size:
+                break
+
+class Model(object):
+    __slots__ = ('database', 'access_table', '_cache')
 
-class Model:
     def __init__(self, database, access_table):
         self.database = database
         self.access_table = access_table
+        self._cache = {}
 
     @memoized_property
     def single_column_indexes(self):
@@ -260,47 +937,51 @@ class Model:
             (i.columns[0].name, i) for i in self.access_table.indexes
             if len(i.columns) == 1)
 
-    @property
+    @memoized_property
     def multicolumn_indexes(self):
-        return [i for i in self.access_table.indexes if len(i.columns) > 1]
+        "The column names and uniqueness of multi-column indexes"
+        return [([column.name for column in i.columns], bool(i.isUnique()))
+                for i in self.access_table.indexes if len(i.columns) > 1]
 
-    @property
+    @memoized_property
+    def columns(self):
+        "The Access columns of the table, read once"
+        return list(self.access_table.getColumns())
+
+    @memoized_property
     def foreign_keys(self):
-        for field in self.fields:
-            if field.foreign_key:
-                yield field.foreign_key
+        return [field.foreign_key for field in self.fields
+                if field.foreign_key]
 
-    @property
+    @memoized_property
     def related_models(self):
         return frozenset(relation.from_field.model
                          for relation in self.foreign_keys)
 
-    @property
+    @memoized_property
     def foreign_key_fields(self):
         return frozenset(relation.to_field for relation in self.foreign_keys)
 
-    @property
+    @memoized_property
     def reverse_foreign_keys(self):
-        for field in self.fields:
-            for relation in field.reverse_foreign_keys:
-                yield relation
+        return [relation for field in self.fields
+                for relation in field.reverse_foreign_keys]
 
-    @property
+    @memoized_property
     def name(self):
         return self.database.table2model_name(self.access_table.name)
 
-    @property
+    @memoized_property
     def verbose_name(self):
         return camelcase2english(self.name)
 
     @property
     def verbose_name_plural(self):
-        return '%ss' % camelcase2english(self.name)
+        return '%ss' % self.verbose_name
 
     @memoized_property
     def fields(self):
-        _field_list = sorted((Field(self, c)
-                              for c in self.access_table.getColumns()),
+        _field_list = sorted((Field(self, c) for c in self.columns),
                              key=lambda f: not f.primary_key)
         if not _field_list[0].primary_key:
             # no primary key in access table, add an AutoField
@@ -309,7 +990,7 @@ class Model:
 
     @memoized_property
     def fields_by_column_name(self):
-        return dict((field.column.name, field)
+        return dict((field.column_name, field)
                     for field in self.fields)
 
     def get_field_by_column(self, column):
@@ -321,7 +1002,7 @@ class Model:
                     self.name,
                     self.fields_by_column_name))
 
-    @property
+    @memoized_property
     def primary_key(self):
         for field in self.fields:
             if field.primary_key:
@@ -350,10 +1031,10 @@ class Model:
             yield "        db_table = '%s'" % db_table
         if self.multicolumn_indexes:
             yield '        unique_together = ('
-            for index in self.multicolumn_indexes:
+            for column_names, unique in self.multicolumn_indexes:
                 yield '            (%s),' % (
-                    ' '.join("'%s'," % self.get_field_by_column(c).name
-                             for c in index.columns))
+                    ' '.join("'%s'," % self.fields_by_column_name[name].name
+                             for name in column_names))
             yield '        )'
         yield "        verbose_name = _(u'%s')" % self.verbose_name
         yield "        verbose_name_plural = _(u'%s')" % (
@@ -393,44 +1074,107 @@ class Model:
                 else:
                     yield '        %s])' % inline_name
 
-    def get_rows(self):
-        self.access_table.reset()
-        row_generator = (self.access_table.getNextRow()
-                         for i in itertools.repeat(None))
-        return itertools.takewhile(lambda row: row is not None, row_generator)
+    def get_row_batches(self, start=0, stop=None):
+        """Generate batches of row values, see `RowFetcher`
+
+        Given `stop`, the rows from index `start` up to but excluding
+        `stop` are read with a cursor of their own, so several ranges
+        of the table can be read at the same time from different
+        database copies.
+        """
+        if stop is None:
+            self.access_table.reset()
+            fetcher = RowFetcher(self.access_table, self.database.batch_rows)
+            batches = fetcher.batches()
+        else:
+            cursor = self.database.create_cursor(self.access_table)
+            if start:
+                cursor.skipNextRows(start)
+            fetcher = RowFetcher(cursor, self.database.batch_rows)
+            batches = fetcher.batches(stop - start)
+        return self.database.metrics.rows(self, batches)
+
+    def converted_batches(self, convert_batch, batches=None):
+        """Generate the row batches of the table converted by a function
+
+        Other row batches can be given in `batches`.  If the database
+        has a `pipeline_batches` depth, the rows of the table are read
+        and converted in threads, see `BatchPipeline`.
+        """
+        if batches is not None:
+            return itertools.imap(convert_batch, batches)
+        batches = self.get_row_batches()
+        if self.database.pipeline_batches:
+            return BatchPipeline(batches, convert_batch,
+                                 self.database.pipeline_batches,
+                                 self.database.formatters)
+        return itertools.imap(convert_batch, batches)
 
     @property
     def row_count(self):
         return self.access_table.getRowCount()
 
-    def output_fixture(self, app_name, valueconversion):
-        "Output all rows from the model table as JSON"
-        # helper function for converting Jackcess column values to
-        # JSON:
-        fix_value = lambda field_name, value: valueconversion.java2json(
-            self.access_table.name, field_name, value)
+    def fingerprint(self):
+        """Return the row count and a hash of the table contents
+
+        The hash is computed from the values read from the table in
+        column order, see `fingerprint_value`, without converting them
+        for an output first.  Only byte arrays are converted, since
+        the text of a Java array isn't its contents.  Hash codes of the
+        rows would be cheaper, but they collide too easily.
+        """
+        binary_columns = [index for index, column in enumerate(self.columns)
+                          if column.type.name() in BINARY_TYPES]
+        digest = hashlib.md5()
+        count = 0
+        for batch in self.get_row_batches():
+            for values in batch:
+                if binary_columns:
+                    values = list(values)
+                    for index in binary_columns:
+                        if values[index] is not None:
+                            values[index] = binary_value(values[index])
+                digest.update(''.join(map(fingerprint_value, values)))
+                count += 1
+        return count, digest.hexdigest()
+
+    def output_fixture(self, app_name, valueconversion, batches=None):
+        """Output all rows from the model table as JSON objects
+
+        Yields the JSON text of each row.  The model label and field
+        names are encoded only once into a template for the table.
+        Other row batches can be given in `batches`.
+        """
+        table_name = self.access_table.name
+        columns = self.columns
+        pk_name = self.primary_key.name
+        fields = [(index, column.name)
+                  for index, column in enumerate(columns)
+                  if column.name != pk_name]
+        template = '{"model": %s, "pk": %%s, "fields": {%s}}' % (
+            encode_basestring_ascii('%s.%s' % (app_name, self.name.lower())
+                                    ).replace('%', '%%'),
+            ', '.join('%s: %%s' % encode_basestring_ascii(name
+                                                          ).replace('%', '%%')
+                      for index, name in fields))
+        field_indexes = [index for index, name in fields]
+        convert_batch = self.database.metrics.batch_converter(
+            self, valueconversion.batch_converter('json', table_name, columns))
         try: # Access table has a single-field primary key
-            pk_index = self.primary_key.column.columnIndex
-            get_pk = lambda values_list: fix_value(
-                self.primary_key.column.name, values_list[pk_index])
+            field_indexes.insert(0, self.primary_key.column.columnIndex)
+            counter = None
         except AttributeError: # generate an AutoField
             counter = itertools.count()
-            get_pk = lambda row: counter.next()
-        for row_is_first, row, row_is_last in forloop(self.get_rows()):
-            values_list = list(row.values())
-            data = dict(
-                pk=get_pk(values_list),
-                model='%s.%s' % (app_name, self.name.lower()),
-                fields=dict((field_name, fix_value(field_name, value))
-                            for field_name, value in
-                            zip(row.keySet(), values_list)
-                            if field_name != self.primary_key.name))
-            json_lines = json.dumps(data).split('\n')
-            for line_is_first, line, line_is_last in forloop(json_lines):
-                if row_is_last and line_is_last:
-                    yield line
-                else:
-                    yield line + ','
+        converted_batches = self.converted_batches(convert_batch, batches)
+        if counter is None:
+            for converted in converted_batches:
+                for values in converted:
+                    yield template % tuple([values[i] for i in field_indexes])
+        else:
+            for converted in converted_batches:
+                for values in converted:
+                    yield template % tuple([str(counter.next())] +
+                                           [values[i] for i in field_indexes])
 
     @memoized_property
     def pg_table(self):
@@ -442,19 +1186,122 @@ class Model:
     def delete_as_pg(self):
         return 'DELETE FROM %s;' % self.pg_table
 
-    def output_postgresql(self, valueconversion):
-        "Output all rows from the table as PostgreSQL COPY commands"
+    @property
+    def pg_columns(self):
         # get fields in MDB order, exclude added AutoFields
-        column_names = [column.name
-                        for column in self.access_table.getColumns()]
-        yield 'COPY %s (%s) FROM stdin;' % (
-            self.pg_table, ', '.join('"%s"' % n for n in column_names))
-        for row in self.get_rows():
-            yield '\t'.join(
-                valueconversion.java2pgcopy(self.access_table.name,
-                                            column_names[index],
-                                            value)
-                for index, value in enumerate(row.values().toArray()))
+        return '%s (%s)' % (
+            self.pg_table,
+            ', '.join('"%s"' % column.name for column in self.columns))
+
+    def copy_statement(self, binary=False):
+        return 'COPY %s FROM stdin%s;' % (self.pg_columns,
+                                          ('', ' WITH BINARY')[binary])
+
+    def pgcopy_rows(self, valueconversion, batches=None):
+        """Output all rows from the table as PostgreSQL COPY data lines
+
+        Other row batches, e.g. of a range, can be given in `batches`.
+        """
+        convert_batch = self.database.metrics.batch_converter(
+            self, valueconversion.batch_converter(
+                'pgcopy', self.access_table.name, self.columns))
+        for converted in self.converted_batches(convert_batch, batches):
+            for values in converted:
+                yield '\t'.join(values)
+
+    def pgcopy_binary_rows(self, valueconversion, batches=None):
+        "Output all rows from the table as PGCOPY binary tuples"
+        columns = self.columns
+        field_count = struct.pack('>h', len(columns))
+        convert_batch = self.database.metrics.batch_converter(
+            self, valueconversion.batch_converter(
+                'pgbinary', self.access_table.name, columns))
+        for converted in self.converted_batches(convert_batch, batches):
+            for values in converted:
+                yield field_count + ''.join(values)
+
+    def csv_rows(self, valueconversion, batches=None):
+        "Output all rows from the table as CSV records"
+        convert_batch = self.database.metrics.batch_converter(
+            self, valueconversion.batch_converter(
+                'csv', self.access_table.name, self.columns))
+        for converted in self.converted_batches(convert_batch, batches):
+            for values in converted:
+                yield ','.join(values)
+
+    def load_data_statement(self, data_path, null_marker=CSV_NULL):
+        """Return a MySQL statement loading a CSV data file of the table
+
+        MySQL reads the unquoted word NULL as a null.  Other markers
+        are turned into nulls with ``NULLIF``.
+        """
+        db_table = '`%s`' % self.db_table
+        if self.database.schema:
+            db_table = '`%s`.%s' % (self.database.schema, db_table)
+        columns = ['`%s`' % column.name
+                   for column in self.columns]
+        if null_marker == 'NULL':
+            assignments = '(%s)' % ', '.join(columns)
+        else:
+            marker = mysql_string(null_marker)
+            assignments = '(%s) SET %s' % (
+                ', '.join('@v%d' % index for index in range(len(columns))),
+                ', '.join('%s = NULLIF(@v%d, %s)' % (column, index, marker)
+                          for index, column in enumerate(columns)))
+        return ("LOAD DATA LOCAL INFILE %s INTO TABLE %s CHARACTER SET utf8 "
+                "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                "ESCAPED BY '' LINES TERMINATED BY '\\r\\n' %s;" % (
+                    mysql_string(data_path), db_table, assignments))
+
+    def sqlite_create_statement(self):
+        return 'CREATE TABLE %s (%s)' % (
+            sqlite_name(self.db_table),
+            ', '.join(field.sqlite_definition() for field in self.fields))
+
+    def sqlite_insert_statement(self):
+        # generated AutoFields are filled in by SQLite
+        columns = self.columns
+        return 'INSERT INTO %s (%s) VALUES (%s)' % (
+            sqlite_name(self.db_table),
+            ', '.join(sqlite_name(column.name) for column in columns),
+            ', '.join('?' for column in columns))
+
+    def sqlite_index_statements(self):
+        """Generate statements creating the indexes of the table
+
+        Like Django, foreign keys are indexed too.  Indexes are unique
+        only if the Access index is.
+        """
+        db_table = self.db_table
+        indexes = []
+        for field in self.fields:
+            if field.primary_key:
+                continue
+            if field.index is None and not field.foreign_key:
+                continue
+            indexes.append(([field.column_name], field.unique))
+        indexes.extend(self.multicolumn_indexes)
+        for column_names, unique in indexes:
+            yield 'CREATE %sINDEX %s ON %s (%s)' % (
+                ('', 'UNIQUE ')[unique],
+                sqlite_name('_'.join([db_table] + column_names)),
+                sqlite_name(db_table),
+                ', '.join(sqlite_name(name) for name in column_names))
+
+    def sqlite_rows(self, valueconversion, batches=None):
+        "Generate all rows from the table as parameters for `sqlite3`"
+        convert_batch = self.database.metrics.batch_converter(
+            self, valueconversion.batch_converter(
+                'sqlite', self.access_table.name, self.columns))
+        for converted in self.converted_batches(convert_batch, batches):
+            for values in converted:
+                yield values
+
+    def output_postgresql(self, valueconversion, batches=None):
+        "Output all rows from the table as PostgreSQL COPY commands"
+        yield self.copy_statement()
+        for line in self.pgcopy_rows(valueconversion, batches):
+            yield line
         yield r'\.'
         yield ''
 
@@ -462,11 +1309,19 @@ class Model:
         return '<Model %s>' % self.name
 
 class OutputType(object):
-    def __init__(self, name, title, comment_char, work):
+    def __init__(self, name, title, comment_char, work, segmented=False,
+                 needs_filepath=False, schema_only=False):
         self.name = name
         self.title = title
         self.comment_char = comment_char
         self.work = work
+        # segmented outputs are built from independent per-model
+        # segments and can be produced by parallel workers
+        self.segmented = segmented
+        # some outputs write additional files next to the output file
+        self.needs_filepath = needs_filepath
+        # schema-only outputs read no rows and work with --from-schema
+        self.schema_only = schema_only
 
     @property
     def attr(self):
@@ -483,10 +1338,14 @@ class OutputType(object):
 class DatabaseWrapper:
 
     OUTPUT_TYPES = [
-        OutputType('models', 'models.py', '#', 5.0),
-        OutputType('admin', 'admin.py', '#', 1.0),
-        OutputType('fixture', 'fixture.json', '#', 150.0),
-        OutputType('postgresql', 'pg_data.sql', '-', 40.0)]
+        OutputType('models', 'models.py', '#', 5.0, schema_only=True),
+        OutputType('admin', 'admin.py', '#', 1.0, schema_only=True),
+        OutputType('fixture', 'fixture.json', '#', 150.0, segmented=True,
+                   needs_filepath=True),
+        OutputType('postgresql', 'pg_data.sql', '-', 40.0, segmented=True,
+                   needs_filepath=True),
+        OutputType('csv', 'load_data.sql', '-', 40.0, segmented=True,
+                   needs_filepath=True)]
 
     def __init__(self, db,
                  app_name='myapp',
@@ -494,28 +1353,139 @@ class DatabaseWrapper:
                  keep_table_names=False,
                  table2model_name=lambda s: s,
                  column2field_name=lambda c, pk: c,
-                 custom_conversion=lambda t, c, v: v):
+                 custom_conversion=no_conversion,
+                 relationship_catalog=True,
+                 pg_format='text',
+                 shard_threshold=None,
+                 shards=4,
+                 batch_rows=FETCH_BATCH_ROWS,
+                 columnar=False,
+                 csv_null=CSV_NULL,
+                 fixture_format='json',
+                 fixture_rows=FIXTURE_FILE_ROWS,
+                 pipeline_batches=None,
+                 formatters=1):
         self.db = db
+        self.filepath = None
+        self.backend = 'jackcess'
+        self.metrics = NO_METRICS
+        self.progress = Progress()
+        self.shared_scan = None
+        self._cache = {}
+        self.options = dict(app_name=app_name,
+                            schema=schema,
+                            keep_table_names=keep_table_names,
+                            table2model_name=table2model_name,
+                            column2field_name=column2field_name,
+                            custom_conversion=custom_conversion,
+                            relationship_catalog=relationship_catalog,
+                            pg_format=pg_format,
+                            shard_threshold=shard_threshold,
+                            shards=shards,
+                            batch_rows=batch_rows,
+                            columnar=columnar,
+                            csv_null=csv_null,
+                            fixture_format=fixture_format,
+                            fixture_rows=fixture_rows,
+                            pipeline_batches=pipeline_batches,
+                            formatters=formatters)
         self.app_name = app_name
         self.schema = schema
         self.keep_table_names = keep_table_names
         self.table2model_name = table2model_name
         self.column2field_name = column2field_name
-        self.valueconversion = ValueConversion(custom_conversion)
+        if columnar:
+            self.valueconversion = ColumnarConversion(custom_conversion)
+        else:
+            self.valueconversion = ValueConversion(custom_conversion)
+        self.valueconversion.csv_null = csv_null
+        self.relationship_catalog = relationship_catalog
+        self.pg_format = pg_format
+        self.shard_threshold = shard_threshold
+        self.shards = shards
+        self.batch_rows = batch_rows
+        self.csv_null = csv_null
+        self.fixture_format = fixture_format
+        self.fixture_rows = fixture_rows
+        self.pipeline_batches = pipeline_batches
+        self.formatters = formatters
 
     @classmethod
-    def from_file(cls, filepath, **kwargs):
+    def from_file(cls, filepath, backend='jackcess', **kwargs):
+        """Open an MDB file read-only
+
+        The ``jet4`` backend reads the file with the pure-Python reader
+        in ``mdb2django_jet4`` and doesn't need a JVM.  The ``snapshot``
+        backend reads a schema snapshot written by `dump_schema`.
+        """
+        if backend in ('jet4', 'snapshot'):
+            module = __import__('mdb2django_%s' % backend)
+            wrapper = cls(module.Database.open(filepath), **kwargs)
+            wrapper.filepath = filepath
+            wrapper.backend = backend
+            return wrapper
         try: # jython
             from com.healthmarketscience.jackcess import Database
             from java.io import File
         except ImportError: # JPype
-            from jpype import startJVM, getDefaultJVMPath, JPackage, java
-            startJVM(getDefaultJVMPath())
+            from jpype import (startJVM, isJVMStarted, getDefaultJVMPath,
+                               JPackage, java)
+            if not isJVMStarted():
+                startJVM(getDefaultJVMPath())
             com = JPackage('com')
             Database = com.healthmarketscience.jackcess.Database
             File = java.io.File
-        return cls(Database.open(File(filepath), True), # True = read-only
-                   **kwargs)
+        wrapper = cls(Database.open(File(filepath), True), # True = read-only
+                      **kwargs)
+        wrapper.filepath = filepath
+        wrapper.backend = backend
+        return wrapper
+
+    def open_data_file(self, path):
+        """Open a data file for writing, see `ThreadedOutput`
+
+        Data files are written in a separate thread with a pipeline.
+        """
+        if self.pipeline_batches:
+            return ThreadedOutput(path)
+        return file(path, 'wb', OUTPUT_BUFFER_SIZE)
+
+    def create_cursor(self, access_table):
+        if hasattr(self.db, 'createCursor'): # pure-Python backend
+            return self.db.createCursor(access_table)
+        return jackcess_class('Cursor').createCursor(access_table)
+
+    def open_copy(self):
+        """Open another read-only wrapper for the same MDB file
+
+        Jackcess databases are not thread safe, so every parallel
+        worker reads the file through a copy of its own.
+        """
+        if self.filepath is None:
+            raise ValueError('%r was not opened from a file' % self)
+        copy = self.from_file(self.filepath, backend=self.backend,
+                              **self.options)
+        copy.metrics = self.metrics
+        return copy
+
+    def dump_schema(self, filepath):
+        """Save the tables and relationships as a JSON schema snapshot
+
+        `from_file` reads the snapshot back with the ``snapshot``
+        backend, which generates models and admin without a JVM.
+        """
+        import mdb2django_snapshot
+        relationships = []
+        for r in self.get_relationships()['all'].itervalues():
+            relationship = CatalogRelationship(r.from_field.model.access_table,
+                                               r.to_field.model.access_table)
+            relationship.fromColumns.append(r.from_field.column)
+            relationship.toColumns.append(r.to_field.column)
+            relationships.append(relationship)
+        mdb2django_snapshot.save(filepath,
+                                 [self.db.getTable(table_name)
+                                  for table_name in self.db.getTableNames()],
+                                 relationships)
 
     def _add_relationships(self, result, table_names=None):
         a = result['all']
@@ -529,6 +1499,45 @@ class DatabaseWrapper:
                     a[r.to_field, r.from_field] = r
             self._add_relationships(result, table_names[1:])
 
+    def _read_relationship_catalog(self):
+        """Read all relationships in one scan of MSysRelationships
+
+        Returns a list of `CatalogRelationship` objects, or None if the
+        system table isn't available.  Every row of the catalog
+        describes one column pair of a relationship.  Like the pairwise
+        lookup, relationships of a table to itself are skipped.
+        """
+        try:
+            catalog = self.db.getSystemTable('MSysRelationships')
+        except AttributeError: # not a Jackcess database
+            return None
+        if catalog is None:
+            return None
+        table_names = frozenset(self.db.getTableNames())
+        relationships = {}
+        column_pairs = defaultdict(list)
+        catalog.reset()
+        for row in iter(catalog.getNextRow, None):
+            from_name = row.get('szReferencedObject')
+            to_name = row.get('szObject')
+            if (from_name not in table_names or to_name not in table_names
+                or from_name == to_name):
+                continue
+            name = row.get('szRelationship')
+            if name not in relationships:
+                relationships[name] = CatalogRelationship(
+                    self.db.getTable(from_name), self.db.getTable(to_name))
+            column_pairs[name].append((row.get('icolumn'),
+                                       row.get('szReferencedColumn'),
+                                       row.get('szColumn')))
+        for name, relationship in relationships.iteritems():
+            for index, from_column, to_column in sorted(column_pairs[name]):
+                relationship.fromColumns.append(
+                    relationship.fromTable.getColumn(from_column))
+                relationship.toColumns.append(
+                    relationship.toTable.getColumn(to_column))
+        return relationships.values()
+
     @memoize
     def get_relationships(self):
         all_ = {}
@@ -538,7 +1547,17 @@ class DatabaseWrapper:
             'all': all_,
             'forward': forward,
             'reverse': reverse}
-        self._add_relationships(relationships, list(self.db.getTableNames()))
+        access_relationships = None
+        if self.relationship_catalog:
+            access_relationships = self._read_relationship_catalog()
+        if access_relationships is None:
+            # fall back to querying each pair of tables
+            self._add_relationships(relationships,
+                                    list(self.db.getTableNames()))
+        else:
+            for access_relationship in access_relationships:
+                r = Relationship(self, access_relationship)
+                all_[r.to_field, r.from_field] = r
         for (to_field, from_field), relationship in all_.iteritems():
             forward[to_field] = relationship
             reverse[from_field].add(relationship)
@@ -553,26 +1572,28 @@ class DatabaseWrapper:
         return self.get_relationships()['reverse']
 
     def get_model_by_table(self, access_table):
-        if not hasattr(self, '_models_by_table_name'):
-            self._models_by_table_name = dict(
-                (model.access_table.name, model) for model in self.models)
-        return self._models_by_table_name[access_table.name]
+        return self.get_model_by_table_name(access_table.name)
 
-    def order_models(self, models, done=set()):
-        """Sorts models based on foreign key dependencies
+    def get_model_by_table_name(self, table_name):
+        return self.models_by_table_name[table_name]
+
+    @memoized_property
+    def models_by_table_name(self):
+        return dict((model.access_table.name, model) for model in self.models)
 
-        Related models appear before the corresponding tables with the
-        foreign key.
+    def invalidate(self):
+        """Drop the cached schema: models, fields and relationships
+
+        Releases the references to the Access table objects, so the
+        next access re-reads the schema from the database.
         """
-        for model in models:
-            if model.name is None:
-                continue
-            if model in done:
-                continue
-            done.add(model)
-            for related_model in self.order_models(model.related_models, done):
-                yield related_model
-            yield model
+        for model in self._cache.get('models', ()):
+            forget(model)
+        forget(self)
+
+    @memoized_property
+    def dependency_graph(self):
+        return DependencyGraph(self.models, self.relationships.values())
 
     @memoized_property
     def models(self):
@@ -586,70 +1607,773 @@ class DatabaseWrapper:
                       for table_name in self.db.getTableNames()]
         return [m for m in all_models if m.name is not None]
 
-    @memoized_property
+    @property
     def ordered_models(self):
-        return list(self.order_models(self.models))
+        "Models sorted by foreign key dependencies, see `DependencyGraph`"
+        return self.dependency_graph.ordered
 
     def output_models(self):
-        yield len(self.models) + 2, 'generating model imports'
+        progress = self.progress
+        progress.start(len(self.models), 'generating model imports')
         yield 'from django.db import models'
         yield 'from django.utils.translation import ugettext as _'
-        for index, model in enumerate(self.ordered_models):
-            yield len(self.models) - index, 'generating models: %s' % model.name
+        for model in self.ordered_models:
+            self.metrics.start_model(model)
+            progress.message = 'generating models: %s' % model.name
             for line in model.as_python():
                 yield line
+            progress.done += 1
 
     def output_admin(self):
-        yield 2 * len(self.models) + 2, 'generating admin imports'
+        progress = self.progress
+        progress.start(2 * len(self.models), 'generating admin imports')
         yield 'from django.contrib import admin'
         yield 'from %s.models import (' % self.app_name
-        for index, model in enumerate(self.ordered_models):
-            yield 2 * len(self.models) + 1, 'generating admin model imports'
+        for model in self.ordered_models:
             yield '    %s,' % model.name
         yield ')'
-        for index, model in enumerate(self.ordered_models):
-            yield (2 * len(self.models) - index,
-                   'generating admin inline: %s', model.name)
+        for model in self.ordered_models:
+            self.metrics.start_model(model)
+            progress.message = 'generating admin inline: %s' % model.name
             for line in model.inlines_as_python():
                 yield line
-        for index, model in enumerate(self.ordered_models):
-            yield (len(self.models) - index,
-                   'generating ModelAdmin: %s' % model.name)
+            progress.done += 1
+        for model in self.ordered_models:
+            self.metrics.start_model(model)
+            progress.message = 'generating ModelAdmin: %s' % model.name
             for line in model.output_admin():
                 yield line
+            progress.done += 1
 
     def total_data_lines(self):
         return sum((model.row_count for model in self.models), 0)
 
-    def output_fixture(self):
-        "Output all data from the database as a JSON fixture"
-        total = self.total_data_lines()
-        for model_is_first, model, model_is_last in forloop(self.models):
-            lines = forloop(model.output_fixture(
-                    self.app_name, self.valueconversion))
-            for line_is_first, line, line_is_last in lines:
-                yield total, 'generating JSON fixture: %s' % model.name
-                total -= 1
-                yield (' ['[model_is_first and line_is_first] +
-                       line +
-                       ('', ']')[model_is_last and line_is_last])
-
-    def output_postgresql(self):
-        "Output all data from the database as PostgreSQL COPY commands"
-        counter = len(self.models) + self.total_data_lines()
+    def get_segments(self, output_type_name, models, jobs=1, cache=None):
+        """Return a function which generates the output of one model
+
+        With more than one job, the segments of all `models` are
+        produced in parallel by worker threads, each reading from its
+        own copy of the database.  Otherwise, with a `SharedScan`, the
+        tables are read only once for all data outputs.  With a
+        `SegmentCache`, the segments of unchanged tables are read from
+        the previous output instead.
+        """
+        if cache is not None:
+            models = [m for m in models if not cache.is_unchanged(m)]
+        if jobs > 1:
+            segment = ParallelSegments(self, output_type_name, models, jobs)
+        elif (self.shared_scan is not None and
+              self.shared_scan.shares(output_type_name)):
+            segment = self.shared_scan.segment(output_type_name)
+        else:
+            segment = getattr(self, '%s_segment' % output_type_name)
+        if cache is None:
+            return segment
+        def cached_segment(model):
+            if cache.is_unchanged(model):
+                if cache.has_segment(model):
+                    return cache.spliced(model)
+                # not written to the previous output, so not queued above
+                return getattr(self, '%s_segment' % output_type_name)(model)
+            return segment(model)
+        return cached_segment
+
+    def output_settings(self, output_type_name):
+        "Return the settings which affect the output of all tables"
+        return dict(output_type=output_type_name,
+                    app_name=self.app_name,
+                    schema=self.schema,
+                    keep_table_names=bool(self.keep_table_names),
+                    pg_format=self.pg_format,
+                    csv_null=self.csv_null,
+                    fixture_format=self.fixture_format,
+                    fixture_rows=self.fixture_rows,
+                    shards=self.shards,
+                    shard_threshold=self.shard_threshold)
+
+    def data_segments(self, output_type_name):
+        """Return the segment kind and the models of a data output
+
+        These are the models whose rows the output reads through
+        `get_segments`.
+        """
+        if output_type_name == 'postgresql':
+            return (('postgresql', 'pgbinary')[self.pg_format == 'binary'],
+                    [model for model in self.ordered_models
+                     if self.shard_ranges(model) is None])
+        return output_type_name, self.ordered_models
+
+    def share_scans(self, output_type_names):
+        """Read the rows of each table once for several data outputs
+
+        `output_type_names` are the data outputs in the order in which
+        they will be written.  See `SharedScan`.
+        """
+        self.shared_scan = SharedScan(self, [self.data_segments(name)
+                                             for name in output_type_names])
+
+    def fixture_segment(self, model, batches=None):
+        return model.output_fixture(self.app_name, self.valueconversion,
+                                    batches)
+
+    def output_fixture(self, jobs=1, filepath=None, cache=None):
+        """Output all data from the database as a JSON fixture
+
+        Rows are written in chunks of `FIXTURE_CHUNK_ROWS` lines.  The
+        last row is held back until the next one arrives, since only
+        the very last row of the fixture lacks a trailing comma.  Each
+        row takes one line with a one-character prefix and suffix.
+
+        With the ``jsonl`` fixture format, see `output_fixture_lines`.
+        """
+        if self.fixture_format == 'jsonl':
+            for line in self.output_fixture_lines(jobs, filepath, cache):
+                yield line
+            return
+        segment = self.get_segments('fixture', self.models, jobs, cache)
+        progress = self.progress
+        progress.start(self.total_data_lines())
+        opening = '['
+        last_row = None
+        position = 0
+        for model in self.models:
+            self.metrics.start_model(model)
+            progress.message = 'generating JSON fixture: %s' % model.name
+            rows = segment(model)
+            start = position
+            while True:
+                chunk = list(itertools.islice(rows, FIXTURE_CHUNK_ROWS))
+                if not chunk:
+                    break
+                progress.done += len(chunk)
+                position += sum(len(row) + 3 for row in chunk)
+                if last_row is not None:
+                    chunk.insert(0, last_row)
+                last_row = chunk.pop()
+                if chunk:
+                    yield '%s%s,' % (opening, ',\n '.join(chunk))
+                    opening = ' '
+            if cache is not None:
+                cache.record(model, start, position - start)
+        if last_row is None:
+            yield '[]'
+        else:
+            yield '%s%s]' % (opening, last_row)
+
+    def output_fixture_lines(self, jobs=1, filepath=None, cache=None):
+        """Output the paths of JSON Lines fixture files in loading order
+
+        The rows of each table are written one JSON object per line
+        into files next to `filepath`, each holding at most
+        `fixture_rows` rows.  Tables appear in dependency order, so the
+        files can be loaded one after another, e.g. with the command
+        in ``mdb2django_loadlines``.
+        """
+        if filepath in (None, '-'):
+            raise ValueError('JSON Lines fixtures need an output file')
+        segment = self.get_segments('fixture', self.ordered_models, jobs,
+                                    cache)
+        progress = self.progress
+        progress.start(self.total_data_lines())
+        for model in self.ordered_models:
+            self.metrics.start_model(model)
+            file_count = -(-model.row_count // self.fixture_rows)
+            paths = [fixture_lines_path(filepath, model, index)
+                     for index in xrange(file_count)]
+            if cache is None or not cache.is_unchanged(model):
+                rows = segment(model)
+            elif not all(os.path.exists(path) for path in paths):
+                rows = self.fixture_segment(model)
+            else: # keep the files of an unchanged table
+                rows = None
+            if rows is not None:
+                progress.message = 'generating JSON Lines: %s' % model.name
+                rows = iter(rows)
+                paths = []
+                for first_row in rows:
+                    path = fixture_lines_path(filepath, model, len(paths))
+                    lines_file = self.open_data_file(path)
+                    output = self.metrics.output(lines_file, model)
+                    try:
+                        for row in itertools.chain(
+                                [first_row],
+                                itertools.islice(rows, self.fixture_rows - 1)):
+                            output.write('%s\n' % row)
+                            progress.done += 1
+                    finally:
+                        lines_file.close()
+                    paths.append(path)
+            if cache is not None:
+                cache.record(model)
+            for path in paths:
+                yield path
+
+    def postgresql_segment(self, model, batches=None):
+        return model.output_postgresql(self.valueconversion, batches)
+
+    def pgbinary_segment(self, model, batches=None):
+        yield PGCOPY_HEADER
+        for row in model.pgcopy_binary_rows(self.valueconversion, batches):
+            yield row
+        yield PGCOPY_TRAILER
+
+    def csv_segment(self, model, batches=None):
+        return model.csv_rows(self.valueconversion, batches)
+
+    def output_csv(self, jobs=1, filepath=None, cache=None):
+        """Output MySQL statements loading a CSV data file for each table
+
+        The CSV data of each table is written in a separate file next
+        to `filepath`, in dependency order.  Records are separated by
+        CRLF and fields are quoted as in RFC 4180.
+        """
+        if filepath in (None, '-'):
+            raise ValueError('CSV data needs an output file')
+        segment = self.get_segments('csv', self.ordered_models, jobs, cache)
+        progress = self.progress
+        progress.start(self.total_data_lines())
+        for model in self.ordered_models:
+            self.metrics.start_model(model)
+            data_path = csv_data_path(filepath, model)
+            if cache is None or not cache.is_unchanged(model):
+                segment_data = segment(model)
+            elif not os.path.exists(data_path):
+                segment_data = self.csv_segment(model)
+            else: # keep the data file of an unchanged table
+                segment_data = None
+            if segment_data is not None:
+                data_file = self.open_data_file(data_path)
+                output = self.metrics.output(data_file, model)
+                progress.message = 'generating CSV data: %s' % model.name
+                try:
+                    for line in segment_data:
+                        output.write('%s\r\n' % line)
+                        progress.done += 1
+                finally:
+                    data_file.close()
+            if cache is not None:
+                cache.record(model)
+            yield model.load_data_statement(data_path, self.csv_null)
+
+    def shard_ranges(self, model):
+        """Return the row ranges for splitting the COPY data of a model
+
+        Returns None for tables not above the shard threshold.
+        """
+        if self.shard_threshold is None:
+            return None
+        row_count = model.row_count
+        if row_count <= self.shard_threshold:
+            return None
+        size = -(-row_count // self.shards)
+        return [(start, min(start + size, row_count))
+                for start in xrange(0, row_count, size)]
+
+    def shard_path(self, filepath, model, index):
+        return os.path.abspath('%s.%s.%d.%s' % (
+            os.path.splitext(filepath)[0], model.db_table, index,
+            ('sql', 'pgcopy')[self.pg_format == 'binary']))
+
+    def write_shard(self, table_name, start, stop, path):
+        "Write the COPY data of a range of rows into a shard file"
+        model = self.get_model_by_table_name(table_name)
+        batches = model.get_row_batches(start, stop)
+        shard_file = self.open_data_file(path)
+        output = self.metrics.output(shard_file, model)
+        try:
+            if self.pg_format == 'binary':
+                output.write(PGCOPY_HEADER)
+                for row in model.pgcopy_binary_rows(self.valueconversion,
+                                                    batches):
+                    output.write(row)
+                output.write(PGCOPY_TRAILER)
+            else:
+                print >>output, model.copy_statement()
+                for line in model.pgcopy_rows(self.valueconversion, batches):
+                    print >>output, line
+                print >>output, r'\.'
+        finally:
+            shard_file.close()
+
+    def output_postgresql(self, jobs=1, filepath=None, cache=None):
+        """Output all data from the database as PostgreSQL COPY commands
+
+        With the binary format, the data of each table is written in
+        a separate PGCOPY file next to `filepath`, and the output only
+        contains psql ``\\copy`` commands for loading them.
+
+        Tables above the shard threshold are split into shard files
+        which are loaded with psql ``\\i`` or ``\\copy`` commands.
+        With more than one job, the shards are written concurrently
+        with the rest of the output, otherwise after it, see
+        `ShardWriter`.  The shards are also listed in a ``.shards``
+        manifest for parallel loading.
+        """
+        binary = self.pg_format == 'binary'
+        if binary:
+            check_pgbinary_columns(self.ordered_models)
+        shard_ranges = dict((model, self.shard_ranges(model))
+                            for model in self.ordered_models)
+        unsharded_models = [model for model in self.ordered_models
+                            if shard_ranges[model] is None]
+        if binary or len(unsharded_models) < len(self.ordered_models):
+            if filepath in (None, '-'):
+                raise ValueError('binary COPY data and shards need an '
+                                 'output file')
+        if binary:
+            segment = self.get_segments('pgbinary', unsharded_models, jobs,
+                                        cache)
+        else:
+            segment = self.get_segments('postgresql', unsharded_models,
+                                        jobs, cache)
+        shard_files = {}
+        shard_tasks = []
+        for model in self.ordered_models:
+            if shard_ranges[model] is None:
+                continue
+            shards = shard_files[model] = [
+                dict(path=self.shard_path(filepath, model, index),
+                     start=start,
+                     stop=stop)
+                for index, (start, stop) in enumerate(shard_ranges[model])]
+            if (cache is not None and cache.is_unchanged(model) and
+                cache.has_shards(model, shards)):
+                continue # keep the shards of an unchanged table
+            shard_tasks.extend((model.access_table.name,
+                                shard['start'], shard['stop'], shard['path'])
+                               for shard in shards)
+        shard_writer = ShardWriter(self, shard_tasks, jobs)
+        progress = self.progress
+        progress.start(len(self.models) + self.total_data_lines(),
+                       'generating SQL DELETE clauses')
+        position = 0
         for model in reversed(self.ordered_models):
-            yield counter, 'generating SQL DELETE clauses: %s' % model.name
-            counter -= 1
-            yield model.delete_as_pg()
+            line = model.delete_as_pg()
+            position += len(line) + 1
+            yield line
+            progress.done += 1
         for model in self.ordered_models:
-            for line in model.output_postgresql(self.valueconversion):
-                yield counter, 'generating SQL COPY lines: %s' % model.name
-                counter -= 1
+            self.metrics.start_model(model)
+            if model in shard_files:
+                progress.message = 'generating shard commands: %s' % (
+                    model.name)
+                for shard in shard_files[model]:
+                    path = shard['path'].replace("'", "''")
+                    if binary:
+                        line = "\\copy %s FROM '%s' WITH BINARY" % (
+                            model.pg_columns, path)
+                    else:
+                        line = "\\i '%s'" % path
+                    position += len(line) + 1
+                    yield line
+                progress.done += model.row_count
+                if cache is not None:
+                    cache.record(model, shards=shard_files[model])
+                continue
+            if binary:
+                data_path = pgcopy_data_path(filepath, model)
+                if cache is None or not cache.is_unchanged(model):
+                    segment_data = segment(model)
+                elif not os.path.exists(data_path):
+                    segment_data = self.pgbinary_segment(model)
+                else: # keep the data file of an unchanged table
+                    segment_data = None
+                if segment_data is not None:
+                    data_file = self.open_data_file(data_path)
+                    output = self.metrics.output(data_file, model)
+                    progress.message = 'generating COPY data: %s' % (
+                        model.name)
+                    try:
+                        for data in segment_data:
+                            output.write(data)
+                            progress.done += 1
+                    finally:
+                        data_file.close()
+                if cache is not None:
+                    cache.record(model)
+                line = "\\copy %s FROM '%s' WITH BINARY" % (
+                    model.pg_columns, data_path.replace("'", "''"))
+                position += len(line) + 1
+                yield line
+                continue
+            start = position
+            progress.message = 'generating SQL COPY lines: %s' % model.name
+            for line in segment(model):
+                position += len(line) + 1
                 yield line
+                progress.done += 1
+            if cache is not None:
+                cache.record(model, start, position - start)
+        shard_writer.wait()
+        if filepath not in (None, '-'):
+            write_shard_manifest('%s.shards' % filepath,
+                                 [(model, shard_files[model])
+                                  for model in self.ordered_models
+                                  if model in shard_files])
 
     def __repr__(self):
         return '<Database %d>' % id(self.db)
 
+def jackcess_class(class_name):
+    "Return a Jackcess class, starting the JVM first if necessary"
+    try: # jython
+        from com.healthmarketscience import jackcess
+    except ImportError: # JPype
+        from jpype import startJVM, isJVMStarted, getDefaultJVMPath, JPackage
+        if not isJVMStarted():
+            startJVM(getDefaultJVMPath())
+        jackcess = JPackage('com').healthmarketscience.jackcess
+    return getattr(jackcess, class_name)
+
+def pgcopy_data_path(filepath, model):
+    "Return the path of the PGCOPY binary data file for a model"
+    return os.path.abspath('%s.%s.pgcopy' % (os.path.splitext(filepath)[0],
+                                             model.db_table))
+
+def fixture_lines_path(filepath, model, index):
+    "Return the path of a JSON Lines fixture file for a model"
+    return os.path.abspath('%s.%s.%d.jsonl' % (os.path.splitext(filepath)[0],
+                                               model.db_table, index))
+
+def csv_data_path(filepath, model):
+    "Return the path of the CSV data file for a model"
+    return os.path.abspath('%s.%s.csv' % (os.path.splitext(filepath)[0],
+                                          model.db_table))
+
+def mysql_string(value):
+    "Quote a string as a MySQL literal"
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+def write_shard_manifest(manifest_path, model_shards):
+    """List the shard files of split tables for parallel loading
+
+    Tables appear in dependency order, with their level in the
+    `DependencyGraph`.  A stale manifest is removed if no tables were
+    split.
+    """
+    if not model_shards:
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return
+    level = model_shards[0][0].database.dependency_graph.level
+    manifest_file = file(manifest_path, 'w')
+    try:
+        json.dump(dict(tables=[dict(table=model.access_table.name,
+                                    db_table=model.db_table,
+                                    level=level[model],
+                                    shards=shards)
+                               for model, shards in model_shards]),
+                  manifest_file, indent=1)
+    finally:
+        manifest_file.close()
+
+def attach_thread_to_jvm():
+    """Make the JVM usable from the current thread
+
+    Only JPype needs this, Jython threads are Java threads already.
+    """
+    try:
+        import jpype
+    except ImportError: # jython
+        return
+    if jpype.isJVMStarted() and not jpype.isThreadAttachedToJVM():
+        jpype.attachThreadToJVM()
+
+class ParallelSegments(object):
+    """Produce per-model output segments in worker threads
+
+    Each worker opens its own read-only copy of the database and
+    spools the segments of the tables it picks from a shared queue to
+    temporary files.  Calling the instance with a model waits for the
+    segment of that model and generates its items exactly as the
+    serial segment method would.  Workers pick tables in the order in
+    which they are requested, so output can start as soon as the first
+    segment is ready.
+    """
+    def __init__(self, dbwrapper, output_type_name, models, jobs):
+        self.dbwrapper = dbwrapper
+        self.method_name = '%s_segment' % output_type_name
+        self.queue = Queue.Queue()
+        self.done = {}
+        self.results = {}
+        for model in models:
+            table_name = model.access_table.name
+            self.done[table_name] = threading.Event()
+            self.queue.put(table_name)
+        for i in range(min(jobs, len(models))):
+            worker = threading.Thread(target=self.work)
+            worker.setDaemon(True)
+            worker.start()
+
+    def work(self):
+        attach_thread_to_jvm()
+        try:
+            dbwrapper = self.dbwrapper.open_copy()
+            error = None
+        except Exception:
+            error = sys.exc_info()
+        while True:
+            try:
+                table_name = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                if error:
+                    raise error[0], error[1], error[2]
+                model = dbwrapper.get_model_by_table_name(table_name)
+                segment = tempfile.TemporaryFile()
+                for item in getattr(dbwrapper, self.method_name)(model):
+                    marshal.dump(item, segment)
+                segment.seek(0)
+                self.results[table_name] = segment, None
+            except Exception:
+                self.results[table_name] = None, sys.exc_info()
+            self.done[table_name].set()
+
+    def __call__(self, model):
+        table_name = model.access_table.name
+        while not self.done[table_name].isSet():
+            # waiting with a timeout keeps the main thread interruptible
+            self.done[table_name].wait(1.0)
+        segment, error = self.results.pop(table_name)
+        if error:
+            raise error[0], error[1], error[2]
+        for item in spooled_items(segment):
+            yield item
+
+def spooled_items(spool):
+    "Generate the items marshalled to a spool file, then close it"
+    try:
+        while True:
+            try:
+                yield marshal.load(spool)
+            except EOFError:
+                break
+    finally:
+        spool.close()
+
+class SharedScan(object):
+    """Read the rows of each table once for several data outputs
+
+    The data outputs are written one after another.  When one of them
+    requests the segment of a model which it reads first, the row
+    batches read for it are also converted by the segment methods of
+    the later outputs, in step with it, so only a few batches are held
+    in memory.  The items of the later outputs are spooled to temporary
+    files like in `ParallelSegments`, and read back when these outputs
+    request the segment.  Each output keeps its own order.
+
+    `segments` lists the segment kind and the models of each output in
+    the order of the outputs, see `DatabaseWrapper.data_segments`.
+    """
+    def __init__(self, dbwrapper, segments):
+        self.dbwrapper = dbwrapper
+        self.segments = segments
+        self.spools = {}
+
+    def shares(self, kind):
+        return kind in [segment_kind for segment_kind, models
+                        in self.segments]
+
+    def segment(self, kind):
+        "Return a function which generates the segment of one model"
+        kinds = [segment_kind for segment_kind, models in self.segments]
+        later = self.segments[kinds.index(kind) + 1:]
+        def shared_segment(model):
+            key = kind, model.access_table.name
+            if key in self.spools:
+                return spooled_items(self.spools.pop(key))
+            return self.scan(model, kind, [later_kind for later_kind, models
+                                           in later if model in models])
+        return shared_segment
+
+    def scan(self, model, kind, later_kinds):
+        """Generate the segment of a model for `kind` from a new read
+
+        The segments for `later_kinds` are spooled from the same rows.
+        """
+        feeds = itertools.tee(model.get_row_batches(), len(later_kinds) + 1)
+        fetched = [0] * len(feeds)
+        def counted(index):
+            for batch in feeds[index]:
+                fetched[index] += 1
+                yield batch
+        segments = [getattr(self.dbwrapper, '%s_segment' % segment_kind)(
+                        model, counted(index))
+                    for index, segment_kind
+                    in enumerate([kind] + later_kinds)]
+        followers = [(index, segments[index], tempfile.TemporaryFile())
+                     for index in range(1, len(segments))]
+        def follow(until=None):
+            "Spool items until each follower has read `until` batches"
+            for index, segment, spool in followers:
+                while until is None or fetched[index] < until:
+                    try:
+                        item = segment.next()
+                    except StopIteration:
+                        break
+                    marshal.dump(item, spool)
+        read = 0
+        for item in segments[0]:
+            yield item
+            if fetched[0] != read:
+                read = fetched[0]
+                follow(read)
+        follow()
+        for (index, segment, spool), later_kind in zip(followers,
+                                                       later_kinds):
+            spool.seek(0)
+            self.spools[later_kind, model.access_table.name] = spool
+
+    def close(self):
+        "Close the spools which haven't been read"
+        for spool in self.spools.values():
+            spool.close()
+        self.spools.clear()
+
+class BatchPipeline(object):
+    """Read and convert the row batches of a table in threads
+
+    A reader thread reads the batches into a queue, from which
+    `formatters` threads take them for `convert_batch`.  Iterating the
+    pipeline generates the converted batches in the order of the rows.
+    At most `depth` batches are read ahead of the converted batch last
+    generated, so memory use doesn't depend on how much faster reading
+    and conversion are than writing the output.  Errors in the threads
+    are raised when the batch they concern is due.
+    """
+    END = object()
+
+    def __init__(self, batches, convert_batch, depth, formatters=1):
+        self.batches = batches
+        self.convert_batch = convert_batch
+        self.slots = Queue.Queue(depth)
+        self.read_batches = Queue.Queue()
+        self.converted = Queue.Queue()
+        self.closed = False
+        self.formatters = formatters
+        self.reader = threading.Thread(target=self.read)
+        self.reader.setDaemon(True)
+        self.reader.start()
+        for i in range(formatters):
+            formatter = threading.Thread(target=self.convert)
+            formatter.setDaemon(True)
+            formatter.start()
+
+    def read(self):
+        attach_thread_to_jvm()
+        index = 0
+        try:
+            try:
+                batches = iter(self.batches)
+                while True:
+                    self.slots.put(None) # blocks while depth batches wait
+                    if self.closed:
+                        break
+                    try:
+                        batch = batches.next()
+                    except StopIteration:
+                        break
+                    self.read_batches.put((index, batch))
+                    index += 1
+                self.converted.put((index, self.END, None))
+            except Exception:
+                self.converted.put((index, None, sys.exc_info()))
+        finally:
+            for i in range(self.formatters):
+                self.read_batches.put(None)
+
+    def convert(self):
+        attach_thread_to_jvm()
+        for index, batch in iter(self.read_batches.get, None):
+            try:
+                self.converted.put((index, self.convert_batch(batch), None))
+            except Exception:
+                self.converted.put((index, None, sys.exc_info()))
+
+    def __iter__(self):
+        results = {}
+        end = None
+        index = 0
+        try:
+            while end is None or index < end:
+                if index in results:
+                    result, error = results.pop(index)
+                    if error:
+                        raise error[0], error[1], error[2]
+                    index += 1
+                    self.slots.get() # the reader may read another batch
+                    yield result
+                    continue
+                try:
+                    # waiting with a timeout keeps the main thread
+                    # interruptible
+                    item_index, result, error = self.converted.get(True, 1.0)
+                except Queue.Empty:
+                    continue
+                if result is self.END:
+                    end = item_index
+                else:
+                    results[item_index] = result, error
+        finally:
+            self.close()
+
+    def close(self):
+        "Stop the reader, which may be waiting for a slot"
+        self.closed = True
+        while self.reader.isAlive():
+            try:
+                self.slots.get_nowait()
+            except Queue.Empty:
+                pass
+            self.reader.join(0.1)
+
+class ShardWriter(object):
+    """Write the shard files of split tables
+
+    With more than one job, the shards are written by worker threads,
+    each reading through its own copy of the database, while the rest
+    of the output is generated.  Otherwise they are written by `wait`.
+    """
+    def __init__(self, dbwrapper, shards, jobs):
+        self.dbwrapper = dbwrapper
+        self.shards = shards
+        self.errors = []
+        self.workers = []
+        if jobs > 1:
+            self.queue = Queue.Queue()
+            for shard in shards:
+                self.queue.put(shard)
+            for i in range(min(jobs, len(shards))):
+                worker = threading.Thread(target=self.work)
+                worker.setDaemon(True)
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        attach_thread_to_jvm()
+        try:
+            dbwrapper = self.dbwrapper.open_copy()
+            while True:
+                try:
+                    shard = self.queue.get_nowait()
+                except Queue.Empty:
+                    return
+                dbwrapper.write_shard(*shard)
+        except Exception:
+            self.errors.append(sys.exc_info())
+
+    def wait(self):
+        if not self.workers:
+            for shard in self.shards:
+                self.dbwrapper.write_shard(*shard)
+        for worker in self.workers:
+            while worker.isAlive():
+                worker.join(1.0)
+        if self.errors:
+            error = self.errors[0]
+            raise error[0], error[1], error[2]
+
 def make_option_parser():
     from optparse import OptionParser
     p = OptionParser()
@@ -660,28 +2384,232 @@ def make_option_parser():
     p.add_option('-n', '--app-name', action='store', default='myapp')
     p.add_option('-s', '--schema', action='store')
     p.add_option('-k', '--keep-table-names', action='store_true')
+    p.add_option('--pairwise-relationships', action='store_true',
+                 help='query relationships for each pair of tables '
+                      'instead of reading MSysRelationships')
+    p.add_option('--backend', type='choice', choices=['jackcess', 'jet4'],
+                 default='jackcess',
+                 help='read the MDB file with Jackcess or with the '
+                      'pure-Python Jet 4 reader which needs no JVM')
+    p.add_option('--dump-schema', action='store', metavar='FILE',
+                 help='save the schema as a JSON snapshot for --from-schema')
+    p.add_option('--from-schema', action='store', metavar='FILE',
+                 help='generate models and admin from a schema snapshot '
+                      'instead of an MDB file')
     p.add_option('-P', '--progress', action='store_true')
+    p.add_option('--progress-interval', action='store', type='float',
+                 default=PROGRESS_INTERVAL,
+                 help='seconds between progress reports')
+    p.add_option('--metrics-file', action='store',
+                 help='write timings, row and byte counts of each output '
+                      'type and table to this JSON file')
+    p.add_option('--pg-format', type='choice', choices=['text', 'binary'],
+                 default='text',
+                 help='COPY data format for PostgreSQL output and loading')
+    p.add_option('--shard-threshold', action='store', type='int',
+                 help='split the COPY data of tables with more rows '
+                      'into separate shard files, written in parallel '
+                      'only with --jobs above 1')
+    p.add_option('--shards', action='store', type='int', default=4,
+                 help='number of shard files for each split table')
+    p.add_option('--pg-dsn', action='store',
+                 help='load data directly into this PostgreSQL database')
+    p.add_option('--batch-rows', action='store', type='int',
+                 default=FETCH_BATCH_ROWS,
+                 help='number of rows read and converted at a time')
+    p.add_option('--fixture-format', type='choice',
+                 choices=['json', 'jsonl'], default='json',
+                 help='write the fixture as one JSON array, or as JSON Lines '
+                      'files listed in the fixture file')
+    p.add_option('--fixture-rows', action='store', type='int',
+                 default=FIXTURE_FILE_ROWS,
+                 help='maximum number of rows in each JSON Lines file')
+    p.add_option('--csv-null', action='store', default=CSV_NULL,
+                 help='marker for null values in CSV data files')
+    p.add_option('--columnar', action='store_true',
+                 help='convert the rows of each batch column by column '
+                      'with NumPy')
+    p.add_option('--sqlite-file', action='store', metavar='FILE',
+                 help='load all data into a new SQLite database file')
+    p.add_option('--compress-level', action='store', type='int',
+                 help='compression level for output files ending in .gz '
+                      'or .zst')
+    p.add_option('-i', '--incremental', action='store_true',
+                 help='reuse the data of unchanged tables from the '
+                      'previous fixture and postgresql outputs, unless '
+                      'they are compressed')
+    p.add_option('-j', '--jobs', action='store', type='int', default=1,
+                 help='number of worker threads for data outputs')
+    p.add_option('--pipeline', action='store_true',
+                 help='read, convert and write the rows of data outputs '
+                      'in separate threads')
+    p.add_option('--pipeline-batches', action='store', type='int',
+                 default=PIPELINE_BATCHES,
+                 help='maximum number of row batches read ahead of the '
+                      'output with --pipeline')
+    p.add_option('--formatters', action='store', type='int', default=1,
+                 help='number of threads converting rows with --pipeline')
+    p.add_option('--serve', action='store', metavar='SOCKET',
+                 help='run as a daemon converting the jobs sent to this '
+                      'Unix socket in a warm JVM')
+    p.add_option('--connect', action='store', metavar='SOCKET',
+                 help='send the conversion to the daemon listening on '
+                      'this Unix socket')
     p.add_option('-d', '--debug', action='store')
     return p
 
 def check_arguments(option_parser, opts, args):
-    if len(args) != 1:
+    if opts.from_schema:
+        if args:
+            option_parser.error('no MDB file expected with --from-schema')
+        for output_type in DatabaseWrapper.OUTPUT_TYPES:
+            if (not output_type.schema_only and
+                getattr(opts, output_type.attr) is not None):
+                option_parser.error('the schema snapshot has no rows for %s'
+                                    % output_type.long)
+        for option in '--pg-dsn', '--sqlite-file':
+            if getattr(opts, option[2:].replace('-', '_')):
+                option_parser.error('the schema snapshot has no rows for %s'
+                                    % option)
+    elif len(args) != 1:
         option_parser.error('only one argument expected')
+    if opts.batch_rows < 1:
+        option_parser.error('--batch-rows must be at least 1')
+    if opts.shards < 1:
+        option_parser.error('--shards must be at least 1')
+    if opts.fixture_rows < 1:
+        option_parser.error('--fixture-rows must be at least 1')
+    if opts.pipeline_batches < 1 or opts.formatters < 1:
+        option_parser.error('--pipeline-batches and --formatters must be '
+                            'at least 1')
 
 def make_database_wrapper(opts, args,
                           table2model_name=lambda s: s,
                           column2field_name=lambda c, pk: c,
-                          custom_conversion=lambda t, c, v: v):
-    return DatabaseWrapper.from_file(args[0],
+                          custom_conversion=no_conversion):
+    if opts.from_schema:
+        filepath, backend = opts.from_schema, 'snapshot'
+    else:
+        filepath, backend = args[0], opts.backend
+    return DatabaseWrapper.from_file(filepath,
+                                     backend=backend,
                                      app_name=opts.app_name,
                                      schema=opts.schema,
                                      keep_table_names=opts.keep_table_names,
                                      table2model_name=table2model_name,
                                      column2field_name=column2field_name,
-                                     custom_conversion=custom_conversion)
-
-def write_to_file_or_stdout(line_generator, filepath, title, progress_callback,
-                            comment_char='#'):
+                                     custom_conversion=custom_conversion,
+                                     relationship_catalog=(
+                                         not opts.pairwise_relationships),
+                                     pg_format=opts.pg_format,
+                                     shard_threshold=opts.shard_threshold,
+                                     shards=opts.shards,
+                                     batch_rows=opts.batch_rows,
+                                     columnar=opts.columnar,
+                                     csv_null=opts.csv_null,
+                                     fixture_format=opts.fixture_format,
+                                     fixture_rows=opts.fixture_rows,
+                                     pipeline_batches=(
+                                         opts.pipeline_batches
+                                         if opts.pipeline else None),
+                                     formatters=opts.formatters)
+
+def is_compressed(filepath):
+    return os.path.splitext(filepath)[1] in COMPRESSION_SUFFIXES
+
+class ThreadedOutput(object):
+    """A file-like object writing its output in a separate thread
+
+    Written data goes through a buffered pipe to a thread which writes
+    it to the file, so disk writes overlap with generating the output.
+    Writing blocks while the pipe is full, so no more than the buffer
+    and the pipe hold unwritten data.  Subclasses write to another
+    file-like `target` wrapping the raw file.
+    """
+    def __init__(self, filepath, mode='wb'):
+        self.raw = file(filepath, mode)
+        try:
+            self.target = self.open_target(filepath)
+        except:
+            self.raw.close()
+            raise
+        read_fd, write_fd = os.pipe()
+        self.pipe = os.fdopen(write_fd, 'wb', OUTPUT_BUFFER_SIZE)
+        self.write = self.pipe.write
+        self.error = None
+        self.thread = threading.Thread(target=self.work, args=(read_fd,))
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def open_target(self, filepath):
+        return self.raw
+
+    def work(self, read_fd):
+        try:
+            try:
+                for chunk in iter(lambda: os.read(read_fd, OUTPUT_BUFFER_SIZE),
+                                  ''):
+                    self.target.write(chunk)
+            except Exception, e:
+                self.error = e
+        finally:
+            os.close(read_fd) # writing fails from now on
+
+    def close(self):
+        try:
+            try:
+                self.pipe.close()
+            finally:
+                self.thread.join()
+            if self.error is not None:
+                raise self.error
+            if self.target is not self.raw:
+                self.target.close()
+        finally:
+            self.raw.close()
+
+class CompressedOutput(ThreadedOutput):
+    """A file-like object compressing its output in a separate thread
+
+    Files ending in ``.gz`` are written with gzip, files ending in
+    ``.zst`` with the ``zstandard`` module.  `level` defaults to the
+    default level of the compressor.
+    """
+    def __init__(self, filepath, level=None):
+        self.level = level
+        ThreadedOutput.__init__(self, filepath)
+
+    def open_target(self, filepath):
+        level = self.level
+        if filepath.endswith('.zst'):
+            import zstandard
+            if level is None:
+                level = 3
+            return zstandard.ZstdCompressor(level=level).stream_writer(
+                self.raw)
+        if level is None:
+            level = 6
+        return gzip.GzipFile(os.path.basename(filepath)[:-3], 'wb', level,
+                             self.raw)
+
+def write_to_file_or_stdout(line_generator, filepath, title,
+                            progress_callback=None, comment_char='#',
+                            metrics=None, compress_level=None,
+                            threaded=False):
+    """Write the lines from a generator to a file or to standard output
+
+    Files ending in one of `COMPRESSION_SUFFIXES` are compressed while
+    they are written, see `CompressedOutput`.  Other files are written
+    in a separate thread if `threaded` is true, see `ThreadedOutput`.
+
+    `progress_callback` is deprecated and never called.  The
+    generators no longer yield progress items, a `ProgressReporter`
+    samples the `Progress` of the database wrapper instead.
+    """
+    if progress_callback is not None:
+        warnings.warn('progress_callback is ignored, use a '
+                      'ProgressReporter sampling DatabaseWrapper.progress',
+                      DeprecationWarning, stacklevel=2)
     if filepath is None:
         return None
     if filepath == '-':
@@ -689,48 +2617,575 @@ def write_to_file_or_stdout(line_generator, filepath, title, progress_callback,
         output.write('\n\n%s %s %s\n\n' % ((68-len(title)) * comment_char,
                                            title,
                                            2*comment_char))
+    elif is_compressed(filepath):
+        output = CompressedOutput(filepath, compress_level)
+    elif threaded:
+        output = ThreadedOutput(filepath, 'w')
     else:
+        output = file(filepath, 'w', OUTPUT_BUFFER_SIZE)
+    writer = output
+    if metrics is not None:
+        writer = metrics.output(output)
+    try:
+        for line in line_generator():
+            print >>writer, line
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+class Progress(object):
+    """The progress of an output
+
+    The output generators count the work `done` out of `total` and
+    describe it in `message`.  A `ProgressReporter` samples these.
+    """
+    def __init__(self):
+        self.start(0)
+
+    def start(self, total, message=''):
+        self.total = total
+        self.done = 0
+        self.message = message
+
+    @property
+    def fraction(self):
+        if not self.total:
+            return 0.0
+        return min(1.0, float(self.done) / self.total)
+
+class ProgressReporter(object):
+    """Report progress from a thread at a fixed interval
+
+    `sample` returns the completed fraction of the work and a message.
+    `report` is called with them and the estimated number of seconds
+    remaining (None if unknown) whenever the percentage or the message
+    has changed.
+    """
+    def __init__(self, sample, report, interval=PROGRESS_INTERVAL):
+        self.sample = sample
+        self.report = report
+        self.interval = interval
+        self.previous = None
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            self.stopped.wait(self.interval)
+            if self.stopped.isSet():
+                break
+            self.tick()
+
+    def tick(self):
+        fraction, message = self.sample()
+        percent = int(100.0 * fraction)
+        if (percent, message) == self.previous:
+            return
+        self.previous = percent, message
+        remaining = None
+        if fraction > 0.0:
+            elapsed = time.time() - self.started
+            remaining = elapsed * (1.0 - fraction) / fraction
+        self.report(fraction, message, remaining)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.tick()
+
+def report_progress(fraction, message, remaining):
+    line = '%d %s' % (int(100.0 * fraction), message)
+    if remaining is not None:
+        remaining = int(remaining)
+        line += ' (ETA %d:%02d:%02d)' % (
+            remaining // 3600, remaining // 60 % 60, remaining % 60)
+    print line
+
+class NoMetrics(object):
+    "Metrics collection which is turned off and costs nothing"
+    def start_output(self, output_type_name):
+        pass
+
+    def start_model(self, model):
+        pass
+
+    def rows(self, model, rows):
+        return rows
+
+    def batch_converter(self, model, convert_batch):
+        return convert_batch
+
+    def output(self, output, model=None):
+        return output
+
+NO_METRICS = NoMetrics()
+
+class Metrics(NoMetrics):
+    """Collect timings and counts for each output type and model
+
+    For every table the wall time of producing its output is recorded,
+    along with the time spent reading row batches
+    (`Model.get_row_batches`), in value conversion and in writing, and
+    the number of rows converted and bytes written.  Reading and
+    conversion are also timed in parallel workers and shard writers,
+    so the sum of these can exceed the wall time, which is measured in
+    the main thread.
+    """
+    FIELDS = ('wall_seconds', 'read_seconds', 'conversion_seconds',
+              'write_seconds', 'rows', 'bytes')
+
+    def __init__(self):
+        self.output_types = []
+        self.records = {}
+        self.lock = threading.Lock()
+        self.output_type_name = None
+        self.current = None
+        self.started = None
+
+    def new_record(self):
+        return dict((field, 0) for field in self.FIELDS)
+
+    def record(self, model):
+        key = self.output_type_name, model.access_table.name
+        self.lock.acquire()
+        try:
+            if key not in self.records:
+                self.records[key] = self.new_record()
+                self.records[key]['model'] = model.name
+                self.output_types[-1]['tables'].append(
+                    (model.access_table.name, self.records[key]))
+            return self.records[key]
+        finally:
+            self.lock.release()
+
+    def stop_timing(self):
+        if self.current is not None:
+            now = time.time()
+            self.current['wall_seconds'] += now - self.started
+            self.started = now
+
+    def start_output(self, output_type_name):
+        self.finish()
+        self.output_type_name = output_type_name
+        self.output_types.append(dict(output_type=output_type_name,
+                                      started=time.time(),
+                                      other=self.new_record(),
+                                      tables=[]))
+        self.current = self.output_types[-1]['other']
+        self.started = time.time()
+
+    def start_model(self, model):
+        self.stop_timing()
+        self.current = self.record(model)
+
+    def finish(self):
+        self.stop_timing()
+        if self.output_types and 'wall_seconds' not in self.output_types[-1]:
+            self.output_types[-1]['wall_seconds'] = (
+                time.time() - self.output_types[-1].pop('started'))
+        self.current = None
+
+    def rows(self, model, rows):
+        record = self.record(model)
+        rows = iter(rows)
+        while True:
+            started = time.time()
+            try:
+                row = rows.next()
+            finally:
+                record['read_seconds'] += time.time() - started
+            yield row
+
+    def batch_converter(self, model, convert_batch):
+        record = self.record(model)
+        lock = self.lock
+        def convert(batch):
+            started = time.time()
+            result = convert_batch(batch)
+            seconds = time.time() - started
+            lock.acquire() # batches may be converted in several threads
+            try:
+                record['conversion_seconds'] += seconds
+                record['rows'] += len(result)
+            finally:
+                lock.release()
+            return result
+        return convert
+
+    def output(self, output, model=None):
+        if model is None:
+            return MeasuredOutput(output, lambda: self.current)
+        record = self.record(model)
+        return MeasuredOutput(output, lambda: record)
+
+    def as_dict(self):
+        self.finish()
+        return dict(outputs=[
+            dict(output_type=output_type['output_type'],
+                 wall_seconds=output_type['wall_seconds'],
+                 other=output_type['other'],
+                 tables=[dict(record, table=table_name)
+                         for table_name, record in output_type['tables']])
+            for output_type in self.output_types])
+
+    def save(self, filepath):
         output = file(filepath, 'w')
-    lines = line_generator()
-    total_estimate = None
-    for item in lines:
-        if isinstance(item, (str, unicode)):
-            print >>output, item
-        elif progress_callback:
-            # `item` is tuple (number of lines remaining, message)
-            if total_estimate is None:
-                total_estimate = float(item[0])
-            progress_callback(1.0 - (item[0] / total_estimate), item[1])
+        try:
+            json.dump(self.as_dict(), output, indent=1, sort_keys=True)
+        finally:
+            output.close()
+
+class MeasuredOutput(object):
+    """Count the bytes and time spent writing to a file
+
+    The counts are added to the metrics record returned by
+    `get_record`.
+    """
+    def __init__(self, output, get_record):
+        self.output = output
+        self.get_record = get_record
+
+    def write(self, data):
+        started = time.time()
+        self.output.write(data)
+        record = self.get_record()
+        record['write_seconds'] += time.time() - started
+        record['bytes'] += len(data)
+
+class SegmentCache(object):
+    """Reuse the output segments of unchanged tables from a previous run
+
+    A manifest next to the output file records the fingerprint of each
+    table (see `Model.fingerprint`) and the byte range of its segment
+    in the output.  The segments of tables whose fingerprint hasn't
+    changed are read back from the previous output instead of being
+    converted again.  The new output must be written to a different
+    file, which replaces the previous one when it is complete.
+
+    The caches of the outputs of a run can share a `fingerprints`
+    dict, so each table is fingerprinted only once.
+    """
+    def __init__(self, filepath, output_type_name, settings,
+                 fingerprints=None):
+        self.filepath = filepath
+        self.manifest_path = '%s.manifest' % filepath
+        self.output_type_name = output_type_name
+        self.settings = settings
+        self.previous = {}
+        self.tables = {}
+        if fingerprints is None:
+            fingerprints = {}
+        self.fingerprints = fingerprints
+        try:
+            manifest = json.load(open(self.manifest_path))
+        except (IOError, ValueError):
+            return
+        if (manifest.get('settings') == settings and
+            os.path.exists(filepath) and
+            os.path.getsize(filepath) == manifest.get('size')):
+            self.previous = manifest['tables']
+
+    def is_unchanged(self, model):
+        table_name = model.access_table.name
+        if table_name not in self.tables:
+            if table_name not in self.fingerprints:
+                self.fingerprints[table_name] = model.fingerprint()
+            rows, digest = self.fingerprints[table_name]
+            self.tables[table_name] = dict(model=model.name,
+                                           rows=rows,
+                                           hash=digest)
+        current = self.tables[table_name]
+        previous = self.previous.get(table_name)
+        return previous is not None and (
+            [previous.get(key) for key in ('model', 'rows', 'hash')] ==
+            [current[key] for key in ('model', 'rows', 'hash')])
+
+    def spliced(self, model):
+        """Generate the segment of a model from the previous output
+
+        Fixture rows are stripped of their separators, which the
+        fixture output adds back depending on their new position.
+        """
+        previous = self.previous[model.access_table.name]
+        strip_separators = self.output_type_name == 'fixture'
+        output = file(self.filepath, 'rb')
+        try:
+            output.seek(previous['offset'])
+            remaining = previous['length']
+            while remaining > 0:
+                line = output.readline(remaining)
+                if not line:
+                    raise IOError('%s is truncated' % self.filepath)
+                remaining -= len(line)
+                line = line.rstrip('\n')
+                if strip_separators:
+                    line = line[1:-1]
+                yield line
+        finally:
+            output.close()
+
+    def has_segment(self, model):
+        "Tell whether the previous output contains the segment of a model"
+        previous = self.previous.get(model.access_table.name)
+        return previous is not None and previous.get('offset') is not None
+
+    def has_shards(self, model, shards):
+        """Tell whether the previous run wrote the same shard files
+
+        The shards must cover the same row ranges and still exist.
+        """
+        previous = self.previous.get(model.access_table.name)
+        if previous is None:
+            return False
+        ranges = [[shard['path'], shard['start'], shard['stop']]
+                  for shard in shards]
+        return (previous.get('shards') == ranges and
+                all(os.path.exists(path) for path, start, stop in ranges))
+
+    def record(self, model, offset=None, length=None, shards=None):
+        """Record the byte range of a model segment in the new output
+
+        For a table split into shard files, the shards are recorded
+        instead.
+        """
+        table = self.tables[model.access_table.name]
+        table.update(offset=offset, length=length)
+        if shards is not None:
+            table['shards'] = [[shard['path'], shard['start'], shard['stop']]
+                               for shard in shards]
+
+    def save(self):
+        manifest = dict(settings=self.settings,
+                        size=os.path.getsize(self.filepath),
+                        tables=self.tables)
+        manifest_file = file(self.manifest_path, 'w')
+        try:
+            json.dump(manifest, manifest_file)
+        finally:
+            manifest_file.close()
+
+class CopyStream(object):
+    """A file-like object reading COPY data lines from a generator
+
+    Lines are pulled from the generator only as they are read, so at
+    most one read size and one line of data is buffered at a time.
+    """
+    def __init__(self, lines, terminator='\n', header='', trailer=''):
+        self.lines = iter(lines)
+        self.terminator = terminator
+        self.buffer = header
+        self.trailer = trailer
+        self.count = 0
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        for line in self.lines:
+            self.count += 1
+            chunks.append(line)
+            chunks.append(self.terminator)
+            length += len(line) + len(self.terminator)
+            if 0 <= size <= length:
+                break
+        else:
+            chunks.append(self.trailer)
+            self.trailer = ''
+        data = ''.join(chunks)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+def load_postgresql(dbwrapper, dsn, report=None):
+    """Load all data directly into a PostgreSQL database
+
+    Rows are streamed over the COPY protocol using psycopg2, each table
+    in a connection and transaction of its own.  `report` is called
+    with the model, the number of rows and the elapsed seconds after
+    each table.
+    """
+    import psycopg2
+    binary = dbwrapper.pg_format == 'binary'
+    if binary:
+        check_pgbinary_columns(dbwrapper.ordered_models)
+    connection = psycopg2.connect(dsn)
+    try:
+        cursor = connection.cursor()
+        for model in reversed(dbwrapper.ordered_models):
+            cursor.execute(model.delete_as_pg())
+        connection.commit()
+    finally:
+        connection.close()
+    for model in dbwrapper.ordered_models:
+        started = time.time()
+        if binary:
+            stream = CopyStream(
+                model.pgcopy_binary_rows(dbwrapper.valueconversion),
+                terminator='', header=PGCOPY_HEADER, trailer=PGCOPY_TRAILER)
+        else:
+            stream = CopyStream(
+                model.pgcopy_rows(dbwrapper.valueconversion))
+        connection = psycopg2.connect(dsn)
+        try:
+            connection.cursor().copy_expert(model.copy_statement(binary),
+                                            stream, COPY_BUFFER_SIZE)
+            connection.commit()
+        finally:
+            connection.close()
+        if report:
+            report(model, stream.count, time.time() - started)
+
+def load_sqlite(dbwrapper, filepath, report=None):
+    """Load all data into a new SQLite database file
+
+    Tables are named after `Model.db_table`.  The rows of each table
+    are inserted with ``executemany`` in a transaction of its own, with
+    journaling and syncing turned off, and the indexes are created
+    after all data is loaded.  `report` is called with the model, the
+    number of rows and the elapsed seconds after each table.
+    """
+    import sqlite3
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    connection = sqlite3.connect(filepath, isolation_level=None)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode = OFF')
+        cursor.execute('PRAGMA synchronous = OFF')
+        cursor.execute('BEGIN')
+        for model in dbwrapper.ordered_models:
+            cursor.execute(model.sqlite_create_statement())
+        cursor.execute('COMMIT')
+        for model in dbwrapper.ordered_models:
+            started = time.time()
+            cursor.execute('BEGIN')
+            cursor.executemany(model.sqlite_insert_statement(),
+                               model.sqlite_rows(dbwrapper.valueconversion))
+            rows = cursor.rowcount
+            cursor.execute('COMMIT')
+            if report:
+                report(model, rows, time.time() - started)
+        cursor.execute('BEGIN')
+        for model in dbwrapper.ordered_models:
+            for statement in model.sqlite_index_statements():
+                cursor.execute(statement)
+        cursor.execute('COMMIT')
+    finally:
+        connection.close()
+
+def report_load_speed(model, rows, seconds):
+    print '%s: %d rows in %.1f s, %.0f rows/s' % (
+        model.name, rows, seconds, rows / max(seconds, 1e-6))
+
+def report_dependency_problems(graph):
+    "Warn about foreign keys which Django models can't refer to in order"
+    for model in graph.self_references:
+        print >>sys.stderr, 'warning: %s has a foreign key to itself' % (
+            model.name)
+    for cycle in graph.cycles:
+        print >>sys.stderr, 'warning: circular foreign keys: %s' % (
+            ' -> '.join(model.name for model in cycle + cycle[:1]))
 
 def run_conversion(dbwrapper, opts):
     total_work = sum((t.work for t in dbwrapper.OUTPUT_TYPES
                       if getattr(opts, t.attr) is not None),
                      0.0)
-    work_offset = 0.0
-    for output_type in dbwrapper.OUTPUT_TYPES:
-        filepath = getattr(opts, output_type.attr)
-        if filepath is None:
-            continue
-
-        if opts.progress:
-            def progress_callback(progress, message):
-                progress = max(0.0, min(100.0, progress))
-                current = int(100.0 *
-                              (work_offset + progress * output_type.work) /
-                              total_work)
-                if (current, message) != progress_callback.previous:
-                    print current, message
-                    progress_callback.previous = current, message
-            progress_callback.previous = 0, ''
-        else:
-            progress_callback = None
+    metrics = None
+    if opts.metrics_file:
+        metrics = Metrics()
+    dbwrapper.metrics = metrics or NO_METRICS
+    current = [(0.0, None)] # work offset and type of the current output
+
+    def sample_progress():
+        work_offset, output_type = current[0]
+        if output_type is None:
+            return 0.0, ''
+        progress = dbwrapper.progress
+        return ((work_offset + progress.fraction * output_type.work) /
+                total_work), progress.message
+
+    reporter = None
+    if opts.progress:
+        reporter = ProgressReporter(sample_progress, report_progress,
+                                    opts.progress_interval)
+        reporter.start()
+    try:
+        if opts.dump_schema:
+            dbwrapper.dump_schema(opts.dump_schema)
+        report_dependency_problems(dbwrapper.dependency_graph)
+        data_outputs = [output_type.name
+                        for output_type in dbwrapper.OUTPUT_TYPES
+                        if output_type.segmented and
+                        getattr(opts, output_type.attr) is not None]
+        if len(data_outputs) > 1 and opts.jobs <= 1 and not opts.pipeline:
+            dbwrapper.share_scans(data_outputs)
+        fingerprints = {} # shared by the segment caches of the outputs
+        work_offset = 0.0
+        for output_type in dbwrapper.OUTPUT_TYPES:
+            filepath = getattr(opts, output_type.attr)
+            if filepath is None:
+                continue
 
-        write_to_file_or_stdout(getattr(dbwrapper, output_type.method_name),
-                                filepath,
-                                output_type.title,
-                                progress_callback,
-                                comment_char=output_type.comment_char)
-        work_offset += output_type.work
+            kwargs = {}
+            if output_type.segmented and opts.jobs > 1:
+                kwargs['jobs'] = opts.jobs
+            if output_type.needs_filepath:
+                kwargs['filepath'] = filepath
+            output_path = filepath
+            if (output_type.segmented and opts.incremental and
+                filepath != '-' and not is_compressed(filepath)):
+                kwargs['cache'] = SegmentCache(
+                    filepath, output_type.name,
+                    dbwrapper.output_settings(output_type.name),
+                    fingerprints)
+                # the previous output is read while the new one is written
+                output_path = '%s.tmp' % filepath
+            elif os.path.exists('%s.manifest' % filepath):
+                # the manifest would not match the new output
+                os.remove('%s.manifest' % filepath)
+            method = getattr(dbwrapper, output_type.method_name)
+            line_generator = (lambda method=method, kwargs=kwargs:
+                              method(**kwargs))
+
+            if metrics is not None:
+                metrics.start_output(output_type.name)
+            dbwrapper.progress.start(0)
+            current[0] = work_offset, output_type
+            write_to_file_or_stdout(line_generator,
+                                    output_path,
+                                    output_type.title,
+                                    comment_char=output_type.comment_char,
+                                    metrics=metrics,
+                                    compress_level=opts.compress_level,
+                                    threaded=opts.pipeline)
+            if output_path != filepath:
+                if os.path.exists(filepath):
+                    os.remove(filepath) # os.rename can't replace on Windows
+                os.rename(output_path, filepath)
+                kwargs['cache'].save()
+            work_offset += output_type.work
+    finally:
+        if dbwrapper.shared_scan is not None:
+            dbwrapper.shared_scan.close()
+            dbwrapper.shared_scan = None
+        if reporter is not None:
+            reporter.stop()
+
+    if metrics is not None:
+        dbwrapper.metrics = NO_METRICS
+        metrics.save(opts.metrics_file)
+
+    if opts.pg_dsn:
+        load_postgresql(dbwrapper, opts.pg_dsn, report=report_load_speed)
+
+    if opts.sqlite_file:
+        load_sqlite(dbwrapper, opts.sqlite_file, report=report_load_speed)
 
     if opts.debug: # print list of relations as Python comments
         for (to_table, to_column), relation in d.relationships.items():
@@ -738,9 +3193,227 @@ def run_conversion(dbwrapper, opts):
                 to_table, to_column,
                 relation.fromTable.name, relation.fromColumns[0].name)
 
+FRAME_HEADER = struct.Struct('>cI')
+
+class FrameWriter(object):
+    """A file-like object sending its output to a daemon client
+
+    Data is buffered and sent in frames tagged with `stream`, which is
+    'o' for standard output and 'e' for standard error.  The progress
+    reporter thread may write at the same time as the job.
+    """
+    def __init__(self, connection, stream):
+        self.connection = connection
+        self.stream = stream
+        self.buffer = []
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('UTF-8')
+        self.lock.acquire()
+        try:
+            self.buffer.append(data)
+            self.size += len(data)
+            if self.size >= COPY_BUFFER_SIZE:
+                self._send()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self._send()
+        finally:
+            self.lock.release()
+
+    def _send(self):
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        if data:
+            self.connection.sendall(
+                FRAME_HEADER.pack(self.stream, len(data)) + data)
+
+class ConversionDaemon(object):
+    """Run conversion jobs received on a Unix socket in a warm JVM
+
+    Each client sends one JSON line with its command line arguments and
+    working directory.  The daemon runs the job and streams standard
+    output and error back, followed by the exit status.  The file paths
+    of the job are resolved relative to the working directory of the
+    client, without changing the working directory of the daemon.  The
+    socket is only accessible to the user running the daemon, whose
+    permissions the jobs have.
+
+    Opened database wrappers are cached by the path and modification
+    time of the MDB file and by the options affecting the wrapper, so
+    repeated jobs skip opening the file and reading its schema.  Jobs
+    are run one at a time.
+    """
+    WRAPPER_OPTIONS = ('backend', 'from_schema', 'app_name', 'schema',
+                       'keep_table_names', 'pairwise_relationships',
+                       'pg_format', 'shard_threshold', 'shards', 'batch_rows',
+                       'columnar', 'csv_null', 'fixture_format',
+                       'fixture_rows', 'pipeline', 'pipeline_batches',
+                       'formatters')
+    PATH_OPTIONS = ('dump_schema', 'from_schema', 'metrics_file',
+                    'sqlite_file')
+
+    def __init__(self, socket_path, wrapper_factory=make_database_wrapper,
+                 cache_size=DAEMON_CACHE_SIZE):
+        self.socket_path = socket_path
+        self.wrapper_factory = wrapper_factory
+        self.cache_size = cache_size
+        self.wrappers = {}
+        self.recent = [] # cache keys, least recently used first
+
+    def get_wrapper(self, opts, args):
+        filepath = os.path.abspath(opts.from_schema or args[0])
+        stat = os.stat(filepath)
+        key = (filepath, stat.st_mtime, stat.st_size) + tuple(
+            getattr(opts, name) for name in self.WRAPPER_OPTIONS)
+        if key in self.wrappers:
+            self.recent.remove(key)
+        else:
+            for stale_key in [k for k in self.recent
+                              if k[0] == filepath and k[1:3] != key[1:3]]:
+                self.evict(stale_key)
+            self.wrappers[key] = self.wrapper_factory(opts, [filepath])
+        self.recent.append(key)
+        while len(self.recent) > self.cache_size:
+            self.evict(self.recent[0])
+        return self.wrappers[key]
+
+    def evict(self, key):
+        self.recent.remove(key)
+        dbwrapper = self.wrappers.pop(key)
+        dbwrapper.invalidate()
+        if hasattr(dbwrapper.db, 'close'):
+            dbwrapper.db.close()
+
+    def resolve_paths(self, opts, args, cwd):
+        """Make the file paths of a job absolute, relative to `cwd`
+
+        Sets the output and other file options of `opts` and returns
+        the resolved arguments.
+        """
+        for name in ([output_type.attr
+                      for output_type in DatabaseWrapper.OUTPUT_TYPES] +
+                     list(self.PATH_OPTIONS)):
+            path = getattr(opts, name)
+            if path and path != '-':
+                setattr(opts, name, os.path.join(cwd, path))
+        return [os.path.join(cwd, arg) for arg in args]
+
+    def run_job(self, argv, cwd):
+        option_parser = make_option_parser()
+        opts, args = option_parser.parse_args(argv)
+        args = self.resolve_paths(opts, args, cwd)
+        check_arguments(option_parser, opts, args)
+        run_conversion(self.get_wrapper(opts, args), opts)
+
+    def handle(self, connection):
+        request = json.loads(connection.makefile('rb').readline())
+        stdout = FrameWriter(connection, 'o')
+        stderr = FrameWriter(connection, 'e')
+        saved = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = stdout, stderr
+        status = 0
+        try:
+            try:
+                self.run_job(request['args'], request['cwd'])
+            except SystemExit, exc:
+                status = exc.code
+                if not isinstance(status, (int, long, type(None))):
+                    print >>sys.stderr, status
+                    status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        finally:
+            sys.stdout, sys.stderr = saved
+        stdout.flush()
+        stderr.flush()
+        connection.sendall(FRAME_HEADER.pack('x', len(str(status or 0))) +
+                           str(status or 0))
+
+    def listen(self):
+        "Return the server socket, which only its owner may connect to"
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        umask = os.umask(0177) # create the socket with mode 0600
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        server.listen(5)
+        return server
+
+    def serve_forever(self):
+        server = self.listen()
+        try:
+            while True:
+                connection, address = server.accept()
+                try:
+                    try:
+                        self.handle(connection)
+                    except socket.error: # the client went away
+                        pass
+                finally:
+                    connection.close()
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+def submit_job(socket_path, argv, stdout=None, stderr=None):
+    """Run a conversion in the daemon listening on `socket_path`
+
+    Copies the output of the job to `stdout` and `stderr` and returns
+    its exit status.
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    try:
+        connection.sendall(json.dumps(dict(args=argv, cwd=os.getcwd())) +
+                           '\n')
+        response = connection.makefile('rb')
+        while True:
+            header = response.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                raise IOError('the conversion daemon closed the connection')
+            stream, length = FRAME_HEADER.unpack(header)
+            data = response.read(length)
+            if stream == 'x':
+                return int(data)
+            (stdout, stderr)[stream == 'e'].write(data)
+    finally:
+        connection.close()
+
+def without_option(argv, option):
+    "Remove an option and its value from a list of arguments"
+    result = []
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument == option:
+            arguments.next()
+        elif not argument.startswith('%s=' % option):
+            result.append(argument)
+    return result
+
 if __name__ == '__main__':
     p = make_option_parser()
     opts, args = p.parse_args()
-    check_arguments(p, opts, args)
-    d = make_database_wrapper(opts, args)
-    run_conversion(d, opts)
+    if opts.serve:
+        ConversionDaemon(opts.serve).serve_forever()
+    elif opts.connect:
+        sys.exit(submit_job(opts.connect,
+                            without_option(sys.argv[1:], '--connect')))
+    else:
+        check_arguments(p, opts, args)
+        d = make_database_wrapper(opts, args)
+        run_conversion(d, opts)
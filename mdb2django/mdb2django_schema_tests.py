@@ -1,4 +1,17 @@
+import os
+import json
+import time
+import struct
+import datetime
+import decimal
+import shutil
+import sqlite3
+import tempfile
+import gzip
+import warnings
+
 from nose.tools import eq_, assert_true, assert_false, assert_raises
+from nose.plugins.skip import SkipTest
 
 from mdb2django_schema import (
     java2python,
@@ -6,8 +19,32 @@ from mdb2django_schema import (
     camelcase2english,
     Relationship,
     DatabaseWrapper,
+    ParallelSegments,
+    BatchPipeline,
+    ValueConversion,
+    check_pgbinary_columns,
+    convert_row,
+    fingerprint_value,
+    CopyStream,
+    CompressedOutput,
+    write_to_file_or_stdout,
+    SegmentCache,
+    ConversionDaemon,
+    Metrics,
+    NO_METRICS,
+    ProgressReporter,
+    make_option_parser,
+    check_arguments,
+    RowFetcher,
+    DependencyGraph,
+    load_sqlite,
     Model,
     Field)
+from mdb2django_jet4 import (
+    decode_text, decode_date, bitmap_pages, RowValues,
+    Database as Jet4Database, Table as Jet4Table, Column as Jet4Column)
+from mdb2django_benchmark import make_database, run_benchmark, BENCHMARKS
+from mdb2django_snapshot import SnapshotError
 
 try: # jython
     import java
@@ -44,6 +81,224 @@ class Java2Python_Tests:
         eq_(java2python(Date(0, 0, 0, 0, 50, 0)), u'1899-12-31 00:50:00')
         eq_(java2python(Date(109, 11, 10, 13, 59, 15)), u'2009-12-10 13:59:15')
 
+class ConversionPlan_Tests:
+    def setUp(self):
+        self.conversion = ValueConversion()
+        self.conversion.timezone_offset = lambda millis: 2 * 3600 * 1000
+        self.columns = [Mock(name=name, type=Mock(name=lambda t=t: t))
+                        for name, t in (('id', u'LONG'),
+                                        ('active', u'BOOLEAN'),
+                                        ('created', u'SHORT_DATE_TIME'),
+                                        ('title', u'TEXT'))]
+        self.row = [23, True,
+                    Mock(getTime=lambda: 1260453555000),
+                    u'two\r\nlines']
+
+    def test_python_plan(self):
+        plan = self.conversion.plan('python', 'Article', self.columns)
+        eq_(convert_row(plan, self.row),
+            [23, True, '2009-12-10 15:59:15', u'two\\rlines'])
+
+    def test_date_before_epoch(self):
+        plan = self.conversion.plan('python', 'Article', self.columns[2:3])
+        eq_(convert_row(plan, [Mock(getTime=lambda: -2209161600000 + 3000)]),
+            ['1899-12-30 02:00:03'])
+
+    def test_nulls(self):
+        eq_(convert_row(self.conversion.plan('json', 'A', self.columns),
+                        [None] * 4),
+            ['null'] * 4)
+        eq_(convert_row(self.conversion.plan('pgcopy', 'A', self.columns),
+                        [None] * 4),
+            [r'\N'] * 4)
+
+    def test_pgcopy_plan(self):
+        plan = self.conversion.plan('pgcopy', 'Article', self.columns)
+        eq_(convert_row(plan, self.row),
+            ['23', 't', '2009-12-10 15:59:15', 'two\\rlines'])
+
+    def test_pgbinary_plan(self):
+        plan = self.conversion.plan('pgbinary', 'Article', self.columns)
+        eq_(convert_row(plan, self.row),
+            ['\0\0\0\x04\0\0\0\x17',
+             '\0\0\0\x01\x01',
+             '\0\0\0\x08\0\x01\x1d`\xa8V:\xc0',
+             '\0\0\0\ntwo\r\nlines'])
+        eq_(convert_row(plan, [None] * 4), ['\xff\xff\xff\xff'] * 4)
+
+    def test_pgbinary_keeps_text_as_is(self):
+        plan = self.conversion.plan('pgbinary', 'Article', self.columns[3:])
+        eq_(convert_row(plan, [u'a\tb\r\nc\\d']),
+            ['\0\0\0\x08a\tb\r\nc\\d'])
+
+    def test_pgbinary_refuses_types_without_encoding(self):
+        column = Mock(name='price', type=Mock(name=lambda: u'DOUBLE'))
+        assert_raises(ValueError, self.conversion.plan, 'pgbinary',
+                      'Article', [column])
+        model = Mock(access_table=Mock(name='Article'),
+                     columns=self.columns + [column])
+        assert_raises(ValueError, check_pgbinary_columns, [model])
+        check_pgbinary_columns([Mock(access_table=Mock(name='Article'),
+                                     columns=self.columns)])
+
+    def test_csv_plan(self):
+        plan = self.conversion.plan('csv', 'Article', self.columns)
+        eq_(convert_row(plan, self.row),
+            ['23', '1', '2009-12-10 15:59:15', '"two\r\nlines"'])
+        eq_(convert_row(plan, [None] * 4), ['NULL'] * 4)
+        eq_(convert_row(plan[3:], [u'NULL']), ['"NULL"'])
+        eq_(convert_row(plan[3:], [u'say "\xe9"']), ['"say ""\xc3\xa9"""'])
+
+    def test_pgbinary_custom_date_conversion(self):
+        conversion = ValueConversion(lambda t, c, v: v)
+        conversion.timezone_offset = self.conversion.timezone_offset
+        plan = conversion.plan('pgbinary', 'Article', self.columns[2:3])
+        eq_(convert_row(plan, self.row[2:3]),
+            ['\0\0\0\x08\0\x01\x1d`\xa8V:\xc0'])
+
+    def test_decimals(self):
+        columns = [Mock(name='price', type=Mock(name=lambda: u'MONEY'))]
+        values = [decimal.Decimal(0).scaleb(-4),
+                  decimal.Decimal(-123450).scaleb(-4)]
+        for kind, expected in (('json', ['0.0000', '-12.3450']),
+                               ('pgcopy', ['0.0000', '-12.3450']),
+                               ('csv', ['0.0000', '-12.3450']),
+                               ('sqlite', ['0.0000', '-12.3450'])):
+            plan = self.conversion.plan(kind, 'Article', columns)
+            eq_([convert_row(plan, [value])[0] for value in values],
+                expected)
+        plan = self.conversion.plan('python', 'Article', columns)
+        eq_(convert_row(plan, [Mock(toString=lambda: '1.50')]),
+            [decimal.Decimal('1.50')])
+
+    def test_binary(self):
+        "Blobs from the Jet 4 reader and signed Java byte arrays"
+        columns = [Mock(name='photo', type=Mock(name=lambda: u'OLE'))]
+        values = [bytearray('\0\xff\x80A'), [0, -1, -128, 65]]
+        for kind, expected in (('json', '"AP+AQQ=="'),
+                               ('pgcopy', r'\\x00ff8041'),
+                               ('csv', 'AP+AQQ=='),
+                               ('pgbinary', '\0\0\0\x04\0\xff\x80A')):
+            plan = self.conversion.plan(kind, 'Article', columns)
+            eq_([convert_row(plan, [value])[0] for value in values],
+                [expected] * 2)
+        plan = self.conversion.plan('sqlite', 'Article', columns)
+        blob = convert_row(plan, values[:1])[0]
+        eq_((type(blob), str(blob)), (buffer, '\0\xff\x80A'))
+        eq_(fingerprint_value(blob), '4:\0\xff\x80A')
+
+    def test_custom_conversion(self):
+        conversion = ValueConversion(
+            lambda t, c, v: (t, c, v) if c == 'id' else v)
+        plan = conversion.plan('python', 'Article', self.columns[:1])
+        eq_(convert_row(plan, [23]), [('Article', 'id', 23)])
+
+class Jet4_Tests:
+    def test_uncompressed_text(self):
+        eq_(decode_text(u'T\xe4st'.encode('utf-16-le')), u'T\xe4st')
+
+    def test_compressed_text(self):
+        "A zero byte toggles between one and two byte characters"
+        eq_(decode_text('\xff\xfeAb\0\x3a\x04\0c'), u'Ab\u043ac')
+
+    def test_date(self):
+        eq_(decode_date(struct.pack('<d', 40157.5826967593)),
+            datetime.datetime(2009, 12, 10, 13, 59, 5))
+        eq_(decode_date(struct.pack('<d', -1.5)),
+            datetime.datetime(1899, 12, 29, 12, 0))
+
+    def test_datetime_conversion(self):
+        plan = ValueConversion().plan(
+            'python', 'Article',
+            [Mock(name='created', type=Mock(name=lambda: u'SHORT_DATE_TIME'))])
+        eq_(convert_row(plan, [datetime.datetime(1899, 12, 30, 1, 2, 3)]),
+            ['1899-12-30 01:02:03'])
+
+    def test_binary_values(self):
+        database = Jet4Database.__new__(Jet4Database)
+        ole = Jet4Column(None, u'photo', 0x0b, 0, 0, 0, 0, 0, 0)
+        data = struct.pack('<II4x', 2 | 0x80000000, 0) + '\x80\xff'
+        eq_(ole.decoder(database)(data), bytearray('\x80\xff'))
+        binary = Jet4Column(None, u'hash', 0x09, 0, 0, 0, 16, 0, 0)
+        eq_(type(binary.decoder(database)('\x80')), bytearray)
+
+    def test_bitmap_pages(self):
+        eq_(bitmap_pages('\x05\0\x80', 100), [100, 102, 123])
+
+    def test_table_rows(self):
+        "Rows decoded from a synthetic table definition and data page"
+        database = Jet4Database.__new__(Jet4Database)
+        database.data = make_jet4_pages()
+        table = Jet4Table(database, u'Article', 1)
+        eq_([column.name for column in table.getColumns()],
+            [u'id', u'price', u'active', u'title', u'notes'])
+        eq_(table.getRowCount(), 2)
+        eq_(table.getNextRows(10),
+            [[1, decimal.Decimal('12.3400'), True, u'caf\xe9',
+              u'short note'],
+             [2, None, False, None, u'long ' * 300]])
+        eq_(database.createCursor(table).getNextRows(10)[1][:3],
+            [2, None, False])
+
+def make_jet4_row(fixed, variable, present):
+    """Encode a Jet 4 row with 5 columns
+
+    The variable length values are followed by their offsets in
+    reverse order, their count and the null mask.
+    """
+    data = struct.pack('<H', 5) + fixed
+    offsets = []
+    for value in variable:
+        offsets.append(len(data))
+        data += value
+    offsets.append(len(data))
+    return (data + struct.pack('<%dH' % len(offsets), *reversed(offsets)) +
+            struct.pack('<HB', len(variable),
+                        sum(1 << number for number in present)))
+
+def make_jet4_pages():
+    """Return a table definition on page 1 and its data page 2
+
+    The usage map and a long value are deleted rows of the data page.
+    """
+    columns = [(u'id', 0x04, 0, 0, 0x01, 0, 4),
+               (u'price', 0x05, 1, 0, 0x01, 4, 8),
+               (u'active', 0x01, 2, 0, 0x01, 0, 0),
+               (u'title', 0x0a, 3, 0, 0, 0, 100),
+               (u'notes', 0x0c, 4, 1, 0, 0, 0)]
+    tdef = ('\x02' + '\0' * 15 + struct.pack('<I', 2) + '\0' * 23 +
+            struct.pack('<HHIII', 2, len(columns), 0, 0, (2 << 8) | 2) +
+            '\0' * 4)
+    for name, type_code, number, var_index, flags, offset, length in columns:
+        tdef += struct.pack('<B4xHH2x4xH4xHH', type_code, number, var_index,
+                            flags, offset, length)
+    for column in columns:
+        name = column[0].encode('utf-16-le')
+        tdef += struct.pack('<H', len(name)) + name
+    long_value = (u'long ' * 300).encode('utf-16-le')
+    rows = [make_jet4_row(struct.pack('<iq', 1, 123400),
+                          ['\xff\xfecaf\xe9',
+                           struct.pack('<II4x', 20 | 0x80000000, 0) +
+                           u'short note'.encode('utf-16-le')],
+                          [0, 1, 2, 3, 4]),
+            make_jet4_row(struct.pack('<i8x', 2),
+                          ['', struct.pack('<II4x', len(long_value) |
+                                           0x40000000, (2 << 8) | 3)],
+                          [0, 4]),
+            '\0\0\0\0\0\x04', # usage map: bitmap from page 0
+            long_value]
+    page = ['\x01\0\0\0', struct.pack('<I', 1), '\0' * 4,
+            struct.pack('<H', len(rows))]
+    end = 4096
+    offsets = []
+    for number, row in enumerate(rows):
+        end -= len(row)
+        offsets.append(end | (0, 0x8000)[number >= 2])
+    page.append(struct.pack('<%dH' % len(rows), *offsets))
+    page = ''.join(page)
+    page += '\0' * (end - len(page)) + ''.join(reversed(rows))
+    return '\0' * 4096 + tdef.ljust(4096, '\0') + page
+
 class ForLoop_Tests:
     def test_empty_sequence(self):
         "An empty sequence should yield no results"
@@ -72,6 +327,181 @@ class ForLoop_Tests:
              (False, 3, False),
              (False, 4, True)])
 
+class CopyStream_Tests:
+    def test_read_all(self):
+        eq_(CopyStream(['1\ta', '2\tb']).read(), '1\ta\n2\tb\n')
+
+    def test_read_in_chunks(self):
+        stream = CopyStream(['1\ta', '2\tb', '3\tc'])
+        eq_([stream.read(3) for i in range(5)],
+            ['1\ta', '\n2\t', 'b\n3', '\tc\n', ''])
+        eq_(stream.count, 3)
+
+    def test_header_and_trailer(self):
+        stream = CopyStream(['1', '2'], terminator='', header='<',
+                            trailer='>')
+        eq_([stream.read(2), stream.read(2), stream.read(2)],
+            ['<1', '2>', ''])
+
+    def test_reads_lazily(self):
+        lines = iter(['1', '2', '3'])
+        stream = CopyStream(lines)
+        eq_(stream.read(2), '1\n')
+        eq_(list(lines), ['2', '3'])
+
+class CompressedOutput_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lines = ['line %d' % number for number in xrange(100000)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_gzip(self):
+        path = os.path.join(self.directory, 'fixture.json.gz')
+        write_to_file_or_stdout(lambda: self.lines, path, 'fixture.json',
+                                compress_level=1)
+        eq_(gzip.open(path).read().splitlines(), self.lines)
+
+    def test_positional_progress_callback(self):
+        path = os.path.join(self.directory, 'load.sql')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            write_to_file_or_stdout(lambda: self.lines[:2], path, 'load.sql',
+                                    lambda fraction, message: None, '--')
+        eq_([warning.category for warning in caught], [DeprecationWarning])
+        eq_(open(path).read(), 'line 0\nline 1\n')
+
+    def test_zstandard(self):
+        try:
+            import zstandard
+        except ImportError:
+            raise SkipTest('zstandard is not installed')
+        path = os.path.join(self.directory, 'pg_data.sql.zst')
+        write_to_file_or_stdout(lambda: self.lines, path, 'pg_data.sql')
+        reader = zstandard.ZstdDecompressor().stream_reader(file(path, 'rb'))
+        data = []
+        for chunk in iter(lambda: reader.read(1 << 16), ''):
+            data.append(chunk)
+        eq_(''.join(data).splitlines(), self.lines)
+
+    def test_errors_are_raised_in_writer(self):
+        class Failing(object):
+            def write(self, data):
+                raise IOError('disk full')
+            def close(self):
+                pass
+        output = CompressedOutput(os.path.join(self.directory, 'out.gz'))
+        output.target = Failing()
+        def write_all():
+            while True:
+                output.write(self.lines[-1])
+        assert_raises(IOError, write_all)
+        assert_raises(IOError, output.close)
+
+class SegmentCache_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'fixture.json')
+        open(self.filepath, 'w').write('[{"pk": 1},\n {"pk": 2}]\n')
+        json.dump(dict(settings={'app_name': 'myapp'},
+                       size=os.path.getsize(self.filepath),
+                       tables={'A': dict(model='A', rows=1, hash='a',
+                                         offset=0, length=12),
+                               'B': dict(model='B', rows=1, hash='b',
+                                         offset=12, length=12)}),
+                  open(self.filepath + '.manifest', 'w'))
+        self.a = Mock(name='A', access_table=Mock(name='A'),
+                      fingerprint=lambda: (1, 'a'))
+        self.b = Mock(name='B', access_table=Mock(name='B'),
+                      fingerprint=lambda: (1, 'changed'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unchanged(self):
+        cache = SegmentCache(self.filepath, 'fixture', {'app_name': 'myapp'})
+        assert_true(cache.is_unchanged(self.a))
+        assert_false(cache.is_unchanged(self.b))
+
+    def test_spliced_fixture_rows(self):
+        cache = SegmentCache(self.filepath, 'fixture', {'app_name': 'myapp'})
+        eq_(list(cache.spliced(self.a)), ['{"pk": 1}'])
+
+    def test_changed_settings(self):
+        cache = SegmentCache(self.filepath, 'fixture', {'app_name': 'other'})
+        assert_false(cache.is_unchanged(self.a))
+
+    def test_fingerprints_are_shared(self):
+        calls = []
+        a = Mock(name='A', access_table=Mock(name='A'),
+                 fingerprint=lambda: calls.append('A') or (1, 'a'))
+        fingerprints = {}
+        for output_type_name in 'fixture', 'postgresql':
+            cache = SegmentCache(self.filepath, output_type_name,
+                                 {'app_name': 'myapp'}, fingerprints)
+            assert_true(cache.is_unchanged(a))
+        eq_(calls, ['A'])
+
+    def test_fingerprint_of_row_values(self):
+        "Fingerprints hash the values as read, without value conversion"
+        def fingerprint(rows):
+            columns = make_data_columns() + [
+                Mock(name='photo', type=Mock(name=lambda: u'OLE'))]
+            return Model(DataDatabaseMock(),
+                         DataTableMock('A', columns, rows)).fingerprint()
+        row = [1, u'Aa', bytearray('\x80')]
+        eq_(fingerprint([row]), fingerprint([row]))
+        eq_(fingerprint([row])[0], 1)
+        eq_(fingerprint([row]), fingerprint([[1, u'Aa', [-128]]]))
+        for other in ([[1, u'BB', bytearray('\x80')]],
+                      [[1, None, bytearray('\x80')]],
+                      [[1, u'', bytearray('\x80')]],
+                      [[2, u'Aa', bytearray('\x80')]],
+                      [[1, u'Aa', bytearray('\x81')]]):
+            assert_true(fingerprint([row]) != fingerprint(other))
+
+    def test_unsplicable_segment(self):
+        manifest = json.load(open(self.filepath + '.manifest'))
+        manifest['tables']['A'].update(offset=None, length=None)
+        json.dump(manifest, open(self.filepath + '.manifest', 'w'))
+        cache = SegmentCache(self.filepath, 'fixture', {'app_name': 'myapp'})
+        assert_true(cache.is_unchanged(self.a))
+        assert_false(cache.has_segment(self.a))
+
+    def incremental_postgresql(self, d):
+        "Write the PostgreSQL output as an incremental run would"
+        cache = SegmentCache(self.filepath, 'postgresql',
+                             d.output_settings('postgresql'))
+        write_to_file_or_stdout(
+            lambda: d.output_postgresql(filepath=self.filepath, cache=cache),
+            self.filepath + '.tmp', 'PostgreSQL')
+        os.rename(self.filepath + '.tmp', self.filepath)
+        cache.save()
+        return dict((name, open(os.path.join(self.directory, name)).read())
+                    for name in os.listdir(self.directory)
+                    if name.startswith('pg_data.') and
+                    not name.endswith('.manifest'))
+
+    def test_changed_shards_are_rewritten(self):
+        self.filepath = os.path.join(self.directory, 'pg_data.sql')
+        d = DatabaseWrapper(make_database(tables=2, columns=3, rows=9),
+                            shard_threshold=4, shards=3)
+        eq_(len(self.incremental_postgresql(d)), 1 + 2 * 3 + 1)
+        d.shards = 2
+        for name in os.listdir(self.directory):
+            if name.startswith('pg_data.'):
+                os.remove(os.path.join(self.directory, name))
+        fresh = self.incremental_postgresql(d)
+        d.shards = 3
+        self.incremental_postgresql(d)
+        d.shards = 2
+        shards = self.incremental_postgresql(d)
+        for name in set(shards) - set(fresh):
+            assert_true(name.endswith('.2.sql'), name)
+            del shards[name]
+        eq_(shards, fresh)
+
 class CamelCaseToEnglish_Tests:
     def test_insert_space_before_capital(self):
         eq_(camelcase2english('aB'), 'A B')
@@ -100,7 +530,29 @@ class TableMock(Mock):
     def getColumns(self):
         return self.columns
 
+    def getColumn(self, column_name):
+        for column in self.columns:
+            if column.name == column_name:
+                return column
+
+class RowsMock(Mock):
+    def __init__(self, rows):
+        super(RowsMock, self).__init__(rows=rows)
+        self.reset()
+
+    def reset(self):
+        self._rows = iter(self.rows)
+
+    def getNextRow(self):
+        for row in self._rows:
+            return row
+
 class DatabaseMock(Mock):
+    metrics = NO_METRICS
+    batch_rows = 2
+    pipeline_batches = None
+    formatters = 1
+
     def table2model_name(self, t):
         return t
 
@@ -135,6 +587,22 @@ class ExampleDatabaseMock(DatabaseMock):
             return [self._reporter_article_relationship]
         return []
 
+class CatalogDatabaseMock(ExampleDatabaseMock):
+    def getSystemTable(self, table_name):
+        return RowsMock([
+            dict(szRelationship='ReporterArticle', icolumn=0,
+                 szReferencedObject='Reporter', szReferencedColumn='id',
+                 szObject='Article', szColumn='reporter_id'),
+            dict(szRelationship='ReporterReporter', icolumn=0,
+                 szReferencedObject='Reporter', szReferencedColumn='id',
+                 szObject='Reporter', szColumn='id'),
+            dict(szRelationship='SystemRelationship', icolumn=0,
+                 szReferencedObject='MSysObjects', szReferencedColumn='Id',
+                 szObject='Article', szColumn='reporter_id')])
+
+    def getRelationships(self, table1, table2):
+        raise AssertionError('pairwise relationship lookup used')
+
 def test_relationship():
     """Test the Relationship class
 
@@ -156,6 +624,36 @@ def test_relationship():
     eq_(r.to_field, 'to_model.to_field')
     eq_(r.from_field, 'from_model.from_field')
 
+class DependencyGraph_Tests:
+    def graph(self, models, references):
+        return DependencyGraph(models, [
+            Mock(to_field=Mock(model=model),
+                 from_field=Mock(model=related_model))
+            for model, related_model in references])
+
+    def test_related_models_first_in_table_order(self):
+        graph = self.graph('abcde', ['ae', 'be', 'ce', 'ad', 'bc'])
+        eq_(graph.ordered, list('deacb'))
+        eq_(graph.levels, [['d', 'e'], ['a', 'c'], ['b']])
+        eq_(graph.cycles, [])
+
+    def test_self_references(self):
+        graph = self.graph('abc', ['aa', 'ab', 'cc'])
+        eq_(graph.ordered, list('bac'))
+        eq_(graph.self_references, ['a', 'c'])
+
+    def test_cycles_are_broken(self):
+        graph = self.graph('abcde', ['ab', 'bc', 'ca', 'de', 'ed', 'ec'])
+        eq_(graph.cycles, [list('abc'), list('de')])
+        eq_(graph.ordered, list('acbde'))
+        eq_(graph.level, dict(a=0, c=1, b=2, d=0, e=2))
+
+    def test_ordered_models_are_stable(self):
+        d = DatabaseWrapper(make_database(tables=5, columns=4, rows=0))
+        first = [model.name for model in d.ordered_models]
+        d.invalidate()
+        eq_([model.name for model in d.ordered_models], first)
+
 class ForeignKey_Tests:
     def setUp(self):
         db = DatabaseMock(relationships={},
@@ -258,6 +756,254 @@ class Model_Tests:
         eq_(list(reporter_model.inline_class_names),
             ['ArticleInline', 'OtherInline'])
 
+class DataTableMock(TableMock):
+    def __init__(self, name, columns, rows):
+        for index, column in enumerate(columns):
+            column.columnIndex = index
+        super(DataTableMock, self).__init__(
+            name, columns,
+            indexes=[Mock(columns=columns[:1], isPrimaryKey=lambda: True)],
+            rows=RowsMock([Mock(values=lambda r=r: RowValues(r))
+                           for r in rows]))
+
+    def reset(self):
+        self.rows.reset()
+
+    def getNextRow(self):
+        return self.rows.getNextRow()
+
+    def getRowCount(self):
+        return len(self.rows.rows)
+
+class DataDatabaseMock(DatabaseMock):
+    def __init__(self, **tables):
+        super(DataDatabaseMock, self).__init__(
+            tables=tables, relationships={}, reverse_relationships={})
+
+    def getTableNames(self):
+        return sorted(self.tables)
+
+    def getTable(self, table_name):
+        return self.tables[table_name]
+
+    def getRelationships(self, table1, table2):
+        return []
+
+def make_data_columns():
+    return [Mock(name='id', type=Mock(name=lambda: u'LONG')),
+            Mock(name='title', type=Mock(name=lambda: u'TEXT'), length=50)]
+
+class RowFetcher_Tests:
+    def setUp(self):
+        self.table = DataTableMock('A', make_data_columns(),
+                                   [[i, u'%d' % i] for i in range(5)])
+
+    def test_batches_of_row_values(self):
+        eq_(list(RowFetcher(self.table, 2).batches()),
+            [[[0, u'0'], [1, u'1']], [[2, u'2'], [3, u'3']], [[4, u'4']]])
+
+    def test_batches_of_limited_count(self):
+        eq_(list(RowFetcher(self.table, 2).batches(3)),
+            [[[0, u'0'], [1, u'1']], [[2, u'2']]])
+        eq_(list(RowFetcher(self.table, 2).batches()), [[[3, u'3'], [4, u'4']]])
+
+    def test_batch_fetching_source(self):
+        source = Mock(getNextRows=lambda count: [[count]] * min(count, 1))
+        eq_(list(RowFetcher(source, 3).batches(5)), [[[3]]])
+
+class Columnar_Tests:
+    def setUp(self):
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest('NumPy is not installed')
+        self.rows = DatabaseWrapper(make_database(tables=2, columns=10,
+                                                  rows=20))
+        self.columns = DatabaseWrapper(self.rows.db, columnar=True)
+        for d in self.rows, self.columns:
+            d.valueconversion.timezone_offset = lambda millis: 3600000
+
+    def test_text_outputs_match_row_conversion(self):
+        eq_(list(self.columns.output_fixture()),
+            list(self.rows.output_fixture()))
+        eq_(list(self.columns.output_postgresql()),
+            list(self.rows.output_postgresql()))
+
+    def test_binary_output_matches_row_conversion(self):
+        for rows_model, columns_model in zip(self.rows.models,
+                                             self.columns.models):
+            eq_(list(columns_model.pgcopy_binary_rows(
+                        self.columns.valueconversion)),
+                list(rows_model.pgcopy_binary_rows(
+                        self.rows.valueconversion)))
+
+    def test_shared_scan_reads_columns_once(self):
+        def outputs(shared):
+            d = DatabaseWrapper(self.rows.db, columnar=True)
+            d.valueconversion.timezone_offset = lambda millis: 3600000
+            reads = []
+            read = d.valueconversion.read_columns.read
+            d.valueconversion.read_columns.read = (
+                lambda *args: reads.append(args[1]) or read(*args))
+            if shared:
+                d.share_scans(['fixture', 'postgresql'])
+            return (list(d.output_fixture()) + list(d.output_postgresql()),
+                    len(reads))
+        separate, separate_reads = outputs(False)
+        shared, shared_reads = outputs(True)
+        eq_(shared, separate)
+        eq_((shared_reads, separate_reads), (2, 4)) # one batch per table
+
+    def test_custom_conversion_is_applied_to_all_columns(self):
+        d = DatabaseWrapper(self.rows.db, columnar=True,
+                            custom_conversion=lambda t, c, value: 1)
+        line = list(d.models[0].pgcopy_rows(d.valueconversion))[0]
+        eq_(line, '\t'.join(['1'] * 10))
+
+class FixtureOutput_Tests:
+    def test_model_rows(self):
+        db = DataDatabaseMock()
+        model = Model(db, DataTableMock(
+            'Article', make_data_columns(), [[1, u'\xe9'], [2, None]]))
+        eq_(list(model.output_fixture('myapp', ValueConversion())),
+            ['{"model": "myapp.article", "pk": 1, '
+             '"fields": {"title": "\\u00e9"}}',
+             '{"model": "myapp.article", "pk": 2, '
+             '"fields": {"title": null}}'])
+
+    def test_separators_between_models(self):
+        db = DataDatabaseMock(
+            A=DataTableMock('A', make_data_columns(), [[1, u'a']]),
+            B=DataTableMock('B', make_data_columns(), []),
+            C=DataTableMock('C', make_data_columns(), [[2, u'c'], [3, u'd']]))
+        lines = DatabaseWrapper(db).output_fixture()
+        eq_([o['pk'] for o in json.loads('\n'.join(lines))], [1, 2, 3])
+
+    def test_empty_database(self):
+        eq_(list(DatabaseWrapper(DataDatabaseMock()).output_fixture()),
+            ['[]'])
+
+class CsvOutput_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'load.sql')
+        self.db = DataDatabaseMock(
+            A=DataTableMock('A', make_data_columns(),
+                            [[1, u'a,b'], [2, None]]),
+            B=DataTableMock('B', make_data_columns(), []))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, filename):
+        return file(os.path.join(self.directory, filename), 'rb').read()
+
+    def test_data_file_per_table(self):
+        d = DatabaseWrapper(self.db)
+        statements = list(d.output_csv(filepath=self.filepath))
+        eq_(self.read('load.myapp_a.csv'), '1,"a,b"\r\n2,NULL\r\n')
+        eq_(self.read('load.myapp_b.csv'), '')
+        eq_(statements[0],
+            "LOAD DATA LOCAL INFILE '%s' INTO TABLE `myapp_a` "
+            "CHARACTER SET utf8 FIELDS TERMINATED BY ',' "
+            "OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            "LINES TERMINATED BY '\\r\\n' (`id`, `title`);"
+            % os.path.join(self.directory, 'load.myapp_a.csv'))
+        eq_(len(statements), 2)
+
+    def test_custom_null_marker(self):
+        d = DatabaseWrapper(self.db, csv_null='')
+        statements = list(d.output_csv(filepath=self.filepath))
+        eq_(self.read('load.myapp_a.csv'), '1,"a,b"\r\n2,\r\n')
+        assert_true(statements[0].endswith(
+            "(@v0, @v1) SET `id` = NULLIF(@v0, ''), "
+            "`title` = NULLIF(@v1, '');"))
+
+    def test_output_file_required(self):
+        assert_raises(ValueError, list,
+                      DatabaseWrapper(self.db).output_csv(filepath='-'))
+
+class FixtureLines_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'fixture.json')
+        self.db = DataDatabaseMock(
+            A=DataTableMock('A', make_data_columns(),
+                            [[1, u'a'], [2, u'b'], [3, None]]),
+            B=DataTableMock('B', make_data_columns(), []))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files_split_by_rows(self):
+        d = DatabaseWrapper(self.db, fixture_format='jsonl', fixture_rows=2)
+        paths = list(d.output_fixture(filepath=self.filepath))
+        eq_(paths, [os.path.join(self.directory, 'fixture.myapp_a.%d.jsonl'
+                                 % index) for index in (0, 1)])
+        lines = file(paths[0]).read().splitlines()
+        lines += file(paths[1]).read().splitlines()
+        eq_([json.loads(line) for line in lines],
+            json.loads('\n'.join(DatabaseWrapper(self.db).output_fixture())))
+
+    def test_compressed_listing(self):
+        try:
+            from mdb2django_loadlines import fixture_files
+        except ImportError:
+            raise SkipTest('Django is not installed')
+        d = DatabaseWrapper(self.db, fixture_format='jsonl', fixture_rows=2)
+        listing_path = self.filepath + '.gz'
+        write_to_file_or_stdout(
+            lambda: d.output_fixture(filepath=listing_path), listing_path,
+            'Django fixture')
+        eq_(fixture_files(listing_path),
+            [os.path.join(self.directory, 'fixture.json.myapp_a.%d.jsonl'
+                          % index) for index in (0, 1)])
+
+    def test_output_file_required(self):
+        d = DatabaseWrapper(self.db, fixture_format='jsonl')
+        assert_raises(ValueError, list, d.output_fixture(filepath='-'))
+
+class SqliteOutput_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'db.sqlite3')
+        self.d = DatabaseWrapper(make_database(tables=3, columns=5, rows=4))
+        self.d.valueconversion.timezone_offset = lambda millis: 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_tables_rows_and_indexes(self):
+        reports = []
+        load_sqlite(self.d, self.filepath,
+                    report=lambda model, rows, seconds:
+                        reports.append((model.db_table, rows)))
+        eq_(reports, [(model.db_table, 4) for model in self.d.ordered_models])
+        connection = sqlite3.connect(self.filepath)
+        try:
+            eq_(connection.execute(
+                    'SELECT "id", "text0" FROM "myapp_table00001" '
+                    'ORDER BY "id"').fetchall(),
+                [(1, u'plain text'), (2, u'caf\xe9 "quoted"'),
+                 (3, u'tab\there'), (4, u'two\r\nlines')])
+            eq_(sorted(name for name, in connection.execute(
+                        "SELECT name FROM sqlite_master WHERE type='index'")),
+                ['myapp_table00001_Table00000_id',
+                 'myapp_table00002_Table00000_id'])
+        finally:
+            connection.close()
+
+    def test_existing_file_is_replaced(self):
+        file(self.filepath, 'w').write('not a database')
+        load_sqlite(self.d, self.filepath)
+        connection = sqlite3.connect(self.filepath)
+        try:
+            eq_(connection.execute(
+                    'SELECT count(*) FROM "myapp_table00000"').fetchall(),
+                [(4,)])
+        finally:
+            connection.close()
+
 class DatabaseWrapper_Tests:
     def test_add_relationships(self):
         d = DatabaseWrapper(ExampleDatabaseMock())
@@ -291,6 +1037,34 @@ class DatabaseWrapper_Tests:
               for r in x] for x in rs.values()],
             [[('Article', 'Reporter')]])
 
+    def test_relationships_from_catalog(self):
+        rs = DatabaseWrapper(CatalogDatabaseMock()).relationships
+        eq_([(r.to_field.model.name, r.to_field.name,
+              r.from_field.model.name, r.from_field.name)
+             for r in rs.values()],
+            [('Article', 'reporter_id', 'Reporter', 'id')])
+
+    def test_self_relationships_from_catalog_are_skipped(self):
+        d = DatabaseWrapper(CatalogDatabaseMock())
+        eq_([r for r in d.get_relationships()['all'].values()
+             if r.to_field.model is r.from_field.model], [])
+
+    def test_pairwise_relationships(self):
+        d = DatabaseWrapper(ExampleDatabaseMock(), relationship_catalog=False)
+        eq_([(r.to_field.name, r.from_field.name)
+             for r in d.relationships.values()],
+            [('reporter_id', 'id')])
+
+    def test_shard_ranges(self):
+        d = DatabaseWrapper(ExampleDatabaseMock(), shard_threshold=10,
+                            shards=3)
+        eq_(d.shard_ranges(Mock(row_count=10)), None)
+        eq_(d.shard_ranges(Mock(row_count=11)), [(0, 4), (4, 8), (8, 11)])
+
+    def test_no_shards_by_default(self):
+        d = DatabaseWrapper(ExampleDatabaseMock())
+        eq_(d.shard_ranges(Mock(row_count=10 ** 9)), None)
+
     def test_models(self):
         d = ExampleDatabaseMock()
         ms = list(DatabaseWrapper(d).models)
@@ -298,3 +1072,408 @@ class DatabaseWrapper_Tests:
         eq_([m.access_table for m in ms],
             [d.reporter_table, d.article_table,
              d.newspaper_table, d.publisher_table])
+
+class ParallelSegments_Tests:
+    def setUp(self):
+        class SegmentingDatabaseMock(Mock):
+            def open_copy(self):
+                return self
+            def get_model_by_table_name(self, table_name):
+                return Mock(access_table=Mock(name=table_name))
+            def fixture_segment(self, model):
+                return ['%s %d' % (model.access_table.name, i)
+                        for i in range(3)]
+        self.models = [Mock(access_table=Mock(name=name))
+                       for name in 'Reporter', 'Article', 'Newspaper']
+        self.segments = ParallelSegments(
+            SegmentingDatabaseMock(), 'fixture', self.models, 2)
+
+    def test_segments_in_requested_order(self):
+        eq_([list(self.segments(m)) for m in reversed(self.models)],
+            [['Newspaper 0', 'Newspaper 1', 'Newspaper 2'],
+             ['Article 0', 'Article 1', 'Article 2'],
+             ['Reporter 0', 'Reporter 1', 'Reporter 2']])
+
+    def test_worker_error_is_reraised(self):
+        segments = ParallelSegments(
+            Mock(open_copy=lambda: None), 'fixture', self.models[:1], 1)
+        assert_raises(AttributeError, list, segments(self.models[0]))
+
+class ParallelOutput_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_wrapper(self):
+        d = DatabaseWrapper(make_database(tables=5, columns=8, rows=40),
+                            batch_rows=7)
+        d.valueconversion.timezone_offset = lambda millis: 3600000
+        return d
+
+    def outputs(self, d, jobs):
+        "Write the data outputs into a directory, return its files"
+        directory = os.path.join(self.directory, str(jobs))
+        os.mkdir(directory)
+        for name, method, needs_filepath in (
+                ('fixture.json', d.output_fixture, False),
+                ('pg_data.sql', d.output_postgresql, True),
+                ('load_data.sql', d.output_csv, True)):
+            path = os.path.join(directory, name)
+            kwargs = dict(jobs=jobs)
+            if needs_filepath:
+                kwargs['filepath'] = path
+            write_to_file_or_stdout(lambda: method(**kwargs), path, name)
+        return dict((name, open(os.path.join(directory, name), 'rb').read()
+                     .replace(directory, 'DIRECTORY'))
+                    for name in os.listdir(directory))
+
+    def test_jobs_match_serial_output(self):
+        d = self.make_wrapper()
+        # every worker reads an identical database of its own
+        d.filepath = 'example.mdb'
+        d.open_copy = self.make_wrapper
+        serial = self.outputs(d, 1)
+        eq_(len(serial), 3 + len(d.models))
+        eq_(self.outputs(d, 3), serial)
+
+class BatchPipeline_Tests:
+    def setUp(self):
+        self.read = []
+
+    def batches(self, count):
+        for number in range(count):
+            self.read.append(number)
+            yield [number]
+
+    def test_converted_batches_in_order(self):
+        def convert_batch(batch):
+            time.sleep(0.01 * (batch[0] % 3))
+            return [batch[0] * 2]
+        pipeline = BatchPipeline(self.batches(20), convert_batch, 4, 3)
+        eq_(list(pipeline), [[number * 2] for number in range(20)])
+
+    def test_reading_ahead_is_bounded(self):
+        pipeline = iter(BatchPipeline(self.batches(20), list, 3))
+        eq_(pipeline.next(), [0])
+        time.sleep(0.2)
+        assert_true(len(self.read) <= 4, self.read)
+        eq_(len(list(pipeline)), 19)
+
+    def test_errors_are_raised_in_order(self):
+        def convert_batch(batch):
+            if batch[0] == 2:
+                raise ValueError(batch[0])
+            return batch
+        pipeline = iter(BatchPipeline(self.batches(5), convert_batch, 2, 2))
+        eq_([pipeline.next(), pipeline.next()], [[0], [1]])
+        assert_raises(ValueError, pipeline.next)
+
+    def test_read_error_is_reraised(self):
+        def batches():
+            yield [0]
+            raise IOError('bad page')
+        assert_raises(IOError, list, BatchPipeline(batches(), list, 2))
+
+    def test_outputs_match_serial_conversion(self):
+        serial = DatabaseWrapper(make_database(tables=2, columns=10,
+                                               rows=20), batch_rows=3)
+        pipelined = DatabaseWrapper(serial.db, batch_rows=3,
+                                    pipeline_batches=2, formatters=2)
+        for d in serial, pipelined:
+            d.valueconversion.timezone_offset = lambda millis: 3600000
+        eq_(list(pipelined.output_fixture()), list(serial.output_fixture()))
+        eq_(list(pipelined.output_postgresql()),
+            list(serial.output_postgresql()))
+
+class SharedScan_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'load.sql')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def outputs(self, shared, **kwargs):
+        d = DatabaseWrapper(make_database(tables=3, columns=5, rows=7),
+                            **kwargs)
+        d.db.batch_rows = 2
+        d.valueconversion.timezone_offset = lambda millis: 0
+        resets = []
+        for model in d.models:
+            model.access_table.reset = (
+                lambda reset=model.access_table.reset, name=model.name:
+                    resets.append(name) or reset())
+        if shared:
+            d.share_scans(['fixture', 'postgresql', 'csv'])
+        outputs = [list(d.output_fixture()),
+                   list(d.output_postgresql(filepath=self.filepath)),
+                   list(d.output_csv(filepath=self.filepath)),
+                   sorted(file(os.path.join(self.directory, name)).read()
+                          for name in os.listdir(self.directory))]
+        return outputs, sorted(resets)
+
+    def test_same_outputs_from_one_read(self):
+        separate, separate_resets = self.outputs(False)
+        shared, shared_resets = self.outputs(True)
+        eq_(shared, separate)
+        eq_(separate_resets, sorted(['Table00000', 'Table00001',
+                                     'Table00002'] * 3))
+        eq_(shared_resets, ['Table00000', 'Table00001', 'Table00002'])
+
+    def test_binary_copy_data(self):
+        eq_(self.outputs(True, pg_format='binary')[0],
+            self.outputs(False, pg_format='binary')[0])
+
+class ConversionDaemon_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mdb_path = os.path.join(self.directory, 'example.mdb')
+        file(self.mdb_path, 'w').close()
+        self.opened = []
+        self.invalidated = []
+        def wrapper_factory(opts, args):
+            self.opened.append(args[0])
+            return Mock(db=Mock(),
+                        invalidate=lambda: self.invalidated.append(args[0]))
+        self.daemon = ConversionDaemon(
+            os.path.join(self.directory, 'socket'), wrapper_factory, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_wrapper(self, *argv):
+        opts, args = make_option_parser().parse_args(
+            list(argv) + [self.mdb_path])
+        return self.daemon.get_wrapper(opts, args)
+
+    def test_wrapper_is_reused(self):
+        wrapper = self.get_wrapper()
+        assert_true(self.get_wrapper() is wrapper)
+        eq_(self.opened, [self.mdb_path])
+
+    def test_modified_file_is_reopened(self):
+        wrapper = self.get_wrapper()
+        os.utime(self.mdb_path, (0, 0))
+        assert_false(self.get_wrapper() is wrapper)
+        eq_(len(self.daemon.wrappers), 1)
+        eq_(self.invalidated, [self.mdb_path])
+
+    def test_options_are_part_of_key(self):
+        wrapper = self.get_wrapper()
+        assert_false(self.get_wrapper('--app-name', 'other') is wrapper)
+        assert_true(self.get_wrapper() is wrapper)
+
+    def test_least_recently_used_is_evicted(self):
+        wrapper = self.get_wrapper()
+        self.get_wrapper('-n', 'a')
+        self.get_wrapper('-n', 'b')
+        assert_false(self.get_wrapper() is wrapper)
+
+    def test_paths_are_relative_to_client(self):
+        opts, args = make_option_parser().parse_args(
+            ['-f', 'fixture.json', '-p', '-', '--metrics-file', '/tmp/m.json',
+             'example.mdb'])
+        cwd = os.getcwd()
+        args = self.daemon.resolve_paths(opts, args, self.directory)
+        eq_(args, [self.mdb_path])
+        eq_((opts.fixture_file, opts.postgresql_file, opts.metrics_file),
+            (os.path.join(self.directory, 'fixture.json'), '-',
+             '/tmp/m.json'))
+        eq_(os.getcwd(), cwd)
+
+    def test_socket_is_private(self):
+        server = self.daemon.listen()
+        try:
+            eq_(os.stat(self.daemon.socket_path).st_mode & 0777, 0600)
+        finally:
+            server.close()
+
+class Caching_Tests:
+    def setUp(self):
+        self.d = DatabaseWrapper(make_database(tables=3, columns=4, rows=0))
+
+    def test_values_are_cached_per_instance(self):
+        model = self.d.models[0]
+        assert_true(model.fields is model.fields)
+        other = DatabaseWrapper(self.d.db).models[0]
+        assert_false(other.fields is model.fields)
+
+    def test_invalidate_drops_models_and_fields(self):
+        models = self.d.ordered_models
+        fields = models[0].fields
+        self.d.invalidate()
+        eq_(models[0]._cache, {})
+        eq_(self.d._cache, {})
+        assert_false(self.d.models[0] is models[0])
+        assert_false(self.d.models[0].fields is fields)
+
+    def test_schema_objects_have_no_instance_dict(self):
+        model = self.d.models[0]
+        for obj in [model, model.fields[0],
+                    self.d.get_relationships()['all'].values()[0]]:
+            assert_false(hasattr(obj, '__dict__'))
+
+    def test_column_metadata_is_read_once(self):
+        "Names, types and index flags aren't read again after the first use"
+        calls = []
+        table = self.d.models[-1].access_table
+        table.indexes.append(Mock(columns=table.columns[2:4],
+                                  isPrimaryKey=lambda: False,
+                                  isUnique=lambda: True))
+        column = table.columns[-1]
+        type_name = column.type.name()
+        column.type = Mock(name=lambda: calls.append('type') or type_name)
+        for column in table.columns:
+            name = column.name
+            column.__class__ = type('Column', (column.__class__,), dict(
+                name=property(lambda self, name=name:
+                              calls.append('name') or name)))
+        for index in table.indexes:
+            for method_name in 'isPrimaryKey', 'isUnique':
+                setattr(index, method_name,
+                        lambda method=getattr(index, method_name),
+                               method_name=method_name:
+                        calls.append(method_name) or method())
+        def generate():
+            list(self.d.output_models())
+            list(self.d.output_admin())
+            for model in self.d.models:
+                list(model.sqlite_index_statements())
+                model.sqlite_create_statement()
+        generate()
+        reads = len(calls)
+        eq_(calls.count('type'), 1)
+        eq_(sorted(set(calls)), ['isPrimaryKey', 'isUnique', 'name', 'type'])
+        generate()
+        eq_(len(calls), reads)
+
+class Snapshot_Tests:
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.directory, 'schema.json')
+        self.d = DatabaseWrapper(make_database(tables=7, columns=5, rows=2))
+        self.d.dump_schema(self.snapshot_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_models_and_admin_match_the_database(self):
+        for relationship_catalog in True, False:
+            snapshot = DatabaseWrapper.from_file(
+                self.snapshot_path, backend='snapshot',
+                relationship_catalog=relationship_catalog)
+            eq_(list(snapshot.output_models()), list(self.d.output_models()))
+            # inlines are listed in the order of a set of relationships
+            eq_([(m.name, sorted(m.inline_class_names))
+                 for m in snapshot.ordered_models],
+                [(m.name, sorted(m.inline_class_names))
+                 for m in self.d.ordered_models])
+
+    def test_rows_are_not_available(self):
+        snapshot = DatabaseWrapper.from_file(self.snapshot_path,
+                                             backend='snapshot')
+        eq_(snapshot.models[1].row_count, 2)
+        assert_raises(SnapshotError, list, snapshot.output_fixture())
+
+    def test_data_outputs_are_rejected(self):
+        parser = make_option_parser()
+        opts, args = parser.parse_args(['--from-schema', self.snapshot_path,
+                                        '-f', 'fixture.json'])
+        def error(message):
+            raise ValueError(message)
+        parser.error = error
+        assert_raises(ValueError, check_arguments, parser, opts, args)
+        check_arguments(parser, *parser.parse_args(
+                ['--from-schema', self.snapshot_path, '-m', 'models.py']))
+
+class CheckArguments_Tests:
+    def check(self, *arguments):
+        parser = make_option_parser()
+        def error(message):
+            raise ValueError(message)
+        parser.error = error
+        opts, args = parser.parse_args(list(arguments) + ['test.mdb'])
+        check_arguments(parser, opts, args)
+
+    def test_batch_rows(self):
+        self.check('--batch-rows', '1')
+        assert_raises(ValueError, self.check, '--batch-rows', '0')
+        assert_raises(ValueError, self.check, '--batch-rows', '-5')
+
+    def test_shards(self):
+        self.check('--shard-threshold', '10', '--shards', '1')
+        assert_raises(ValueError, self.check, '--shards', '0')
+        assert_raises(ValueError, self.check, '--shards', '-2')
+
+    def test_fixture_rows(self):
+        self.check('--fixture-format', 'jsonl', '--fixture-rows', '1')
+        assert_raises(ValueError, self.check, '--fixture-rows', '0')
+
+class Benchmark_Tests:
+    def setUp(self):
+        self.d = DatabaseWrapper(make_database(tables=5, columns=8, rows=3))
+
+    def test_related_models_first(self):
+        eq_([m.name for m in self.d.ordered_models],
+            [u'Table00000', u'Table00002', u'Table00001', u'Table00004',
+             u'Table00003'])
+
+    def test_fixture_rows(self):
+        fixture = json.loads('\n'.join(self.d.output_fixture()))
+        eq_(len(fixture), 15)
+        eq_(fixture[3]['model'], u'myapp.table00003')
+        eq_(fixture[3]['fields'][u'Table00001_id'], 1)
+
+    def test_rows_per_second(self):
+        result = run_benchmark(dict(tables=2, columns=8, rows=10),
+                               BENCHMARKS[-1])
+        eq_(result['rows'], 20)
+        assert_true(result['rows_per_second'] > 0)
+
+class Metrics_Tests:
+    def setUp(self):
+        self.d = DatabaseWrapper(make_database(tables=2, columns=8, rows=5))
+        self.d.metrics = self.metrics = Metrics()
+
+    def test_rows_and_bytes_per_table(self):
+        self.metrics.start_output('postgresql')
+        output = self.metrics.output(open(os.devnull, 'w'))
+        for line in self.d.output_postgresql():
+            output.write(line + '\n')
+        tables = self.metrics.as_dict()['outputs'][0]['tables']
+        eq_([(t['table'], t['rows']) for t in tables],
+            [(u'Table00000', 5), (u'Table00001', 5)])
+        assert_true(all(t['bytes'] > 0 and t['read_seconds'] > 0
+                        for t in tables))
+
+class Progress_Tests:
+    def setUp(self):
+        self.d = DatabaseWrapper(make_database(tables=2, columns=8, rows=5))
+
+    def test_generators_yield_only_data(self):
+        for output in (self.d.output_models(), self.d.output_admin(),
+                       self.d.output_fixture(), self.d.output_postgresql()):
+            assert_true(all(isinstance(line, basestring) for line in output))
+
+    def test_counter(self):
+        lines = self.d.output_postgresql()
+        for index in range(3): # DELETE clauses and the first COPY command
+            lines.next()
+        eq_((self.d.progress.done, self.d.progress.total), (2, 12))
+        eq_(self.d.progress.message, 'generating SQL COPY lines: Table00000')
+        list(lines)
+        eq_(self.d.progress.fraction, 1.0)
+
+    def test_reporter_eta(self):
+        reports = []
+        reporter = ProgressReporter(lambda: (0.25, 'working'),
+                                    lambda *args: reports.append(args))
+        reporter.started -= 10
+        reporter.tick()
+        reporter.tick() # unchanged progress isn't reported again
+        eq_(len(reports), 1)
+        fraction, message, remaining = reports[0]
+        eq_((fraction, message), (0.25, 'working'))
+        assert_true(29.0 < remaining < 31.0)
@@ -0,0 +1,198 @@
+"""
+Save the schema of an MDB file as JSON and read it back without a JVM
+
+Generating ``models.py`` and ``admin.py`` needs only table names,
+column types and lengths, indexes and relationships.  `save` writes
+them into a compact JSON snapshot, and `Database` implements the part
+of the `Jackcess`_ API which ``mdb2django_schema`` reads from a
+snapshot.  Snapshots contain no rows, so data outputs can't be
+generated from them.
+
+.. _Jackcess: http://jackcess.sourceforge.net/
+"""
+
+import json
+from collections import defaultdict
+
+from mdb2django_jet4 import DataType, Index, Relationship
+
+SNAPSHOT_VERSION = 1
+
+class SnapshotError(ValueError):
+    "Raised for invalid snapshots and for reading rows from a snapshot"
+
+class Column(object):
+    def __init__(self, table, name, type_name, length, column_index):
+        self.table = table
+        self.name = name
+        self.type = DataType(None, type_name)
+        self.length = length
+        self.columnIndex = column_index
+
+    def getName(self):
+        return self.name
+
+    def getType(self):
+        return self.type
+
+    def getLength(self):
+        return self.length
+
+    def __repr__(self):
+        return '<Column %s.%s>' % (self.table.name, self.name)
+
+class Table(object):
+    def __init__(self, name, columns, indexes, row_count):
+        self.name = name
+        self.columns = [Column(self, column_name, type_name, length, index)
+                        for index, (column_name, type_name, length)
+                        in enumerate(columns)]
+        self.columns_by_name = dict((column.name, column)
+                                    for column in self.columns)
+        self.indexes = [
+            Index(None, [self.columns_by_name[column_name]
+                         for column_name in column_names],
+                  primary_key, unique)
+            for column_names, primary_key, unique in indexes]
+        self.row_count = row_count
+
+    def getName(self):
+        return self.name
+
+    def getColumns(self):
+        return self.columns
+
+    def getColumn(self, column_name):
+        return self.columns_by_name.get(column_name)
+
+    def getIndexes(self):
+        return self.indexes
+
+    def getRowCount(self):
+        return self.row_count
+
+    def reset(self):
+        pass
+
+    def getNextRow(self):
+        raise SnapshotError('the schema snapshot has no rows for table %s'
+                            % self.name)
+
+    def __repr__(self):
+        return '<Table %s>' % self.name
+
+class CatalogTable(object):
+    "The MSysRelationships system table rebuilt from a snapshot"
+    def __init__(self, rows):
+        self.name = u'MSysRelationships'
+        self.rows = rows
+        self.reset()
+
+    def reset(self):
+        self._rows = iter(self.rows)
+
+    def getNextRow(self):
+        for row in self._rows:
+            return row
+
+class Database(object):
+    def __init__(self, snapshot):
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise SnapshotError('unsupported schema snapshot version %r'
+                                % snapshot.get('version'))
+        self.tables = {}
+        self.table_names = []
+        for table in snapshot['tables']:
+            self.table_names.append(table['name'])
+            self.tables[table['name']] = Table(table['name'],
+                                               table['columns'],
+                                               table['indexes'],
+                                               table['rows'])
+        self.catalog_rows = []
+        self.relationships = defaultdict(list)
+        for number, (from_name, from_columns, to_name, to_columns
+                     ) in enumerate(snapshot['relationships']):
+            name = u'relationship%d' % number
+            relationship = Relationship(self.tables[from_name],
+                                        self.tables[to_name])
+            for icolumn, (from_column, to_column) in enumerate(
+                    zip(from_columns, to_columns)):
+                relationship.fromColumns.append(
+                    relationship.fromTable.getColumn(from_column))
+                relationship.toColumns.append(
+                    relationship.toTable.getColumn(to_column))
+                self.catalog_rows.append(dict(szRelationship=name,
+                                              szReferencedObject=from_name,
+                                              szObject=to_name,
+                                              icolumn=icolumn,
+                                              szReferencedColumn=from_column,
+                                              szColumn=to_column))
+            self.relationships[frozenset([from_name, to_name])].append(
+                relationship)
+
+    @classmethod
+    def open(cls, filepath):
+        snapshot_file = file(filepath)
+        try:
+            return cls(json.load(snapshot_file))
+        finally:
+            snapshot_file.close()
+
+    def close(self):
+        pass
+
+    def getTableNames(self):
+        return list(self.table_names)
+
+    def getTable(self, table_name):
+        return self.tables.get(table_name)
+
+    def getSystemTable(self, table_name):
+        if table_name == 'MSysRelationships':
+            return CatalogTable(self.catalog_rows)
+        return None
+
+    def getRelationships(self, table1, table2):
+        "Return the relationships between two tables in either direction"
+        return list(self.relationships[frozenset([table1.name,
+                                                  table2.name])])
+
+    def createCursor(self, table):
+        raise SnapshotError('the schema snapshot has no rows for table %s'
+                            % table.name)
+
+def snapshot(tables, relationships):
+    """Return the schema of Access tables and relationships as a dict
+
+    `tables` and `relationships` are Jackcess-like ``Table`` and
+    ``Relationship`` objects.
+    """
+    return dict(
+        version=SNAPSHOT_VERSION,
+        tables=[dict(name=unicode(table.name),
+                     rows=int(table.getRowCount()),
+                     columns=[[unicode(column.name),
+                               unicode(column.type.name()),
+                               int(column.length)]
+                              for column in table.getColumns()],
+                     indexes=[[[unicode(column.name)
+                                for column in index.columns],
+                               bool(index.isPrimaryKey()),
+                               bool(index.isUnique())]
+                              for index in table.indexes])
+                for table in tables],
+        relationships=sorted(
+            [unicode(relationship.fromTable.name),
+             [unicode(column.name) for column in relationship.fromColumns],
+             unicode(relationship.toTable.name),
+             [unicode(column.name) for column in relationship.toColumns]]
+            for relationship in relationships))
+
+def save(filepath, tables, relationships):
+    "Write a compact JSON snapshot of tables and relationships to a file"
+    snapshot_file = file(filepath, 'w')
+    try:
+        json.dump(snapshot(tables, relationships), snapshot_file,
+                  separators=(',', ':'), sort_keys=True)
+    finally:
+        snapshot_file.close()